@@ -1,4 +1,5 @@
 import os
+import json
 import h5py
 import numpy as np
 import time
@@ -6,14 +7,33 @@ import torch
 
 from collections import OrderedDict
 from torch.utils.data import Dataset
-from torchvision.transforms import transforms
+
+from imitation_shared.storage import IMAGE_SCALE_ATTR, get_image_scale, read_image_scale, encode_images, decode_images
+from imitation_shared.sampling import read_rows
+from imitation_shared.utils import *
+
+# HDF5 layouts for session files. chunk_rows is the number of samples stored per chunk, compression is
+# None, 'lzf' or 'gzip' (compression_opts is the gzip level) and shuffle enables the byte shuffle filter.
+STORAGE_PROFILES = {
+    'legacy': {'chunk_rows': 1, 'compression': None, 'compression_opts': None, 'shuffle': False},
+    'chunked': {'chunk_rows': 16, 'compression': None, 'compression_opts': None, 'shuffle': False},
+    'lzf': {'chunk_rows': 16, 'compression': 'lzf', 'compression_opts': None, 'shuffle': True},
+    'gzip': {'chunk_rows': 16, 'compression': 'gzip', 'compression_opts': 4, 'shuffle': True},
+}
+
 
 class DataManager:
-    def __init__(self, folder, name):
+    def __init__(self, folder, name, image_dtype=np.float32, storage_profile='chunked'):
         self.folder = folder
         self.name = name
+        self.image_dtype = np.dtype(image_dtype)
+        if isinstance(storage_profile, str):
+            storage_profile = STORAGE_PROFILES[storage_profile]
+        self.storage_profile = {**STORAGE_PROFILES['legacy'], **storage_profile}
         self.file_path = self.get_file_path()
         self.h5file = None
+        self.buffers = {}
+        self.buffered = 0
         self.initialize_folder()
         self.open_file()
 
@@ -30,29 +50,77 @@ class DataManager:
 
     def initialize_datasets(self):
         datasets = {
-            'images': ((0, 88, 200, 3), np.float32),
+            'images': ((0, 88, 200, 3), self.image_dtype),
             'scalars': ((0, 3), np.float32),
             'targets': ((0, 3), np.float32),
             'commands': ((0, 1), np.uint8),
         }
+        profile = self.storage_profile
         for name, (shape, dtype) in datasets.items():
             if name not in self.h5file:
-                self.h5file.create_dataset(name, shape, maxshape=(None, *shape[1:]), dtype=dtype, chunks=(1, *shape[1:]))
+                self.h5file.create_dataset(name, shape, maxshape=(None, *shape[1:]), dtype=dtype,
+                                           chunks=(profile['chunk_rows'], *shape[1:]),
+                                           compression=profile['compression'],
+                                           compression_opts=profile['compression_opts'],
+                                           shuffle=profile['shuffle'])
+            self.buffers[name] = np.empty((profile['chunk_rows'], *shape[1:]), dtype=dtype)
+
+        self.h5file['images'].attrs[IMAGE_SCALE_ATTR] = get_image_scale(self.image_dtype)
 
     def save(self, image, scalars, targets, commands):
-        image = np.array(image, dtype=np.float32)
+        image = encode_images(image, self.image_dtype)
         scalars = np.array(scalars, dtype=np.float32)
         targets = np.array(targets, dtype=np.float32)
         commands = np.array(commands, dtype=np.uint8)
 
+        # samples are held back until a whole chunk is available, so every chunk is written (and compressed)
+        # exactly once instead of being re-read and re-encoded on each append
         try:
             for dataset_name, data in zip(['images', 'scalars', 'targets', 'commands'], [image, scalars, targets, commands]):
-                dataset = self.h5file[dataset_name]
-                dataset.resize(dataset.shape[0] + 1, axis=0)
-                dataset[-1:] = data
+                self.buffers[dataset_name][self.buffered] = data
+            self.buffered += 1
+
+            if self.buffered == self.storage_profile['chunk_rows']:
+                self.flush()
         except Exception as e:
             print(f"An error occurred: {e}")
 
+    def flush(self):
+        if self.h5file is None or self.buffered == 0:
+            return
+
+        for dataset_name, buffer in self.buffers.items():
+            dataset = self.h5file[dataset_name]
+            start = dataset.shape[0]
+            dataset.resize(start + self.buffered, axis=0)
+            dataset[start:] = buffer[:self.buffered]
+
+        self.buffered = 0
+        self.h5file.flush()
+
+    def close(self):
+        if self.h5file is None:
+            return
+
+        self.flush()
+        self.h5file.close()
+        self.h5file = None
+
+
+def to_image_tensors(images, scale):
+    """
+    Converts stored (N, 88, 200, 3) frames to normalized (N, 3, 88, 200) float tensors. Augmentation is
+    applied to whole batches in the training loop, see imitation_shared.augmentation.BatchAugmentation.
+
+    Parameters:
+        images (numpy.ndarray): The stored frames.
+        scale (float): The image scale recorded on the dataset.
+
+    Returns:
+        torch.Tensor: The normalized frames in channels-first layout.
+    """
+    return torch.from_numpy(decode_images(images, scale)).permute(0, 3, 1, 2)
+
 
 class ImitationDataset(Dataset):
     def __init__(self, folder, cache_size=10, include_image=True):
@@ -63,18 +131,6 @@ class ImitationDataset(Dataset):
         self.cache_size = cache_size
         self.include_image = include_image
 
-        self.transforms = transforms.Compose([
-            transforms.ToPILImage(),
-            transforms.Resize((88, 200)),
-            transforms.ColorJitter(0.2, 0.2),
-            transforms.GaussianBlur(3),
-            transforms.ToTensor(),
-            transforms.RandomErasing(0.5, scale=(0.005, 0.01), inplace=True),
-            transforms.RandomErasing(0.5, scale=(0.005, 0.01), inplace=True),
-            transforms.RandomErasing(0.5, scale=(0.005, 0.01), inplace=True),
-            transforms.RandomErasing(0.5, scale=(0.005, 0.01), inplace=True),
-        ])
-
     def get_file_length(self, file_path):
         with h5py.File(file_path, 'r') as file:
             return file['images'].shape[0]
@@ -88,22 +144,23 @@ class ImitationDataset(Dataset):
 
         return file_path.split("/")[-1]
 
-    def __getitem__(self, idx):
-        file_index = np.searchsorted(self.cumulative_lengths, idx, side='right')
-        local_index = idx - (self.cumulative_lengths[file_index - 1] if file_index > 0 else 0)
-        file_path = self.file_paths[file_index]
-
+    def get_file(self, file_path):
         if file_path not in self.file_cache:
             if len(self.file_cache) >= self.cache_size:
                 self.file_cache.popitem(last=False)
             self.file_cache[file_path] = h5py.File(file_path, 'r')
 
-        file = self.file_cache[file_path]
+        return self.file_cache[file_path]
+
+    def __getitem__(self, idx):
+        file_index = np.searchsorted(self.cumulative_lengths, idx, side='right')
+        local_index = idx - (self.cumulative_lengths[file_index - 1] if file_index > 0 else 0)
+        file_path = self.file_paths[file_index]
+
+        file = self.get_file(file_path)
 
         if self.include_image:
-            image = file['images'][local_index]
-            image = np.array(image, dtype=np.float32)
-            image = self.transforms(image)
+            image = to_image_tensors(file['images'][local_index][None], read_image_scale(file['images']))[0]
         else:
             image = None
 
@@ -118,7 +175,199 @@ class ImitationDataset(Dataset):
 
         return image, scalars, targets, commands
 
+    def __getitems__(self, indices):
+        # batched counterpart of __getitem__ used by the DataLoader: indices are grouped by file and every
+        # run of neighbouring rows is read with one slice
+        indices = np.asarray(indices, dtype=np.int64)
+        file_indices = np.searchsorted(self.cumulative_lengths, indices, side='right')
+        local_indices = indices - np.r_[0, self.cumulative_lengths][file_indices]
+
+        images = [None] * len(indices)
+        scalars = np.empty((len(indices), 3), dtype=np.float32)
+        targets = np.empty((len(indices), 3), dtype=np.float32)
+        commands = np.empty((len(indices), 1), dtype=np.uint8)
+
+        for file_index in np.unique(file_indices):
+            positions = np.flatnonzero(file_indices == file_index)
+            rows = local_indices[positions]
+            file = self.get_file(self.file_paths[file_index])
+
+            if self.include_image:
+                block = to_image_tensors(read_rows(file['images'], rows), read_image_scale(file['images']))
+                for position, image in zip(positions, block):
+                    images[position] = image
+
+            scalars[positions] = read_rows(file['scalars'], rows)
+            targets[positions] = read_rows(file['targets'], rows)
+            commands[positions] = read_rows(file['commands'], rows)
+
+        return list(zip(images, scalars, targets, commands))
+
     def __del__(self):
         for file in self.file_cache.values():
             file.close()
         self.file_cache.clear()
+
+
+# Flat training cache: every array of every session is appended to one raw file per array, which is
+# memory mapped by MemmapImitationDataset. Images are always cached as 8-bit pixels.
+CACHE_MANIFEST = 'manifest.json'
+CACHE_ARRAYS = {
+    'images': ((88, 200, 3), np.uint8),
+    'scalars': ((3,), np.float32),
+    'targets': ((3,), np.float32),
+    'commands': ((1,), np.uint8),
+}
+
+
+def load_cache_manifest(cache_folder):
+    try:
+        with open(os.path.join(cache_folder, CACHE_MANIFEST), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def build_cache(folder, cache_folder, block_size=1024):
+    """
+    Consolidates the session files in folder into the flat memmap cache in cache_folder.
+
+    Sessions that are already cached are skipped, so only new session files are appended. If a cached
+    session was modified or removed, the cache is rebuilt from scratch. The manifest is replaced atomically
+    once the arrays have been appended, and bytes left behind by an interrupted build are truncated away
+    on the next run.
+
+    Parameters:
+        folder (str): The folder containing the session .h5 files.
+        cache_folder (str): The folder holding the cache arrays and manifest.
+        block_size (int): The number of samples copied per read.
+
+    Returns:
+        dict: The updated manifest.
+    """
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+
+    file_names = sorted(f for f in os.listdir(folder) if f.endswith('.h5'))
+    mtimes = {f: os.path.getmtime(os.path.join(folder, f)) for f in file_names}
+
+    manifest = load_cache_manifest(cache_folder)
+    if manifest is not None and any(mtimes.get(session['file']) != session['mtime'] for session in manifest['sessions']):
+        print_formatted("Cached sessions changed, rebuilding the training cache", YELLOW)
+        manifest = None
+
+    if manifest is None:
+        manifest = {
+            'length': 0,
+            'arrays': {name: {'shape': list(shape), 'dtype': np.dtype(dtype).str} for name, (shape, dtype) in CACHE_ARRAYS.items()},
+            'sessions': [],
+        }
+
+    cached = {session['file'] for session in manifest['sessions']}
+    new_files = [f for f in file_names if f not in cached]
+
+    array_files = {}
+    for name, (shape, dtype) in CACHE_ARRAYS.items():
+        path = os.path.join(cache_folder, f"{name}.bin")
+        array_files[name] = open(path, 'ab')
+        array_files[name].truncate(manifest['length'] * int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        array_files[name].seek(0, os.SEEK_END)
+
+    try:
+        for file_name in new_files:
+            with h5py.File(os.path.join(folder, file_name), 'r') as file:
+                length = file['images'].shape[0]
+                scale = read_image_scale(file['images'])
+
+                for start in range(0, length, block_size):
+                    for name, (shape, dtype) in CACHE_ARRAYS.items():
+                        block = file[name][start:start + block_size]
+                        if name == 'images':
+                            block = encode_images(decode_images(block, scale), dtype)
+                        array_files[name].write(np.ascontiguousarray(block, dtype=dtype).tobytes())
+
+            manifest['sessions'].append({'file': file_name, 'mtime': mtimes[file_name], 'start': manifest['length'], 'length': length})
+            manifest['length'] += length
+    finally:
+        for array_file in array_files.values():
+            array_file.close()
+
+    temp_path = os.path.join(cache_folder, CACHE_MANIFEST + '.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, os.path.join(cache_folder, CACHE_MANIFEST))
+
+    print_formatted(f"Cached {len(new_files)} new sessions ({manifest['length']} samples in total)", GREEN)
+    return manifest
+
+
+class MemmapImitationDataset(Dataset):
+    """
+    Serves samples from the flat cache written by build_cache. Arrays are memory mapped lazily in each
+    process, so DataLoader workers share the page cache instead of receiving a pickled copy of the data.
+    """
+
+    def __init__(self, cache_folder, include_image=True):
+        self.cache_folder = cache_folder
+        self.manifest = load_cache_manifest(cache_folder)
+        if self.manifest is None:
+            raise FileNotFoundError(f"No training cache found in {cache_folder}, run 'python preprocess.py build-cache'")
+
+        self.include_image = include_image
+        self.arrays = None
+        self.file_paths = [session['file'] for session in self.manifest['sessions']]
+        self.cumulative_lengths = np.cumsum([session['length'] for session in self.manifest['sessions']])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['arrays'] = None
+        return state
+
+    def get_arrays(self):
+        if self.arrays is None:
+            self.arrays = {}
+            for name, spec in self.manifest['arrays'].items():
+                path = os.path.join(self.cache_folder, f"{name}.bin")
+                shape = (self.manifest['length'], *spec['shape'])
+                # Copy-on-write keeps the rows writable, so that collate can wrap them in tensors without a
+                # warning, while the file is never written and the pages stay shared until then
+                self.arrays[name] = np.memmap(path, dtype=np.dtype(spec['dtype']), mode='c', shape=shape)
+
+        return self.arrays
+
+    @property
+    def commands(self):
+        return self.get_arrays()['commands']
+
+    def __len__(self):
+        return self.manifest['length']
+
+    def get_file_for_index(self, idx):
+        file_index = np.searchsorted(self.cumulative_lengths, idx, side='right')
+        return self.file_paths[file_index]
+
+    def __getitem__(self, idx):
+        arrays = self.get_arrays()
+
+        if self.include_image:
+            image = to_image_tensors(arrays['images'][idx][None], get_image_scale(np.uint8))[0]
+        else:
+            image = None
+
+        # The rows are views of the memory map, collate copies them once into the batch
+        scalars = arrays['scalars'][idx]
+        targets = arrays['targets'][idx]
+        commands = arrays['commands'][idx]
+
+        return image, scalars, targets, commands
+
+    def __getitems__(self, indices):
+        arrays = self.get_arrays()
+        indices = np.asarray(indices, dtype=np.int64)
+
+        if self.include_image:
+            images = list(to_image_tensors(arrays['images'][indices], get_image_scale(np.uint8)))
+        else:
+            images = [None] * len(indices)
+
+        return list(zip(images, arrays['scalars'][indices], arrays['targets'][indices], arrays['commands'][indices]))
@@ -0,0 +1,48 @@
+import argparse
+
+from model import *
+from imitation_shared.benchmark import measure_latency
+
+"""
+Model export
+
+Exports the trained model as a frozen, eval-mode TorchScript artifact with BatchNorm folded into the
+convolutions, which load_inference_model (and therefore the autopilot) picks up. Afterwards the per-frame
+CPU latency of the eager and the exported model is measured and reported.
+
+Usage:
+    python export.py --iterations 100
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports the model for inference and benchmarks it")
+    parser.add_argument('--folder', type=str, default='data/model', help="Model folder. Default is data/model.")
+    parser.add_argument('--name', type=str, default='model_state_dict', help="Model name. Default is model_state_dict.")
+    parser.add_argument('--iterations', type=int, default=100, help="Timed forward passes per model.")
+    args = parser.parse_args()
+
+    print_game_letterhead("Model Export")
+    print_args(args)
+
+    model = load_model(args.folder, args.name)
+    model.eval()
+
+    export_model(args.folder, model, args.name)
+    exported = load_inference_model(args.folder, args.name)
+
+    inputs = (torch.rand(1, 3, 88, 200), torch.rand(1, 3), torch.tensor([[1]], dtype=torch.uint8))
+
+    with torch.no_grad():
+        difference = (model(*inputs) - exported(*inputs)).abs().max().item()
+    print_formatted(f"Max output difference: {difference:.3e}")
+
+    eager_ms = measure_latency(model, inputs, args.iterations)
+    exported_ms = measure_latency(exported, inputs, args.iterations)
+
+    print_formatted(f"Eager:    {eager_ms:8.2f} ms/frame")
+    print_formatted(f"Exported: {exported_ms:8.2f} ms/frame ({eager_ms / exported_ms:.2f}x)", GREEN)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import time
+import threading
+import torch
+
+
+def predict(model, image, scalars, command):
+    """
+    Runs the model on a single camera frame.
+
+    Parameters:
+        model (torch.nn.Module): The driving model.
+        image (numpy.ndarray): The (88, 200, 3) float camera frame.
+        scalars (list): The scalar inputs of the model.
+        command (int): The navigation command.
+
+    Returns:
+        tuple: The predicted (steer, throttle, brake).
+    """
+    image = image.transpose((2, 0, 1))
+    image = torch.from_numpy(image).float().unsqueeze(0)
+    scalars = torch.tensor(scalars, dtype=torch.float32).unsqueeze(0)
+    command = torch.tensor([command], dtype=torch.uint8).unsqueeze(0)
+
+    with torch.no_grad():
+        output = model(image, scalars, command)
+
+    return tuple(output.squeeze().tolist())
+
+
+class InferenceWorker:
+    """
+    Runs the driving model on a background thread so the simulator loop never waits for a forward pass.
+
+    The control loop submits its latest inputs with submit() and reads the most recent prediction with
+    get_control(). Inputs submitted while the model is busy replace each other, so the worker always
+    starts on the newest frame and the returned age is the time since the frame behind the prediction
+    was submitted. The returned timestamp identifies the prediction, it only changes with a new one.
+
+    An exception raised by the model stops the worker and is raised again by the next submit() or
+    get_control() on the control loop, like a failing synchronous prediction would.
+
+    Attributes:
+        model (torch.nn.Module): The driving model.
+        max_age (float): Age in seconds after which a prediction counts as stale.
+    """
+
+    def __init__(self, model, max_age=0.2):
+        self.model = model
+        self.max_age = max_age
+
+        self._condition = threading.Condition()
+        self._pending = None
+        self._control = None
+        self._timestamp = None
+        self._error = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, image, scalars, command):
+        """
+        Hands the latest model inputs to the worker without blocking.
+
+        Parameters:
+            image (numpy.ndarray): The (88, 200, 3) float camera frame.
+            scalars (list): The scalar inputs of the model.
+            command (int): The navigation command.
+        """
+        with self._condition:
+            self._raise_error()
+            self._pending = (image, scalars, command, time.monotonic())
+            self._condition.notify()
+
+    def get_control(self):
+        """
+        Returns the most recent prediction, its age and the time its frame was submitted.
+
+        Returns:
+            tuple: ((steer, throttle, brake), age in seconds, timestamp), or (None, inf, None) before the
+                first prediction.
+
+        Raises:
+            Exception: The exception of the model if a prediction failed.
+        """
+        with self._condition:
+            self._raise_error()
+            if self._control is None:
+                return None, float('inf'), None
+            return self._control, time.monotonic() - self._timestamp, self._timestamp
+
+    def is_stale(self, age):
+        return age > self.max_age
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                image, scalars, command, timestamp = self._pending
+                self._pending = None
+
+            try:
+                control = predict(self.model, image, scalars, command)
+            except Exception as e:
+                with self._condition:
+                    self._error = e
+                    self._running = False
+                return
+
+            with self._condition:
+                self._control = control
+                self._timestamp = timestamp
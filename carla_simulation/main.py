@@ -2,13 +2,15 @@ import pygame
 import carla
 import queue
 import threading
+import numpy as np
 
 from imitation_shared.input import InputManager
 from imitation_shared.utils import *
 
 from scene import CarlaScene, CarlaCamera
 from data import DataManager
-from model import load_model
+from model import load_inference_model
+from inference import InferenceWorker
 
 from agents.navigation.local_planner import LocalPlanner, RoadOption
 from agents.navigation.global_route_planner import GlobalRoutePlanner
@@ -29,7 +31,11 @@ input_manager = InputManager()
 save_queue = queue.Queue()
 
 # Load the model (or an empty model if it doesn't exist)
-model = load_model("data/model", "model_state_dict")
+model = load_inference_model("data/model", "model_state_dict")
+
+# The autopilot runs the model on a background thread so the tick loop never waits for a forward pass
+inference_worker = InferenceWorker(model)
+inference_worker.start()
 
 # Add a car to the scene
 vehicle = scene.add_car()
@@ -73,7 +79,7 @@ navigate = False
 change_weather = False
 
 def save_data_thread():
-    data_manager = DataManager("data/training", "training_data")
+    data_manager = DataManager("data/training", "training_data", image_dtype=np.uint8)
 
     while True:
         screenshot, scalars, targets, command = save_queue.get()
@@ -81,6 +87,8 @@ def save_data_thread():
             break
         data_manager.save(screenshot, scalars, targets, command)
 
+    data_manager.close()
+
 
 save_thread = threading.Thread(target=save_data_thread)
 save_thread.start()
@@ -206,7 +214,8 @@ try:
                     save_queue.put((right_image, scalars, [steer - steer_offset, throttle, brake], command))
         elif autopilot:
             distance_traveled += vehicle.get_velocity() / 3600.0 / 30.0
-            steer, throttle, brake = vehicle.get_autopilot_control(model, scalars, forward_camera.get_image_float(), command)
+            inference_worker.submit(forward_camera.get_image_float(), scalars, command)
+            steer, throttle, brake = vehicle.get_async_autopilot_control(inference_worker)
 
         if logitech_detected:
             if autopilot and not collecting:
@@ -248,6 +257,7 @@ finally:
     print_formatted("Exiting...", RED)
     save_queue.put((None, None, None, None))
     save_thread.join()
+    inference_worker.stop()
     print_formatted("Save thread joined, exiting...", RED)
     scene.cleanup()
     if logitech_detected:
@@ -83,13 +83,38 @@ class CNNModel(nn.Module):
         emb = torch.cat([x_img, scalar], dim=1)
         emb = self.emb_fc(emb)
 
-        output_list = []
-        for i in range(emb.shape[0]):  # Iterate over batch size
-            branch_output = self.branches[command[i]](emb[i])
-            output_list.append(branch_output.unsqueeze(0))
+        output = self.forward_branches(emb)
 
-        output = torch.cat(output_list, dim=0)
-        return output
+        # pick the output of the branch selected by each sample's command
+        command = command.reshape(-1).long()
+        return output[command, torch.arange(emb.shape[0], device=emb.device)]
+
+    def forward_branches(self, emb):
+        """
+        Evaluates every branch on the whole batch. The layers at the same depth of each branch are stacked,
+        so each linear layer runs as a single batched matmul for all branches.
+
+        Parameters:
+            emb (torch.Tensor): The (batch, 512) embedding.
+
+        Returns:
+            torch.Tensor: A (branches, batch, 3) tensor with the output of every branch.
+        """
+        x = emb.unsqueeze(0).expand(len(self.branches), -1, -1)
+
+        for layers in zip(*self.branches):
+            if isinstance(layers[0], nn.Linear):
+                weight = torch.stack([layer.weight for layer in layers])
+                bias = torch.stack([layer.bias for layer in layers])
+                x = torch.baddbmm(bias.unsqueeze(1), x, weight.transpose(1, 2))
+            elif isinstance(layers[0], (nn.Dropout, nn.ReLU)):
+                # dropout and activations are elementwise, so one module applies to all branches
+                x = layers[0](x)
+            else:
+                # layers without stackable weights (e.g. quantized linear layers) run branch by branch
+                x = torch.stack([layer(branch_x) for layer, branch_x in zip(layers, x)])
+
+        return x
 
 
 def save_model(folder, model, name):
@@ -108,19 +133,24 @@ def save_model(folder, model, name):
     print_formatted(f"Model saved to {folder}/{name}.pth", GREEN)
 
 
-def load_model(folder, name):
+def load_model(folder, name, quantized=False):
     """
     Loads the model from the specified folder with the specified name.
 
     Parameters:
         folder (str): The folder from which to load the model.
         name (str): The name of the model file to load.
+        quantized (bool): Whether to load the int8 model written by quantize.py ({name}_int8.pth) instead.
 
     Returns:
         torch.nn.Module: The loaded model.
     """
     model = CNNModel()
 
+    if quantized:
+        model = quantize_model(model)
+        name = f"{name}_int8"
+
     try:
         model.load_state_dict(torch.load(os.path.join(folder, f"{name}.pth")))
         print_formatted(f"Model loaded from {folder}/{name}.pth", GREEN)
@@ -128,3 +158,78 @@ def load_model(folder, name):
         print_formatted(f"Existing model not found", RED)
 
     return model
+
+
+def quantize_model(model):
+    """
+    Returns an int8 copy of the model for CPU inference. The weights of every linear layer are quantized
+    ahead of time and their activations are quantized dynamically per batch, while the convolutions stay
+    in float.
+
+    Parameters:
+        model (torch.nn.Module): The float model.
+
+    Returns:
+        torch.nn.Module: The quantized model, in eval mode.
+    """
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def export_model(folder, model, name):
+    """
+    Exports the model as an inference artifact: the model is put in eval mode, traced to TorchScript and
+    frozen, which inlines the weights and folds every BatchNorm into the preceding convolution.
+
+    Parameters:
+        folder (str): The folder in which to save the artifact.
+        model (torch.nn.Module): The model to export.
+        name (str): The name to use for the artifact file.
+
+    Returns:
+        torch.jit.ScriptModule: The exported model.
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    example_inputs = (torch.zeros(1, 3, 88, 200), torch.zeros(1, 3), torch.zeros(1, 1, dtype=torch.uint8))
+
+    model.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_inputs)
+        exported = torch.jit.freeze(traced)
+
+    torch.jit.save(exported, os.path.join(folder, f"{name}.pt"))
+    print_formatted(f"Model exported to {folder}/{name}.pt", GREEN)
+
+    return exported
+
+
+def load_inference_model(folder, name):
+    """
+    Loads the model for inference. The exported TorchScript artifact is used when it is at least as new as
+    the state dictionary, otherwise the eager model is loaded and put in eval mode. The optimizations that
+    depend on the local CPU (e.g. oneDNN convolution layouts) cannot be serialized, so they are applied here.
+
+    Parameters:
+        folder (str): The folder from which to load the model.
+        name (str): The name of the model files to load.
+
+    Returns:
+        torch.nn.Module: The model, ready for inference.
+    """
+    artifact_path = os.path.join(folder, f"{name}.pt")
+    state_dict_path = os.path.join(folder, f"{name}.pth")
+
+    if os.path.exists(artifact_path):
+        if not os.path.exists(state_dict_path) or os.path.getmtime(artifact_path) >= os.path.getmtime(state_dict_path):
+            model = torch.jit.optimize_for_inference(torch.jit.load(artifact_path))
+            print_formatted(f"Exported model loaded from {folder}/{name}.pt", GREEN)
+            return model
+
+        print_formatted(f"Exported model is older than {folder}/{name}.pth, run export.py again", YELLOW)
+
+    model = load_model(folder, name)
+    model.eval()
+
+    return model
@@ -0,0 +1,89 @@
+import time
+import argparse
+
+from model import *
+
+"""
+Branch dispatch benchmark
+
+Compares CNNModel.forward, which evaluates the command branches as batched matmuls, with the previous
+per-sample loop over the branches. Reports the largest output difference and the forward and
+forward/backward time of both on the CPU.
+
+Usage:
+    python model_benchmark.py --batch-size 120 --iterations 20
+"""
+
+
+def legacy_forward(model, x_img, scalar, command):
+    """
+    The per-sample branch dispatch CNNModel.forward used before the branches were batched.
+    """
+    x_img = model.conv_blocks(x_img)
+    x_img = model.img_fc(x_img)
+
+    scalar = scalar[:, 0].unsqueeze(1)
+    scalar = model.scalar_fc(scalar)
+
+    emb = torch.cat([x_img, scalar], dim=1)
+    emb = model.emb_fc(emb)
+
+    output_list = []
+    for i in range(emb.shape[0]):
+        branch_output = model.branches[command[i]](emb[i])
+        output_list.append(branch_output.unsqueeze(0))
+
+    return torch.cat(output_list, dim=0)
+
+
+def time_call(function, iterations, backward):
+    for _ in range(2):
+        output = function()
+        if backward:
+            output.sum().backward()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        output = function()
+        if backward:
+            output.sum().backward()
+
+    return (time.perf_counter() - start) / iterations * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the CNNModel branch dispatch on the CPU")
+    parser.add_argument('--batch-size', type=int, default=120, help="Batch size. Default is 120.")
+    parser.add_argument('--iterations', type=int, default=20, help="Timed iterations per measurement.")
+    args = parser.parse_args()
+
+    print_game_letterhead("Branch Dispatch Benchmark")
+    print_args(args)
+
+    torch.manual_seed(0)
+    model = CNNModel()
+
+    x_img = torch.rand(args.batch_size, 3, 88, 200)
+    scalar = torch.rand(args.batch_size, 3)
+    command = torch.randint(0, 3, (args.batch_size, 1), dtype=torch.uint8)
+
+    model.eval()
+    with torch.no_grad():
+        difference = (model(x_img, scalar, command) - legacy_forward(model, x_img, scalar, command)).abs().max()
+    print_formatted(f"Max output difference: {difference.item():.3e}")
+
+    implementations = {
+        'loop': lambda: legacy_forward(model, x_img, scalar, command),
+        'batched': lambda: model(x_img, scalar, command),
+    }
+
+    model.train()
+    for name, function in implementations.items():
+        with torch.no_grad():
+            forward_ms = time_call(function, args.iterations, backward=False)
+        backward_ms = time_call(function, args.iterations, backward=True)
+        print_formatted(f"{name:<8} forward: {forward_ms:8.2f} ms   forward/backward: {backward_ms:8.2f} ms", GREEN)
+
+
+if __name__ == '__main__':
+    main()
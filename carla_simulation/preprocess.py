@@ -1,39 +1,105 @@
+import os
+import json
+import h5py
+import argparse
 import numpy as np
-from data import ImitationDataset
+from data import MemmapImitationDataset, CACHE_MANIFEST, build_cache
 
+# Per-folder cache of the concatenated commands, keyed by the session files and their modification times
+COMMANDS_CACHE = 'commands_cache.npz'
 
-def get_balanced_commands(dataset_name):
-    dataset = ImitationDataset(dataset_name, include_image=False)
 
-    left_indices = []
-    center_indices = []
-    right_indices = []
+def read_commands(dataset_name):
+    """
+    Returns the command of every sample in dataset index order. Each session's commands dataset is read in
+    one bulk read, and the result is cached in the folder until a session file is added, removed or modified.
 
-    for i in range(len(dataset)):
-        _, _, _, command = dataset[i]
-        command = command.item()
-        if command == 0:
-            left_indices.append(i)
-        elif command == 1:
-            center_indices.append(i)
-        elif command == 2:
-            right_indices.append(i)
+    Parameters:
+        dataset_name (str): A folder of session .h5 files or a training cache folder.
 
-    minimum = min(len(left_indices), len(center_indices), len(right_indices))
+    Returns:
+        numpy.ndarray: The uint8 command of every sample.
+    """
+    if os.path.exists(os.path.join(dataset_name, CACHE_MANIFEST)):
+        return np.asarray(MemmapImitationDataset(dataset_name, include_image=False).commands).reshape(-1)
 
-    np.random.shuffle(left_indices)
-    np.random.shuffle(center_indices)
-    np.random.shuffle(right_indices)
+    file_paths = sorted([os.path.join(dataset_name, f) for f in os.listdir(dataset_name) if f.endswith('.h5')])
+    key = json.dumps([[os.path.basename(f), os.path.getmtime(f), os.path.getsize(f)] for f in file_paths])
+    cache_path = os.path.join(dataset_name, COMMANDS_CACHE)
 
-    left_indices = left_indices[:minimum]
-    center_indices = center_indices[:minimum]
-    right_indices = right_indices[:minimum]
+    try:
+        with np.load(cache_path) as cache:
+            if str(cache['key']) == key:
+                return cache['commands']
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
 
-    indices = left_indices + center_indices + right_indices
+    commands = []
+    for file_path in file_paths:
+        with h5py.File(file_path, 'r') as file:
+            commands.append(file['commands'][:file['images'].shape[0]].reshape(-1))
+    commands = np.concatenate(commands) if commands else np.empty(0, dtype=np.uint8)
 
-    return indices
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, key=np.array(key), commands=commands)
+    os.replace(temp_path, cache_path)
+
+    return commands
+
+
+def get_balanced_commands(dataset_name, seed=None):
+    """
+    Returns an index subset with the same number of left, center and right command samples.
+
+    Parameters:
+        dataset_name (str): A folder of session .h5 files or a training cache folder.
+        seed (int or None): Seed for choosing the subset. None picks a different subset on every call.
+
+    Returns:
+        numpy.ndarray: The left, center and right indices, each group in random order.
+    """
+    commands = read_commands(dataset_name)
+    return balance_indices(commands, np.arange(len(commands)), seed)
+
+
+def balance_indices(commands, indices, seed=None):
+    """
+    Returns the subset of indices with the same number of left, center and right command samples.
+
+    Parameters:
+        commands (numpy.ndarray): The command of every sample in dataset index order.
+        indices (numpy.ndarray): The indices to choose from.
+        seed (int or None): Seed for choosing the subset. None picks a different subset on every call.
+
+    Returns:
+        numpy.ndarray: The left, center and right indices, each group in random order.
+    """
+    rng = np.random.default_rng(seed)
+    commands = np.asarray(commands).reshape(-1)
+
+    groups = [indices[commands[indices] == command] for command in range(3)]
+    minimum = min(len(group) for group in groups)
+
+    return np.concatenate([rng.permutation(group)[:minimum] for group in groups])
 
 
 if __name__ == "__main__":
-    indices = get_balanced_commands("data/training")
-    print(len(indices))
+    parser = argparse.ArgumentParser(description="CARLA training data preprocessing")
+    subparsers = parser.add_subparsers(dest='command')
+
+    balance_parser = subparsers.add_parser('balance', help="Print the size of the command-balanced subset (default).")
+    balance_parser.add_argument('folder', type=str, nargs='?', default='data/training')
+    balance_parser.add_argument('--seed', type=int, default=None, help="Seed for a reproducible subset.")
+
+    cache_parser = subparsers.add_parser('build-cache', help="Consolidate the sessions into the flat memmap training cache.")
+    cache_parser.add_argument('folder', type=str, nargs='?', default='data/training')
+    cache_parser.add_argument('cache_folder', type=str, nargs='?', default='data/cache')
+
+    args = parser.parse_args()
+
+    if args.command == 'build-cache':
+        build_cache(args.folder, args.cache_folder)
+    else:
+        indices = get_balanced_commands(getattr(args, 'folder', 'data/training'), getattr(args, 'seed', None))
+        print(len(indices))
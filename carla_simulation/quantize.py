@@ -0,0 +1,71 @@
+import argparse
+import numpy as np
+
+from torch.utils.data import DataLoader, Subset
+
+from model import *
+from imitation_shared.benchmark import measure_latency
+from data import ImitationDataset
+
+"""
+Post-training int8 quantization
+
+Quantizes the linear layers of the trained model to int8 and writes <name>_int8.pth, which
+load_model(..., quantized=True) loads. A sample of the training data is run through both models to report
+the steer/throttle/brake MSE of the int8 model against the float model, together with the per-frame CPU
+latency of both.
+
+Usage:
+    python quantize.py --samples 1024
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantizes the model to int8 and compares it with the float model")
+    parser.add_argument('--folder', type=str, default='data/model', help="Model folder. Default is data/model.")
+    parser.add_argument('--name', type=str, default='model_state_dict', help="Model name. Default is model_state_dict.")
+    parser.add_argument('--data', type=str, default='data/training', help="Session folder to sample from.")
+    parser.add_argument('--samples', type=int, default=1024, help="Number of samples used for the comparison.")
+    parser.add_argument('--iterations', type=int, default=100, help="Timed forward passes per model.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for choosing the samples.")
+    args = parser.parse_args()
+
+    print_game_letterhead("Model Quantization")
+    print_args(args)
+
+    model = load_model(args.folder, args.name)
+    model.eval()
+
+    quantized = quantize_model(load_model(args.folder, args.name))
+    save_model(args.folder, quantized, f"{args.name}_int8")
+
+    dataset = ImitationDataset(args.data)
+
+    if len(dataset) == 0:
+        print_formatted("No data found in the training folder", RED)
+        return
+
+    rng = np.random.default_rng(args.seed)
+    indices = rng.choice(len(dataset), min(args.samples, len(dataset)), replace=False)
+    dataloader = DataLoader(Subset(dataset, np.sort(indices)), batch_size=32)
+
+    squared_error = torch.zeros(3)
+    with torch.no_grad():
+        for images, scalars, targets, commands in dataloader:
+            squared_error += ((quantized(images, scalars, commands) - model(images, scalars, commands)) ** 2).sum(dim=0)
+    mse = squared_error / len(indices)
+
+    print_formatted(f"int8 vs float MSE ({len(indices)} samples) - Steer: {mse[0]:.2e} - Throttle: {mse[1]:.2e} - "
+                    f"Brake: {mse[2]:.2e}")
+
+    inputs = (torch.rand(1, 3, 88, 200), torch.rand(1, 3), torch.tensor([[1]], dtype=torch.uint8))
+
+    float_ms = measure_latency(model, inputs, args.iterations)
+    quantized_ms = measure_latency(quantized, inputs, args.iterations)
+
+    print_formatted(f"Float: {float_ms:8.2f} ms/frame")
+    print_formatted(f"Int8:  {quantized_ms:8.2f} ms/frame ({float_ms / quantized_ms:.2f}x)", GREEN)
+
+
+if __name__ == '__main__':
+    main()
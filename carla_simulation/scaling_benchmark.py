@@ -0,0 +1,107 @@
+import os
+import time
+import argparse
+
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+
+from model import *
+
+"""
+Data-parallel scaling benchmark
+
+Trains CNNModel on synthetic batches with 1 to N DistributedDataParallel processes on the gloo backend, the
+setup 'torchrun --nproc_per_node N train.py' uses, and reports the throughput of each process count and its
+scaling efficiency, the throughput relative to N times the single-process throughput. Each process uses an
+equal share of the cores.
+
+Usage:
+    python scaling_benchmark.py --processes 1 2 4 8 --batch-size 120 --iterations 10
+"""
+
+
+def worker(rank, world_size, batch_size, iterations, port, results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group(backend='gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+
+    torch.manual_seed(0)
+    model = DistributedDataParallel(CNNModel())
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.0004)
+    criterion = nn.MSELoss()
+
+    x_img = torch.rand(batch_size, 3, 88, 200)
+    scalar = torch.rand(batch_size, 3)
+    command = torch.randint(0, 3, (batch_size, 1), dtype=torch.uint8)
+    target = torch.rand(batch_size, 3)
+
+    def step():
+        optimizer.zero_grad(set_to_none=True)
+        criterion(model(x_img, scalar, command), target).backward()
+        optimizer.step()
+
+    for _ in range(2):
+        step()
+
+    dist.barrier()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        step()
+    dist.barrier()
+    elapsed = time.perf_counter() - start
+
+    if rank == 0:
+        results.put(world_size * batch_size * iterations / elapsed)
+
+    dist.destroy_process_group()
+
+
+def measure(world_size, batch_size, iterations, port):
+    """
+    Runs the benchmark with the given number of processes.
+
+    Parameters:
+        world_size (int): The number of processes.
+        batch_size (int): The batch size of each process.
+        iterations (int): The number of timed training steps.
+        port (int): The port of the process group rendezvous.
+
+    Returns:
+        float: The training throughput of all processes in samples per second.
+    """
+    context = mp.get_context('spawn')
+    results = context.SimpleQueue()
+    mp.start_processes(worker, args=(world_size, batch_size, iterations, port, results), nprocs=world_size,
+                       start_method='spawn')
+    return results.get()
+
+
+def main():
+    default_processes = [n for n in [1, 2, 4, 8, 16, 32, 64] if n <= (os.cpu_count() or 1)]
+
+    parser = argparse.ArgumentParser(description="Benchmarks data-parallel training across CPU processes")
+    parser.add_argument('--processes', type=int, nargs='+', default=default_processes,
+                        help="Process counts to measure. Default is powers of two up to the core count.")
+    parser.add_argument('--batch-size', type=int, default=120, help="Batch size per process. Default is 120.")
+    parser.add_argument('--iterations', type=int, default=10, help="Timed training steps per process count.")
+    parser.add_argument('--port', type=int, default=29531, help="Port for the process group rendezvous.")
+    args = parser.parse_args()
+
+    print_game_letterhead("Data-Parallel Scaling Benchmark")
+    print_args(args)
+
+    baseline = None
+    print_formatted(f"{'processes':<11}{'samples/s':>12}{'speedup':>10}{'efficiency':>12}")
+    for world_size in sorted(args.processes):
+        throughput = measure(world_size, args.batch_size, args.iterations, args.port)
+        if baseline is None:
+            baseline = throughput / world_size
+
+        speedup = throughput / baseline
+        print_formatted(f"{world_size:<11}{throughput:>12.1f}{speedup:>10.2f}{speedup / world_size:>12.0%}", GREEN)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,8 @@ import random
 import pygame
 import queue
 import numpy as np
-import torch
+
+from inference import predict
 
 class CarlaScene:
     def __init__(self, town='Town10HD', weather=carla.WeatherParameters.ClearNoon):
@@ -180,11 +181,17 @@ class CarlaCamera:
 
 
 class CarlaVehicle:
+    # brake applied when the asynchronous prediction is far too old to follow
+    STALE_STOP_FACTOR = 5.0
+    STALE_BRAKE = 0.5
+
     def __init__(self, vehicle, spawn_point=None):
         self.object = vehicle
 
         self._last_steer = 0.0
         self._last_throttle = 0.0
+        self._last_brake = 0.0
+        self._last_timestamp = None
         self._spawn_point = spawn_point
 
     def get_spawn_point(self):
@@ -210,22 +217,47 @@ class CarlaVehicle:
 
     def get_autopilot_control(self, model, scalars, image, command):
         if model:
-            image = image.transpose((2, 0, 1))
-            image = torch.from_numpy(image).float().unsqueeze(0)
-            scalars = torch.tensor(scalars, dtype=torch.float32).unsqueeze(0)
-            command = torch.tensor([command], dtype=torch.uint8).unsqueeze(0)
+            steer, throttle, brake = predict(model, image, scalars, command)
+            return self.smooth_control(steer, throttle, brake)
+
+    def get_async_autopilot_control(self, worker):
+        """
+        Returns the latest prediction of an InferenceWorker without waiting for the model.
+
+        A prediction is smoothed once, when it arrives. Until the worker has a newer one the last smoothed
+        control is repeated, so the smoothing follows the model rate and not the simulator rate.
+
+        Stale predictions are not trusted for throttle: while the latest prediction is older than the
+        worker's max_age the car holds its last steering and coasts, and if it is older than
+        STALE_STOP_FACTOR times max_age (or there is none yet) the car also brakes.
+        """
+        control, age, timestamp = worker.get_control()
+
+        if control is None or age > worker.max_age * self.STALE_STOP_FACTOR:
+            self._last_throttle = 0.0
+            return self._last_steer, 0.0, self.STALE_BRAKE
+        if worker.is_stale(age):
+            self._last_throttle = 0.0
+            return self._last_steer, 0.0, 0.0
+
+        if timestamp != self._last_timestamp:
+            self._last_timestamp = timestamp
+            self._last_brake = control[2]
+            return self.smooth_control(*control)
+
+        return self.limit_control(self._last_steer, self._last_throttle, self._last_brake)
 
-            with torch.no_grad():
-                output = model(image, scalars, command)
-                steer, throttle, brake = tuple(output.squeeze().tolist())
+    def smooth_control(self, steer, throttle, brake):
+        steer = self._last_steer + (steer - self._last_steer) * 0.10
+        throttle = self._last_throttle + (throttle - self._last_throttle) * 0.25
 
-            steer = self._last_steer + (steer - self._last_steer) * 0.10
-            throttle = self._last_throttle + (throttle - self._last_throttle) * 0.25
+        self._last_steer = steer
+        self._last_throttle = throttle
 
-            self._last_steer = steer
-            self._last_throttle = throttle
+        return self.limit_control(steer, throttle, brake)
 
-            if self.get_velocity() >= 20.0:
-                throttle = 0.0
+    def limit_control(self, steer, throttle, brake):
+        if self.get_velocity() >= 20.0:
+            throttle = 0.0
 
-            return steer, throttle, brake
+        return steer, throttle, brake
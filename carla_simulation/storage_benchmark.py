@@ -0,0 +1,104 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import h5py
+import numpy as np
+
+from imitation_shared.utils import *
+from data import DataManager, STORAGE_PROFILES
+
+"""
+Storage profile benchmark
+
+Writes synthetic camera frames through DataManager with every profile in STORAGE_PROFILES and reports
+write throughput, file size and random-read latency for each of them.
+
+Usage:
+    python storage_benchmark.py --frames 2000 --reads 500 --image-dtype uint8
+"""
+
+
+def synthetic_frames(count, seed=0):
+    """
+    Generates frames that compress roughly like camera images: a smooth sky/road gradient that drifts
+    between frames, with a small amount of sensor noise.
+
+    Parameters:
+        count (int): The number of frames to generate.
+        seed (int): The seed for the noise generator.
+
+    Returns:
+        numpy.ndarray: A (count, 88, 200, 3) float32 array of frames in [0, 1].
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.linspace(0.0, 1.0, 88, dtype=np.float32)[:, None, None]
+    cols = np.linspace(0.0, 1.0, 200, dtype=np.float32)[None, :, None]
+    tint = np.array([0.9, 0.8, 0.7], dtype=np.float32)
+
+    frames = np.empty((count, 88, 200, 3), dtype=np.float32)
+    for i in range(count):
+        phase = i / 50.0
+        base = 0.5 + 0.4 * np.sin(3.0 * rows + phase) * np.cos(2.0 * cols - phase)
+        frames[i] = np.clip(base * tint + rng.normal(0.0, 0.01, (88, 200, 3)), 0.0, 1.0)
+
+    return frames
+
+
+def benchmark_profile(profile_name, frames, reads, image_dtype, seed=0):
+    folder = tempfile.mkdtemp(prefix=f"storage_{profile_name}_")
+
+    try:
+        manager = DataManager(folder, "benchmark", image_dtype=image_dtype, storage_profile=profile_name)
+
+        start = time.perf_counter()
+        for i, frame in enumerate(frames):
+            manager.save(frame, [0.1, 0.2, 0.3], [0.0, 0.5, 0.0], [i % 3])
+        manager.close()
+        write_time = time.perf_counter() - start
+
+        file_size = os.path.getsize(manager.file_path)
+
+        indices = np.random.default_rng(seed).integers(0, len(frames), reads)
+        latencies = np.empty(reads)
+        with h5py.File(manager.file_path, 'r') as file:
+            images = file['images']
+            for i, index in enumerate(indices):
+                start = time.perf_counter()
+                images[index]
+                latencies[i] = time.perf_counter() - start
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return {
+        'frames_per_second': len(frames) / write_time,
+        'megabytes': file_size / 2 ** 20,
+        'read_mean_ms': latencies.mean() * 1000.0,
+        'read_p95_ms': np.percentile(latencies, 95) * 1000.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the HDF5 storage profiles used by DataManager")
+    parser.add_argument('--frames', type=int, default=2000, help="Number of frames written per profile.")
+    parser.add_argument('--reads', type=int, default=500, help="Number of random single-frame reads per profile.")
+    parser.add_argument('--image-dtype', type=str, default='uint8', choices=['uint8', 'float32'],
+                        help="Image layout to benchmark. Default is uint8.")
+    args = parser.parse_args()
+
+    print_game_letterhead("Storage Profile Benchmark")
+    print_args(args)
+
+    frames = synthetic_frames(args.frames)
+
+    print_formatted(f"{'profile':<10}{'write (frames/s)':>18}{'size (MB)':>12}{'read mean (ms)':>16}{'read p95 (ms)':>15}")
+    for profile_name in STORAGE_PROFILES:
+        result = benchmark_profile(profile_name, frames, args.reads, np.dtype(args.image_dtype))
+        print_formatted(f"{profile_name:<10}{result['frames_per_second']:>18.1f}{result['megabytes']:>12.1f}"
+                        f"{result['read_mean_ms']:>16.3f}{result['read_p95_ms']:>15.3f}", GREEN)
+
+
+if __name__ == '__main__':
+    main()
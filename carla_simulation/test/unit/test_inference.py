@@ -0,0 +1,68 @@
+import time
+import unittest
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from inference import InferenceWorker
+
+
+class ConstantModel(nn.Module):
+    def forward(self, image, scalars, command):
+        return torch.tensor([[0.1, 0.5, 0.0]])
+
+
+class FailingModel(nn.Module):
+    def forward(self, image, scalars, command):
+        raise ValueError("bad input")
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+
+
+def submit_frame(worker):
+    worker.submit(np.zeros((88, 200, 3), dtype=np.float32), [0.0], 0)
+
+
+class UnitTestInferenceWorker(unittest.TestCase):
+    def test_predicts(self):
+        """Test that a submitted frame is predicted on the worker thread."""
+        worker = InferenceWorker(ConstantModel())
+        worker.start()
+        self.addCleanup(worker.stop)
+        self.assertEqual(worker.get_control(), (None, float('inf'), None))
+
+        submit_frame(worker)
+        wait_for(lambda: worker.get_control()[0] is not None)
+        control, age, timestamp = worker.get_control()
+
+        np.testing.assert_allclose(control, (0.1, 0.5, 0.0), rtol=1e-6)
+        self.assertLess(age, 5.0)
+        # The timestamp identifies the prediction, so it only changes with the next one
+        self.assertEqual(worker.get_control()[2], timestamp)
+
+        submit_frame(worker)
+        wait_for(lambda: worker.get_control()[2] != timestamp)
+        self.assertGreater(worker.get_control()[2], timestamp)
+
+    def test_raises_model_error(self):
+        """Test that an exception of the model reaches the control loop instead of silently ending the worker."""
+        worker = InferenceWorker(FailingModel())
+        worker.start()
+        self.addCleanup(worker.stop)
+        submit_frame(worker)
+
+        wait_for(lambda: not worker._thread.is_alive())
+
+        with self.assertRaisesRegex(ValueError, "bad input"):
+            worker.get_control()
+        with self.assertRaises(ValueError):
+            submit_frame(worker)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,33 +1,85 @@
+import argparse
+
 from torch.utils.data import DataLoader
-from torch.utils.data import random_split
 from torch.utils.tensorboard import SummaryWriter
 
 import matplotlib.pyplot as plt
 
 from model import *
-from data import ImitationDataset
+from data import ImitationDataset, MemmapImitationDataset, CACHE_MANIFEST, build_cache
 from preprocess import *
+from imitation_shared.sampling import ContiguousBatchSampler
+from imitation_shared.augmentation import BatchAugmentation
+from imitation_shared.splits import load_split
+from imitation_shared.checkpoint import CheckpointManager, find_latest_run, get_rng_state, set_rng_state
+from imitation_shared.distributed import init_distributed, cleanup_distributed, barrier, broadcast_object, \
+    all_gather_object
+from imitation_shared.training import TrainingEngine, ThroughputMeter, LossAccumulator, AsyncScalarWriter, \
+    NullScalarWriter, add_training_args
 
 def main():
-    print_game_letterhead("CARLA Simulation Training")
+    parser = argparse.ArgumentParser(description="Trains the CARLA simulation model")
+    add_training_args(parser, epochs=30, batch_size=120)
+    parser.add_argument('--resume', nargs='?', const='latest', default=None, metavar='RUN',
+                        help="Resume a run from its latest checkpoint: the run folder, or the most recent run "
+                             "with a checkpoint when no folder is given.")
+    parser.add_argument('--checkpoint-interval', type=int, default=500,
+                        help="Number of training steps between mid-epoch checkpoints. Default is 500.")
+    parser.add_argument('--keep-best', type=int, default=3,
+                        help="Number of end-of-epoch checkpoints kept, ranked by validation loss. Default is 3.")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Seed for the batch order and augmentation. Default is random.")
+    parser.add_argument('--no-augmentation', action='store_true', help="Train on the frames as recorded.")
+    args = parser.parse_args()
+
+    # Started through torchrun, every process trains on its share of each epoch and rank 0 does the logging,
+    # checkpointing and saving
+    rank, world_size = init_distributed()
+    try:
+        train(args, rank, world_size)
+    finally:
+        cleanup_distributed()
+
 
-    print_formatted("Starting Training Process", GREEN)
+def train(args, rank, world_size):
+    is_main = rank == 0
+
+    if is_main:
+        print_game_letterhead("CARLA Simulation Training")
+        print_args(args)
+
+        print_formatted("Starting Training Process", GREEN)
 
     # Check if CUDA is available
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    print_formatted(f"Using device: {GREEN}{device}{RESET}")
+    device = torch.device(f"cuda:{os.environ.get('LOCAL_RANK', 0)}" if torch.cuda.is_available() else 'cpu')
+    if is_main:
+        print_formatted(f"Using device: {GREEN}{device}{RESET} - Processes: {world_size}")
 
     # Load the model
     model = load_model("data/model", "model_state_dict")
     model = model.to(device)
 
     # Hyperparameters
-    num_epochs = 30
-    batch_size = 120
-
-    # Tensorboard writer
-    run_dir = f"runs/{time.strftime('%Y-%m-%d_%H-%M-%S')}"
-    tsbd = SummaryWriter(log_dir=run_dir)
+    num_epochs = args.epochs
+    batch_size = args.batch_size
+
+    # Every run keeps its checkpoints in its own run folder, next to its Tensorboard logs, so a new run never
+    # ranks its checkpoints against those of another run. A resumed run keeps using the folder it continues.
+    run_dir = None
+    checkpoint = None
+    if args.resume is not None:
+        run_dir = find_latest_run() if args.resume == 'latest' else args.resume
+        if run_dir is not None and os.path.isdir(run_dir):
+            checkpoint = CheckpointManager(os.path.join(run_dir, CheckpointManager.FOLDER)).load_latest()
+        if checkpoint is None and is_main:
+            print_formatted("No checkpoint found, starting a new run", YELLOW)
+    if checkpoint is None:
+        # Every process uses the folder named by rank 0, whose clock may have ticked over
+        run_dir = broadcast_object(f"runs/{time.strftime('%Y-%m-%d_%H-%M-%S')}")
+
+    checkpoints = CheckpointManager(os.path.join(run_dir, CheckpointManager.FOLDER), keep_best=args.keep_best)
+    if is_main:
+        print_formatted(f"Checkpoints: {checkpoints.folder}")
 
     # Loss function and optimizer
     criterion = nn.MSELoss()
@@ -36,91 +88,208 @@ def main():
     try:
         optimizer.load_state_dict(torch.load("data/model/optimizer_state_dict.pth"))
     except FileNotFoundError:
-        print_formatted("No optimizer state dictionary found", RED)
-
-    # Load your entire dataset
-    dataset = ImitationDataset("data/training")
+        if is_main:
+            print_formatted("No optimizer state dictionary found", RED)
+    engine = TrainingEngine.from_args(model, optimizer, criterion, device, args)
+
+    # Load your entire dataset, from the memmap cache if one has been built with 'python preprocess.py build-cache'
+    if os.path.exists(os.path.join("data/cache", CACHE_MANIFEST)):
+        if is_main:
+            build_cache("data/training", "data/cache")
+        barrier()
+        data_folder = "data/cache"
+        dataset = MemmapImitationDataset(data_folder)
+    else:
+        data_folder = "data/training"
+        dataset = ImitationDataset(data_folder)
 
     if len(dataset) == 0:
         print_formatted("No data found in the training folder", RED)
         return
 
-    indices = get_balanced_commands("data/training")
-
-    dataset = torch.utils.data.Subset(dataset, indices)
-
-    # Determine the lengths of your splits
-    train_size = int(0.8 * len(dataset))  # 80% for training
-    val_size = len(dataset) - train_size  # 20% for validation
-
-    # Split the dataset
-    train_dataset, validation_dataset = random_split(dataset, [train_size, val_size])
-
-    # Create dataloaders for the training and validation sets
-    train_dataloader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=4, pin_memory=True)
-    validation_dataloader = DataLoader(validation_dataset, batch_size=batch_size, shuffle=True, num_workers=4, pin_memory=True)
-
-    tsbd.add_graph(model, [torch.zeros(1, 3, 88, 200).to(device),
-                           torch.zeros(1, 3).to(device),
-                           torch.zeros(1, 1).to(device, dtype=torch.uint8)])
+    # Tensorboard writer, a resumed run keeps logging to the run it continues
+    tsbd = AsyncScalarWriter(SummaryWriter(log_dir=run_dir)) if is_main else NullScalarWriter()
+
+    if checkpoint is not None:
+        # A resumed run keeps the split and batch order of the run it continues
+        train_indices, validation_indices = checkpoint['train_indices'], checkpoint['validation_indices']
+        seed = checkpoint['seed']
+    elif is_main:
+        seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % 2 ** 32)
+
+        # The sessions are split once, stratified by command, in the split manifest shared by all runs. Each
+        # split is then balanced by command; the validation subset is fixed so that runs can be compared.
+        commands = read_commands(data_folder)
+        file_lengths = np.diff(np.r_[0, dataset.cumulative_lengths])
+        train_split, validation_split = load_split(dataset.file_paths, file_lengths, commands)
+
+        train_indices = balance_indices(commands, train_split, seed)
+        validation_indices = balance_indices(commands, validation_split, 0)
+
+        if len(validation_indices) == 0:
+            print_formatted("No validation sessions, record more sessions to validate the model", YELLOW)
+    else:
+        train_indices = validation_indices = seed = None
+
+    # Every process works on the split and batch order chosen by rank 0
+    train_indices, validation_indices, seed = broadcast_object((train_indices, validation_indices, seed))
+
+    # Without validation sessions the epochs are only measured on the training loss, and no checkpoint is
+    # ranked among the best
+    has_validation = len(validation_indices) > 0
+
+    # Create dataloaders for the training and validation sets. The batch samplers work on the underlying
+    # dataset indices and keep neighbouring rows together, so that ImitationDataset.__getitems__ can read
+    # each batch with a few contiguous slices. The training sampler is seeded so that an epoch can be resumed,
+    # and both samplers hand each process its share of the batches in a distributed run.
+    train_sampler = ContiguousBatchSampler(train_indices, batch_size, shuffle=True, seed=seed, rank=rank,
+                                           num_replicas=world_size)
+    validation_sampler = ContiguousBatchSampler(validation_indices, batch_size, shuffle=False, rank=rank,
+                                                num_replicas=world_size)
+
+    # Training batches are augmented as a whole after they reach the device, validation batches never are.
+    # Each process draws its own augmentation parameters.
+    augmentation = None if args.no_augmentation else BatchAugmentation(seed=seed + rank)
+
+    train_dataloader = DataLoader(dataset, batch_sampler=train_sampler, num_workers=4, pin_memory=True)
+    validation_dataloader = DataLoader(dataset, batch_sampler=validation_sampler, num_workers=4, pin_memory=True)
+
+    if is_main:
+        tsbd.writer.add_graph(model, [torch.zeros(1, 3, 88, 200).to(device),
+                                      torch.zeros(1, 3).to(device),
+                                      torch.zeros(1, 1).to(device, dtype=torch.uint8)])
 
     training_losses = []
     validation_losses = []
+    start_epoch, start_step = 0, 0
+
+    if checkpoint is not None:
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        lr_scheduler.load_state_dict(checkpoint['scheduler'])
+        training_losses, validation_losses = checkpoint['training_losses'], checkpoint['validation_losses']
+        start_epoch, start_step = checkpoint['epoch'], checkpoint['step']
+        set_rng_state(checkpoint['rng'])
+        if augmentation is not None and checkpoint.get('augmentation') is not None:
+            augmentation.set_state(checkpoint['augmentation'])
+
+        # The steps of an epoch depend on the number of processes sharing it
+        if start_step > 0 and checkpoint.get('world_size', 1) != world_size:
+            start_step = 0
+            if is_main:
+                print_formatted("The number of processes changed, restarting the interrupted epoch", YELLOW)
+
+        if is_main:
+            print_formatted(f"Resuming from epoch {start_epoch + 1}, step {start_step}", GREEN)
+
+    def get_state(epoch, step, running_losses=None):
+        return {
+            'epoch': epoch,
+            'step': step,
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'scheduler': lr_scheduler.state_dict(),
+            'running_losses': running_losses,
+            'training_losses': training_losses,
+            'validation_losses': validation_losses,
+            'train_indices': train_indices,
+            'validation_indices': validation_indices,
+            'seed': seed,
+            'run_dir': run_dir,
+            'world_size': world_size,
+            'rng': get_rng_state(),
+            'augmentation': augmentation.get_state() if augmentation is not None else None,
+        }
+
+    steps_per_epoch = train_sampler.get_epoch_length()
+
+    for epoch in range(start_epoch, num_epochs):
+        # A checkpoint taken mid-epoch resumes with the batches of that epoch that were not processed yet
+        step = start_step if epoch == start_epoch else 0
+        train_sampler.set_epoch(epoch, start_batch=step)
+
+        # Every process restores its own share of the interrupted epoch's loss, the checkpoint holds them all
+        running_loss = LossAccumulator(device)
+        if step > 0:
+            running_loss.load_state_dict(checkpoint['running_losses'][rank])
+        throughput = ThroughputMeter()
+
+        # Training loop. The losses stay on the device and are only read back every log_interval steps.
+        engine.timer.start()
+        for i, batch in enumerate(train_dataloader, start=step):
+            engine.timer.mark('data')
+            images_batch, scalars_batch, targets_batch, commands_batch = engine.move_batch(batch)
+            engine.timer.mark('h2d')
+            if augmentation is not None:
+                images_batch = augmentation(images_batch)
+            engine.timer.mark('augmentation')
+
+            loss = engine.train_step((images_batch, scalars_batch, commands_batch), targets_batch)
+
+            running_loss.update(loss)
+            throughput.update(len(targets_batch))
+            if (i + 1) % args.log_interval == 0:
+                tsbd.add_scalar('Loss/Train', running_loss.interval_mean(), epoch * steps_per_epoch + i)
+            if (i + 1) % args.checkpoint_interval == 0:
+                running_losses = all_gather_object(running_loss.state_dict())
+                if is_main:
+                    checkpoints.save_latest(get_state(epoch, i + 1, running_losses))
+
+        samples_per_second = throughput.samples_per_second() * world_size
 
-    for epoch in range(num_epochs):
-        running_loss = 0.0
-
-        # Training loop
-        for i, (images_batch, scalars_batch, targets_batch, commands_batch) in enumerate(train_dataloader):
-            images_batch = images_batch.to(device, non_blocking=True)
-            scalars_batch = scalars_batch.to(device, non_blocking=True)
-            targets_batch = targets_batch.to(device, non_blocking=True)
-            commands_batch = commands_batch.to(device, non_blocking=True)
-
-            outputs = model(images_batch, scalars_batch, commands_batch)
-
-            optimizer.zero_grad(set_to_none=True)
-            loss = criterion(outputs, targets_batch)
-            loss.backward()
-            optimizer.step()
-
-            loss_val = loss.item()
-            running_loss += loss_val
-            tsbd.add_scalar('Loss/Train', loss_val, epoch * len(train_dataloader) + i)
+        # Save losses for plotting
+        running_loss.synchronize()
+        training_losses.append(running_loss.mean())
+        tsbd.add_scalar('Loss/TrainEpoch', training_losses[-1], epoch)
+        tsbd.add_scalar('Throughput/TrainSamplesPerSecond', samples_per_second, epoch)
+        summary = f"Training Loss: {training_losses[-1]:.4f}"
 
         # Validation loop
-        model.eval()
-        with torch.no_grad():
-            validation_loss = 0.0
-            for i, (images_batch, scalars_batch, targets_batch, commands_batch) in enumerate(validation_dataloader):
-                images_batch = images_batch.to(device, non_blocking=True)
-                scalars_batch = scalars_batch.to(device, non_blocking=True)
-                targets_batch = targets_batch.to(device, non_blocking=True)
-                commands_batch = commands_batch.to(device, non_blocking=True)
-
-                outputs = model(images_batch, scalars_batch, commands_batch)
-                loss = criterion(outputs, targets_batch)
-
-                loss_val = loss.item()
-                validation_loss += loss_val
-                tsbd.add_scalar('Loss/Validation', loss_val, epoch * len(validation_dataloader) + i)
-
-        # Save losses for plotting
-        training_losses.append(running_loss / len(train_dataloader))
-        validation_losses.append(validation_loss / len(validation_dataloader))
+        if has_validation:
+            engine.eval()
+            validation_loss = LossAccumulator(device)
+            for i, batch in enumerate(validation_dataloader):
+                images_batch, scalars_batch, targets_batch, commands_batch = engine.move_batch(batch)
+
+                loss = engine.eval_step((images_batch, scalars_batch, commands_batch), targets_batch)
+
+                validation_loss.update(loss)
+                if (i + 1) % args.log_interval == 0:
+                    tsbd.add_scalar('Loss/Validation', validation_loss.interval_mean(),
+                                    epoch * len(validation_dataloader) + i)
+
+            validation_loss.synchronize()
+            validation_losses.append(validation_loss.mean())
+            tsbd.add_scalar('Loss/ValidationEpoch', validation_losses[-1], epoch)
+            tsbd.add_scalars("Loss/TrainValidation", {
+                "Train": training_losses[-1],
+                "Validation": validation_losses[-1]
+            }, epoch)
+            summary += f" - Validation Loss: {validation_losses[-1]:.4f}"
+
+        if is_main:
+            print_formatted(f"Epoch {epoch + 1}/{num_epochs} - {summary} - {samples_per_second:.1f} samples/s")
+
+        if engine.timer.enabled:
+            for phase, milliseconds in engine.timer.summary().items():
+                tsbd.add_scalar(f'StepTime/{phase}', milliseconds, epoch)
+            if is_main:
+                print_formatted(f"Step time - {engine.timer.format_summary()}")
+            engine.timer.reset()
+
+        engine.train()
+        lr_scheduler.step()
 
-        tsbd.add_scalar('Loss/TrainEpoch', training_losses[-1], epoch)
-        tsbd.add_scalar('Loss/ValidationEpoch', validation_losses[-1], epoch)
-        tsbd.add_scalars("Loss/TrainValidation", {
-            "Train": training_losses[-1],
-            "Validation": validation_losses[-1]
-        }, epoch)
+        if is_main:
+            state = get_state(epoch + 1, 0)
+            checkpoints.save_latest(state)
+            if has_validation and checkpoints.save_best(state, epoch + 1, validation_losses[-1]):
+                print_formatted(f"Kept checkpoint of epoch {epoch + 1} among the best {args.keep_best}")
 
-        print_formatted(f"Epoch {epoch + 1}/{num_epochs} - Training Loss: {training_losses[-1]:.4f} - "
-                        f"Validation Loss: {validation_losses[-1]:.4f}")
+    tsbd.close()
 
-        model.train()
-        lr_scheduler.step()
+    if not is_main:
+        return
 
     # Save the model and plot the losses
     save_model("data/model", model, "model_state_dict")
@@ -128,7 +297,8 @@ def main():
 
     plt.figure(figsize=(10, 5))
     plt.plot(training_losses, label='Training Loss')
-    plt.plot(validation_losses, label='Validation Loss')
+    if validation_losses:
+        plt.plot(validation_losses, label='Validation Loss')
     plt.xlabel('Epochs')
     plt.ylabel('Loss')
     plt.legend()
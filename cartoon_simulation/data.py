@@ -3,18 +3,34 @@ import h5py
 import numpy as np
 import time
 
+from collections import OrderedDict
+from multiprocessing import util
 from torch.utils.data import Dataset
 
+from imitation_shared.storage import IMAGE_SCALE_ATTR, get_image_scale, read_image_scale, encode_images, decode_images
+from imitation_shared.sampling import read_rows
+
 
 class DataManager:
-    def __init__(self, folder, name):
+    def __init__(self, folder, name, buffer_size=64, image_dtype=np.float32):
         self.folder = folder
         self.name = name
+        self.buffer_size = buffer_size
+        self.image_dtype = np.dtype(image_dtype)
         self.file_path = self.get_file_path()
         self.h5file = None
+        self.buffers = {}
+        self.buffered = 0
+        self.length = 0
         self.initialize_folder()
         self.open_file()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def initialize_folder(self):
         if not os.path.exists(self.folder):
             os.makedirs(self.folder)
@@ -28,36 +44,139 @@ class DataManager:
 
     def initialize_datasets(self):
         datasets = {
-            'images': ((0, 200, 200, 3), np.float32),
+            'images': ((0, 200, 200, 3), self.image_dtype),
             'scalars': ((0, 1), np.float32),
             'targets': ((0, 3), np.float32),
         }
         for name, (shape, dtype) in datasets.items():
             if name not in self.h5file:
                 self.h5file.create_dataset(name, shape, maxshape=(None, *shape[1:]), dtype=dtype)
+            self.buffers[name] = np.empty((self.buffer_size, *shape[1:]), dtype=dtype)
 
-    def save(self, image, scalars, targets):
-        image = np.array(image, dtype=np.float32)
-        scalars = np.array(scalars, dtype=np.float32)
-        targets = np.array(targets, dtype=np.float32)
+        self.h5file['images'].attrs[IMAGE_SCALE_ATTR] = get_image_scale(self.image_dtype)
 
+        self.length = int(self.h5file.attrs.get('length', self.h5file['images'].shape[0]))
+
+    def save(self, image, scalars, targets):
+        # samples are staged in preallocated buffers and written to disk a whole block at a time
         try:
+            image = encode_images(image, self.image_dtype)
             for dataset_name, data in zip(['images', 'scalars', 'targets'], [image, scalars, targets]):
-                dataset = self.h5file[dataset_name]
-                dataset.resize(dataset.shape[0] + 1, axis=0)
-                dataset[-1:] = data
+                self.buffers[dataset_name][self.buffered] = data
+            self.buffered += 1
+
+            if self.buffered == self.buffer_size:
+                self.flush()
         except Exception as e:
             print(f"An error occurred: {e}")
 
+    def flush(self):
+        if self.h5file is None or self.buffered == 0:
+            return
+
+        end = self.length + self.buffered
+        for dataset_name, buffer in self.buffers.items():
+            dataset = self.h5file[dataset_name]
+            # grow geometrically so the number of resizes is logarithmic in the session length
+            if dataset.shape[0] < end:
+                dataset.resize(max(end, 2 * dataset.shape[0]), axis=0)
+            dataset[self.length:end] = buffer[:self.buffered]
+
+        self.length = end
+        self.buffered = 0
+        self.h5file.attrs['length'] = self.length
+        self.h5file.flush()
+
+    def close(self):
+        if self.h5file is None:
+            return
+
+        self.flush()
+
+        # trim the over-allocated rows so the file has the same layout as an unbuffered session
+        for dataset_name in self.buffers:
+            self.h5file[dataset_name].resize(self.length, axis=0)
+
+        self.h5file.close()
+        self.h5file = None
+
+def close_files(file_cache):
+    for file in file_cache.values():
+        file.close()
+    file_cache.clear()
+
+
 class ImitationDataset(Dataset):
-    def __init__(self, folder):
+    def __init__(self, folder, cache_size=10):
         self.file_paths = sorted([os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.h5')])
         self.file_lengths = [self.get_file_length(f) for f in self.file_paths]
         self.cumulative_lengths = np.cumsum(self.file_lengths)
 
+        # open read handles, kept per process and evicted least recently used first
+        self.cache_size = cache_size
+        self.file_cache = OrderedDict()
+        self.image_scales = {}
+        self.cache_pid = None
+        self.cache_stats = {'opens': 0, 'hits': 0}
+
+    def __getstate__(self):
+        # h5py handles cannot be pickled, so workers started with the spawn method begin with an empty cache
+        state = self.__dict__.copy()
+        state['file_cache'] = OrderedDict()
+        state['cache_pid'] = None
+        return state
+
+    def get_file(self, file_path):
+        """
+        Returns an open read handle for the file, opening it on first use in the current process.
+
+        Handles inherited through fork are never reused, since HDF5 handles cannot be shared between
+        processes. Each DataLoader worker therefore builds its own cache, which is closed when the worker exits.
+
+        Parameters:
+            file_path (str): The path of the session file.
+
+        Returns:
+            h5py.File: The open file.
+        """
+        if self.cache_pid != os.getpid():
+            self.file_cache = OrderedDict()
+            self.cache_stats = {'opens': 0, 'hits': 0}
+            self.cache_pid = os.getpid()
+            util.Finalize(self, close_files, args=(self.file_cache,), exitpriority=10)
+
+        if file_path in self.file_cache:
+            self.file_cache.move_to_end(file_path)
+            self.cache_stats['hits'] += 1
+        else:
+            if len(self.file_cache) >= self.cache_size:
+                _, file = self.file_cache.popitem(last=False)
+                file.close()
+
+            file = h5py.File(file_path, 'r')
+            self.file_cache[file_path] = file
+            self.image_scales[file_path] = read_image_scale(file['images'])
+            self.cache_stats['opens'] += 1
+
+        return self.file_cache[file_path]
+
+    def cache_info(self):
+        """
+        Returns the handle cache counters of the current process.
+
+        Returns:
+            dict: The number of file opens, cache hits and currently open files.
+        """
+        return {**self.cache_stats, 'open_files': len(self.file_cache)}
+
+    def close_files(self):
+        close_files(self.file_cache)
+
     def get_file_length(self, file_path):
+        # a session that was not closed cleanly may contain over-allocated rows past its recorded length,
+        # while files edited by an older delete_groups may be shorter than a stale length attribute
         with h5py.File(file_path, 'r') as file:
-            return file['images'].shape[0]
+            return int(min(file.attrs.get('length', file['images'].shape[0]), file['images'].shape[0]))
 
     def __len__(self):
         return sum(self.file_lengths)
@@ -84,22 +203,48 @@ class ImitationDataset(Dataset):
 
         file_path = self.file_paths[file_index]
 
-        with h5py.File(file_path, 'r') as file:
-            image = file['images'][local_index]
-            scalars = file['scalars'][local_index]
-            targets = file['targets'][local_index]
+        file = self.get_file(file_path)
+        image = file['images'][local_index]
+        scalars = file['scalars'][local_index]
+        targets = file['targets'][local_index]
 
-        image = np.array(image, dtype=np.float32).transpose((2, 0, 1))
+        image = decode_images(image, self.image_scales[file_path]).transpose((2, 0, 1))
         scalars = np.array(scalars, dtype=np.float32)
         targets = np.array(targets, dtype=np.float32)
 
         return image, scalars, targets
-    
+
+    def __getitems__(self, indices):
+        # batched counterpart of __getitem__ used by the DataLoader: indices are grouped by file and every
+        # run of neighbouring rows is read with one slice
+        indices = np.asarray(indices, dtype=np.int64)
+        file_indices = np.searchsorted(self.cumulative_lengths, indices, side='right')
+        local_indices = indices - np.r_[0, self.cumulative_lengths][file_indices]
+
+        images = np.empty((len(indices), 3, 200, 200), dtype=np.float32)
+        scalars = np.empty((len(indices), 1), dtype=np.float32)
+        targets = np.empty((len(indices), 3), dtype=np.float32)
+
+        for file_index in np.unique(file_indices):
+            positions = np.flatnonzero(file_indices == file_index)
+            rows = local_indices[positions]
+            file_path = self.file_paths[file_index]
+            file = self.get_file(file_path)
+
+            images[positions] = decode_images(read_rows(file['images'], rows), self.image_scales[file_path]).transpose((0, 3, 1, 2))
+            scalars[positions] = read_rows(file['scalars'], rows)
+            targets[positions] = read_rows(file['targets'], rows)
+
+        return list(zip(images, scalars, targets))
+
     # removes files in a range of indices across multiple files (inclusive of start_idx, exclusive of end_idx)
     # returns -1 if the range is invalid, 0 otherwise
     def delete_groups(self, start_idx, end_idx):
         if start_idx >= end_idx or start_idx < 0 or end_idx > len(self):
             return -1
+
+        # the files are rewritten below, which requires that no read handles are open on them
+        self.close_files()
         
         start_file_index = np.searchsorted(self.cumulative_lengths, start_idx, side='right')
         end_file_index = np.searchsorted(self.cumulative_lengths, end_idx, side='right')
@@ -115,9 +260,13 @@ class ImitationDataset(Dataset):
                 if local_end_index > self.file_lengths[file_index]:
                     local_end_index = self.file_lengths[file_index]
 
-                images = file['images']
-                scalars = file['scalars']
-                targets = file['targets']
+                # only the recorded rows are kept, over-allocated rows of a session that was not closed
+                # cleanly are dropped with the deleted range
+                length = self.file_lengths[file_index]
+                images = file['images'][:length]
+                scalars = file['scalars'][:length]
+                targets = file['targets'][:length]
+                image_attrs = dict(file['images'].attrs)
 
                 new_images = np.delete(images, slice(local_start_index, local_end_index), axis=0)
                 new_scalars = np.delete(scalars, slice(local_start_index, local_end_index), axis=0)
@@ -128,8 +277,10 @@ class ImitationDataset(Dataset):
                 del file['targets']
 
                 file.create_dataset('images', data=new_images)
+                file['images'].attrs.update(image_attrs)
                 file.create_dataset('scalars', data=new_scalars)
                 file.create_dataset('targets', data=new_targets)
+                file.attrs['length'] = len(new_images)
                 
             start_idx = self.cumulative_lengths[file_index]
     
@@ -0,0 +1,325 @@
+import os
+import multiprocessing as mp
+
+import numpy as np
+import pygame
+import torch
+
+from scene import Scene, Car, ASSETS_FOLDER
+
+
+def get_track_mask(background_image, max_saturation=40):
+    """
+    Finds the pixels of the racetrack. The asphalt, lane markings and white curbs are gray, while the grass,
+    sand and red curbs around the track are colored.
+
+    Parameters:
+        background_image (pygame.Surface): The racetrack image.
+        max_saturation (int): The largest difference between the channels of a track pixel.
+
+    Returns:
+        numpy.ndarray: The boolean (width, height) mask of the track pixels.
+    """
+    pixels = pygame.surfarray.array3d(background_image).astype(np.int16)
+    return pixels.max(axis=2) - pixels.min(axis=2) <= max_saturation
+
+
+class CartoonEnv:
+    """
+    A programmatic environment over the 2D simulation: one car on the racetrack of a headless scene, driven by
+    (steer, throttle, brake) actions. Observations are the egocentric screenshot the autopilot sees and the
+    velocity of the car, like the samples recorded by main.py.
+
+    The screenshot is captured into the same image buffer every step, so an observation is only valid until
+    the next call to reset or step.
+
+    Attributes:
+        scene (Scene): The headless scene.
+        car (Car): The driven car.
+        start (tuple): The (x, y, angle) the car is reset to.
+        max_steps (int): The number of steps after which an episode is done.
+        steps (int): The number of steps of the current episode.
+        image (numpy.ndarray): The (width, height, 3) buffer the screenshots are captured into.
+        track (numpy.ndarray): The (width, height) mask of the racetrack pixels.
+    """
+
+    def __init__(self, start=(300, 300, 0), max_steps=1000, width=200, height=200, image_dtype=np.float32,
+                 image=None):
+        """
+        Creates the scene and the car of the environment.
+
+        Parameters:
+            start (tuple): The (x, y, angle) the car is reset to.
+            max_steps (int): The number of steps after which an episode is done.
+            width (int): Width of the screenshots.
+            height (int): Height of the screenshots.
+            image_dtype (numpy.dtype): The dtype of the screenshots, uint8 or floating point.
+            image (numpy.ndarray or None): The buffer to capture the screenshots into, e.g. shared memory.
+                Allocated when None.
+        """
+        background_image = pygame.image.load(os.path.join(ASSETS_FOLDER, 'racetrack.jpeg'))
+        self.scene = Scene(background_image, 800, 600, 0, headless=True)
+        self.car = Car(*start, 0.1)
+        self.scene.add_agent(self.car)
+        self.track = get_track_mask(background_image)
+
+        self.start = start
+        self.max_steps = max_steps
+        self.steps = 0
+        self.image = np.zeros((width, height, 3), dtype=image_dtype) if image is None else image
+
+    def reset(self, start=None):
+        """
+        Puts the car back at the start, standing still.
+
+        Parameters:
+            start (tuple or None): The (x, y, angle) of this episode, the start of the environment when None.
+
+        Returns:
+            tuple: The (image, velocity) observation.
+        """
+        self.car.update_position(*(self.start if start is None else start))
+        self.car.velocity = 0.0
+        self.steps = 0
+
+        return self.observe()
+
+    def step(self, action):
+        """
+        Applies an action for one frame. An episode is done after max_steps steps or once the car leaves the
+        screen.
+
+        Parameters:
+            action (array-like): The (steer, throttle, brake) controls.
+
+        Returns:
+            tuple: The (image, velocity) observation, whether the episode is done, and the info of get_info.
+        """
+        steer, throttle, brake = (float(control) for control in action)
+        self.car.update_physics(steer, throttle, brake)
+        self.steps += 1
+
+        observation = self.observe()
+        done = self.steps >= self.max_steps or not self.is_on_screen()
+
+        return observation, done, self.get_info()
+
+    def observe(self):
+        self.scene.run()
+        return self.scene.capture(self.car, self.image), self.car.velocity
+
+    def is_on_screen(self):
+        return 0 <= self.car.x < self.scene.screen_width and 0 <= self.car.y < self.scene.screen_height
+
+    def is_on_track(self):
+        return self.is_on_screen() and bool(self.track[int(self.car.x), int(self.car.y)])
+
+    def get_info(self):
+        """
+        Returns the state of the car.
+
+        Returns:
+            dict: The x, y, angle and velocity of the car, whether it is on the track and the steps of the
+                episode.
+        """
+        return {'x': self.car.x, 'y': self.car.y, 'angle': self.car.angle, 'velocity': self.car.velocity,
+                'on_track': self.is_on_track(), 'steps': self.steps}
+
+
+def run_worker(connection, index, shared_images, shared_velocities, image_shape, image_dtype, env_kwargs):
+    """
+    Runs one environment of a VectorEnv in a subprocess. The observations are written to the shared buffers,
+    only the commands, done flags and infos go through the pipe.
+    """
+    images = np.frombuffer(shared_images, dtype=image_dtype).reshape(-1, *image_shape)
+    velocities = np.frombuffer(shared_velocities, dtype=np.float64)
+    env = CartoonEnv(image=images[index], **env_kwargs)
+
+    try:
+        while True:
+            command, data = connection.recv()
+
+            if command == 'reset':
+                _, velocities[index] = env.reset(data)
+                connection.send(env.get_info())
+            elif command == 'step':
+                (_, velocities[index]), done, info = env.step(data)
+                # Done environments start their next episode right away, the info keeps the final state
+                if done:
+                    _, velocities[index] = env.reset()
+                connection.send((done, info))
+            elif command == 'close':
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connection.close()
+
+
+class VectorEnv:
+    """
+    Runs num_envs CartoonEnv environments in subprocesses and steps them all at once. The screenshots and
+    velocities are written by the subprocesses to shared memory, so the observations of all environments are
+    batches without any copy, ready for a single batched policy forward pass (see get_policy_actions).
+
+    The observation arrays are overwritten by the next reset or step. Environments whose episode is done are
+    reset automatically, and the step returns the first observation of their new episode.
+
+    Attributes:
+        num_envs (int): The number of environments.
+        images (numpy.ndarray): The shared (num_envs, width, height, 3) screenshots.
+        velocities (numpy.ndarray): The shared (num_envs,) velocities.
+        connections (list): The pipes to the subprocesses.
+        processes (list): The subprocesses.
+    """
+
+    def __init__(self, num_envs, starts=None, width=200, height=200, image_dtype=np.float32, start_method='spawn',
+                 **env_kwargs):
+        """
+        Starts the subprocesses of the environments.
+
+        Parameters:
+            num_envs (int): The number of environments.
+            starts (list or None): The (x, y, angle) start of every environment, the CartoonEnv default when
+                None.
+            width (int): Width of the screenshots.
+            height (int): Height of the screenshots.
+            image_dtype (numpy.dtype): The dtype of the screenshots, uint8 or floating point.
+            start_method (str): The multiprocessing start method of the subprocesses.
+            env_kwargs: The remaining arguments of every CartoonEnv.
+        """
+        context = mp.get_context(start_method)
+        image_dtype = np.dtype(image_dtype)
+        image_shape = (width, height, 3)
+
+        shared_images = context.RawArray(np.ctypeslib.as_ctypes_type(image_dtype), num_envs * width * height * 3)
+        shared_velocities = context.RawArray(np.ctypeslib.as_ctypes_type(np.float64), num_envs)
+        self.images = np.frombuffer(shared_images, dtype=image_dtype).reshape(num_envs, *image_shape)
+        self.velocities = np.frombuffer(shared_velocities, dtype=np.float64)
+
+        self.num_envs = num_envs
+        self.connections = []
+        self.processes = []
+        for index in range(num_envs):
+            connection, worker_connection = context.Pipe()
+            kwargs = env_kwargs if starts is None else dict(env_kwargs, start=tuple(starts[index]))
+            process = context.Process(target=run_worker, daemon=True,
+                                      args=(worker_connection, index, shared_images, shared_velocities, image_shape,
+                                            image_dtype.str, kwargs))
+            process.start()
+            worker_connection.close()
+
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def __len__(self):
+        return self.num_envs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def reset(self, starts=None):
+        """
+        Resets every environment.
+
+        Parameters:
+            starts (list or None): The (x, y, angle) of this episode for every environment, the starts of the
+                environments when None. Automatic resets always return to the starts of the environments.
+
+        Returns:
+            tuple: The (images, velocities) observations.
+        """
+        for index, connection in enumerate(self.connections):
+            connection.send(('reset', None if starts is None else tuple(starts[index])))
+        for connection in self.connections:
+            connection.recv()
+
+        return self.images, self.velocities
+
+    def step(self, actions):
+        """
+        Steps every environment with its action.
+
+        Parameters:
+            actions (array-like): The (num_envs, 3) steer, throttle and brake controls.
+
+        Returns:
+            tuple: The (images, velocities) observations, the (num_envs,) done flags and the info of every
+                environment before any automatic reset.
+        """
+        for connection, action in zip(self.connections, np.asarray(actions, dtype=np.float64).tolist()):
+            connection.send(('step', action))
+        dones, infos = zip(*[connection.recv() for connection in self.connections])
+
+        return (self.images, self.velocities), np.array(dones), list(infos)
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(('close', None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+
+        self.connections = []
+        self.processes = []
+
+
+def get_policy_actions(model, images, velocities, device=torch.device('cpu')):
+    """
+    Runs the policy on the observations of all environments in one forward pass, with the inputs the
+    autopilot of Car gives the model.
+
+    Parameters:
+        model (torch.nn.Module): The policy, e.g. a CNNModel in evaluation mode.
+        images (numpy.ndarray): The (N, width, height, 3) screenshots, uint8 or in [0, 1].
+        velocities (numpy.ndarray): The (N,) velocities.
+        device (torch.device): The device of the model.
+
+    Returns:
+        numpy.ndarray: The (N, 3) steer, throttle and brake controls.
+    """
+    images = torch.from_numpy(np.asarray(images)).to(device).permute(0, 3, 1, 2)
+    images = images.float() / 255.0 if images.dtype == torch.uint8 else images.float()
+    velocities = torch.from_numpy(np.asarray(velocities, dtype=np.float32)).to(device).unsqueeze(1)
+
+    with torch.no_grad():
+        return model(images, velocities).float().cpu().numpy()
+
+
+def get_episode_metrics(infos, actions, start, frame_rate=60):
+    """
+    Computes the driving metrics of an episode.
+
+    Parameters:
+        infos (list): The info of every step of the episode, as returned by CartoonEnv.step.
+        actions (array-like): The (steps, 3) steer, throttle and brake controls of the episode.
+        start (tuple): The (x, y, angle) the episode started from.
+        frame_rate (int): The simulated frames per second, used to convert frames to seconds.
+
+    Returns:
+        dict: The off-track time in seconds and as a fraction of the episode, the mean speed in pixels per
+            frame, the driven distance in pixels, the steering jerk (the mean absolute second difference of
+            the steering controls per frame) and the number of steps.
+    """
+    positions = np.array([start[:2]] + [(info['x'], info['y']) for info in infos], dtype=np.float64)
+    velocities = np.array([info['velocity'] for info in infos], dtype=np.float64)
+    off_track = ~np.array([info['on_track'] for info in infos], dtype=bool)
+    steering = np.asarray(actions, dtype=np.float64).reshape(-1, 3)[:, 0]
+
+    return {
+        'off_track_time': float(off_track.sum() / frame_rate),
+        'off_track_fraction': float(off_track.mean()) if len(infos) else 0.0,
+        'mean_speed': float(velocities.mean()) if len(infos) else 0.0,
+        'distance': float(np.hypot(*np.diff(positions, axis=0).T).sum()),
+        'steering_jerk': float(np.abs(np.diff(steering, n=2)).mean()) if len(steering) > 2 else 0.0,
+        'steps': len(infos),
+    }
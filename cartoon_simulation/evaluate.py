@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from model import *
+from env import VectorEnv, get_policy_actions, get_episode_metrics
+
+"""
+Closed-loop model evaluation
+
+Drives the car with one or more saved models on the racetrack in headless scenes and writes the driving
+metrics of every episode to a JSON report. Every episode starts from a pose on the track; the episodes run in
+parallel subprocesses and all cars are driven by one batched forward pass per frame. An episode ends after
+--steps frames or when the car leaves the screen.
+
+Metrics per episode:
+    - off_track_time: Seconds the car spent off the asphalt, and off_track_fraction of the episode
+    - mean_speed: The mean velocity in pixels per frame
+    - distance: The driven distance in pixels
+    - steering_jerk: The mean absolute second difference of the steering controls per frame
+
+Usage:
+    python evaluate.py --names model_state_dict checkpoint_a checkpoint_b --episodes 8
+"""
+
+# Poses on the racetrack, facing along the track: (x, y, angle)
+START_POSES = [(380, 455, 90), (520, 360, 0), (600, 265, 90), (720, 150, 0), (550, 70, 270), (250, 225, 270),
+               (90, 330, 180), (200, 455, 90)]
+
+
+def get_starts(episodes, seed):
+    """
+    Returns the start of every episode: the start poses in turn, shifted by a small random offset once every
+    pose has been used.
+
+    Parameters:
+        episodes (int): The number of episodes.
+        seed (int): Seed for the offsets.
+
+    Returns:
+        list: The (x, y, angle) start of every episode.
+    """
+    rng = np.random.default_rng(seed)
+    starts = []
+    for episode in range(episodes):
+        x, y, angle = START_POSES[episode % len(START_POSES)]
+        if episode >= len(START_POSES):
+            dx, dy, dangle = rng.uniform(-5.0, 5.0), rng.uniform(-5.0, 5.0), rng.uniform(-10.0, 10.0)
+            x, y, angle = x + dx, y + dy, (angle + dangle) % 360
+        starts.append((float(x), float(y), float(angle)))
+
+    return starts
+
+
+def run_episodes(vector_env, model, starts, steps):
+    """
+    Runs one episode from every start, len(vector_env) at a time.
+
+    Parameters:
+        vector_env (VectorEnv): The environments.
+        model (torch.nn.Module): The model driving the cars.
+        starts (list): The (x, y, angle) start of every episode.
+        steps (int): The maximum number of frames of an episode.
+
+    Returns:
+        list: The metrics of every episode.
+    """
+    results = []
+    for first in range(0, len(starts), len(vector_env)):
+        round_starts = starts[first:first + len(vector_env)]
+        # Environments without an episode in the last round drive from the first start and are ignored
+        padded_starts = round_starts + [starts[0]] * (len(vector_env) - len(round_starts))
+
+        images, velocities = vector_env.reset(padded_starts)
+        episode_infos = [[] for _ in round_starts]
+        episode_actions = [[] for _ in round_starts]
+        running = np.ones(len(vector_env), dtype=bool)
+        running[len(round_starts):] = False
+
+        for _ in range(steps):
+            actions = get_policy_actions(model, images, velocities)
+            (images, velocities), dones, infos = vector_env.step(actions)
+
+            for index in np.flatnonzero(running):
+                episode_infos[index].append(infos[index])
+                episode_actions[index].append(actions[index])
+            running &= ~dones
+
+            if not running.any():
+                break
+
+        for start, infos, actions in zip(round_starts, episode_infos, episode_actions):
+            results.append(dict(start=start, **get_episode_metrics(infos, actions, start)))
+
+    return results
+
+
+def summarize(results):
+    metrics = ['off_track_time', 'off_track_fraction', 'mean_speed', 'distance', 'steering_jerk']
+    return {metric: float(np.mean([result[metric] for result in results])) for metric in metrics}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluates models by driving the racetrack in headless scenes")
+    parser.add_argument('--folder', type=str, default='data/model', help="Model folder. Default is data/model.")
+    parser.add_argument('--names', type=str, nargs='+', default=['model_state_dict'],
+                        help="Names of the models to evaluate. Default is model_state_dict.")
+    parser.add_argument('--episodes', type=int, default=8, help="Number of episodes per model. Default is 8.")
+    parser.add_argument('--steps', type=int, default=1200, help="Maximum frames per episode. Default is 1200.")
+    parser.add_argument('--processes', type=int, default=min(8, os.cpu_count() or 1),
+                        help="Number of parallel environments. Default is the number of CPUs, at most 8.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the starts beyond the start poses.")
+    parser.add_argument('--output', type=str, default='data/model/evaluation.json', help="Path of the report.")
+    args = parser.parse_args()
+
+    print_game_letterhead("Model Evaluation")
+    print_args(args)
+
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) - args.processes))
+    starts = get_starts(args.episodes, args.seed)
+    report = {'steps': args.steps, 'episodes': args.episodes, 'seed': args.seed, 'models': {}}
+
+    with VectorEnv(min(args.processes, args.episodes), max_steps=args.steps) as vector_env:
+        for name in args.names:
+            if not any(os.path.exists(os.path.join(args.folder, f"{name}{ext}")) for ext in ('.pth', '.pt')):
+                print_formatted(f"Model {args.folder}/{name} not found, skipping it", RED)
+                continue
+
+            model = load_inference_model(args.folder, name)
+
+            start_time = time.perf_counter()
+            results = run_episodes(vector_env, model, starts, args.steps)
+            summary = summarize(results)
+            report['models'][name] = {'summary': summary, 'episodes': results}
+
+            print_formatted(f"{name}: off track {summary['off_track_time']:.1f} s "
+                            f"({summary['off_track_fraction']:.1%}), mean speed {summary['mean_speed']:.3f} px/frame, "
+                            f"distance {summary['distance']:.0f} px, steering jerk {summary['steering_jerk']:.4f} "
+                            f"in {time.perf_counter() - start_time:.1f} s", GREEN)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    temp_path = args.output + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(report, file, indent=2)
+    os.replace(temp_path, args.output)
+
+    print_formatted(f"Report written to {args.output}", GREEN)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,13 @@
 import pygame
 import threading
+import numpy as np
 import queue
 
 from imitation_shared.utils import *
 from imitation_shared.input import InputManager
-from scene import Scene, Car
+from scene import Scene, Car, FrameRing
 from data import DataManager
-from model import load_model
+from model import load_inference_model
 
 """
 2D Imitation Learning Application
@@ -51,11 +52,15 @@ scene = Scene(background_image, initial_x, initial_y, initial_angle)
 input_manager = InputManager()
 
 # Initialize the data manager
-data_manager = DataManager("data/training", "training_data")
-save_queue = queue.Queue()
+data_manager = DataManager("data/training", "training_data", image_dtype=np.uint8)
+
+# Screenshots are captured into a ring of uint8 frames. The queue holds fewer frames than the ring, so the
+# game loop never overwrites a frame that has not been saved yet
+frame_ring = FrameRing(64)
+save_queue = queue.Queue(maxsize=len(frame_ring) - 2)
 
 # Load the model (or use an unweighted model if none is found)
-model = load_model("data/model", "model_state_dict")
+model = load_inference_model("data/model", "model_state_dict")
 
 # Create the agents and add them to the scene
 car_agent = Car(300, 300, 0, 0.1)
@@ -106,7 +111,8 @@ try:
         frames += 1
 
         if collecting and frames % (60 / sampling_rate) == 0:
-            save_queue.put((scene.take_screenshot(car_agent), car_agent.velocity, [steer, throttle, brake]))
+            screenshot = scene.capture(car_agent, frame_ring.next())
+            save_queue.put((screenshot, car_agent.velocity, [steer, throttle, brake]))
         if autopilot:
             steer, throttle, brake = car_agent.get_autopilot_control(scene, model)
 
@@ -118,5 +124,6 @@ finally:
     print_formatted("Exiting...", RED)
     save_queue.put((None, None, None))
     save_thread.join()
+    data_manager.close()
     print_formatted("Save thread joined, exiting...", RED)
     pygame.quit()
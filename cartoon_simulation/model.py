@@ -74,7 +74,7 @@ class CNNModel(nn.Module):
 
     def forward(self, x_img, scalar):
         x_img = self.conv_blocks(x_img)
-        x_img = x_img.view(x_img.size(0), -1)
+        x_img = x_img.reshape(x_img.size(0), -1)
         x_img = self.img_fc(x_img)
 
         scalar = self.scalar_fc(scalar)
@@ -103,19 +103,24 @@ def save_model(folder, model, name):
     print_formatted(f"Model saved to {folder}/{name}.pth", GREEN)
 
 
-def load_model(folder, name):
+def load_model(folder, name, quantized=False):
     """
     Loads the model from the specified folder with the specified name.
 
     Parameters:
         folder (str): The folder from which to load the model.
         name (str): The name of the model file to load.
+        quantized (bool): Whether to load the int8 model written by quantize.py ({name}_int8.pth) instead.
 
     Returns:
         torch.nn.Module: The loaded model.
     """
     model = CNNModel()
 
+    if quantized:
+        model = quantize_model(model)
+        name = f"{name}_int8"
+
     try:
         model.load_state_dict(torch.load(os.path.join(folder, f"{name}.pth")))
         print_formatted(f"Model loaded from {folder}/{name}.pth", GREEN)
@@ -123,3 +128,78 @@ def load_model(folder, name):
         print_formatted(f"Existing model not found", RED)
 
     return model
+
+
+def quantize_model(model):
+    """
+    Returns an int8 copy of the model for CPU inference. The weights of every linear layer are quantized
+    ahead of time and their activations are quantized dynamically per batch, while the convolutions stay
+    in float.
+
+    Parameters:
+        model (torch.nn.Module): The float model.
+
+    Returns:
+        torch.nn.Module: The quantized model, in eval mode.
+    """
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def export_model(folder, model, name):
+    """
+    Exports the model as an inference artifact: the model is put in eval mode, traced to TorchScript and
+    frozen, which inlines the weights and folds every BatchNorm into the preceding convolution.
+
+    Parameters:
+        folder (str): The folder in which to save the artifact.
+        model (torch.nn.Module): The model to export.
+        name (str): The name to use for the artifact file.
+
+    Returns:
+        torch.jit.ScriptModule: The exported model.
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    example_inputs = (torch.zeros(1, 3, 200, 200), torch.zeros(1, 1))
+
+    model.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_inputs)
+        exported = torch.jit.freeze(traced)
+
+    torch.jit.save(exported, os.path.join(folder, f"{name}.pt"))
+    print_formatted(f"Model exported to {folder}/{name}.pt", GREEN)
+
+    return exported
+
+
+def load_inference_model(folder, name):
+    """
+    Loads the model for inference. The exported TorchScript artifact is used when it is at least as new as
+    the state dictionary, otherwise the eager model is loaded and put in eval mode. The optimizations that
+    depend on the local CPU (e.g. oneDNN convolution layouts) cannot be serialized, so they are applied here.
+
+    Parameters:
+        folder (str): The folder from which to load the model.
+        name (str): The name of the model files to load.
+
+    Returns:
+        torch.nn.Module: The model, ready for inference.
+    """
+    artifact_path = os.path.join(folder, f"{name}.pt")
+    state_dict_path = os.path.join(folder, f"{name}.pth")
+
+    if os.path.exists(artifact_path):
+        if not os.path.exists(state_dict_path) or os.path.getmtime(artifact_path) >= os.path.getmtime(state_dict_path):
+            model = torch.jit.optimize_for_inference(torch.jit.load(artifact_path))
+            print_formatted(f"Exported model loaded from {folder}/{name}.pt", GREEN)
+            return model
+
+        print_formatted(f"Exported model is older than {folder}/{name}.pth, run export.py again", YELLOW)
+
+    model = load_model(folder, name)
+    model.eval()
+
+    return model
@@ -0,0 +1,76 @@
+import time
+import argparse
+
+import numpy as np
+import pygame
+
+from imitation_shared.utils import *
+from scene import Scene, Car, CarBatch
+
+"""
+Headless rollout benchmark
+
+Drives the car around the racetrack in a headless scene, without a window or frame rate limit, and reports
+how many frames per second the simulation step (Car.update_physics and Scene.run) and the screenshot the
+autopilot sees (Scene.take_screenshot) reach. With --cars, it also reports how many car steps per second the
+batched physics (CarBatch.update_physics) reaches for that many cars.
+
+Usage:
+    python rollout_benchmark.py --frames 2000 --cars 4096
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks headless rollouts of the 2D simulation")
+    parser.add_argument('--frames', type=int, default=2000, help="Number of simulated frames. Default is 2000.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the random controls.")
+    parser.add_argument('--cars', type=int, default=0, help="Number of cars of the batched physics benchmark. "
+                                                            "Default is 0, which skips it.")
+    args = parser.parse_args()
+
+    print_game_letterhead("Headless Rollout Benchmark")
+    print_args(args)
+
+    background_image = pygame.image.load('./scene_assets/racetrack.jpeg')
+    scene = Scene(background_image, 800, 600, 0, headless=True)
+    car_agent = Car(300, 300, 0, 0.1)
+    scene.add_agent(car_agent)
+
+    rng = np.random.default_rng(args.seed)
+    controls = np.column_stack([rng.uniform(-1.0, 1.0, args.frames), rng.uniform(0.0, 1.0, args.frames),
+                                np.zeros(args.frames)])
+
+    step_time = 0.0
+    screenshot_time = 0.0
+    for steer, throttle, brake in controls:
+        start = time.perf_counter()
+        scene.run()
+        car_agent.update_physics(steer, throttle, brake)
+        step_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        scene.take_screenshot(car_agent)
+        screenshot_time += time.perf_counter() - start
+
+    print_formatted(f"Step:       {args.frames / step_time:10.1f} frames/s")
+    print_formatted(f"Screenshot: {args.frames / screenshot_time:10.1f} frames/s")
+    print_formatted(f"Total:      {args.frames / (step_time + screenshot_time):10.1f} frames/s", GREEN)
+
+    if args.cars > 0:
+        batch = CarBatch(np.full(args.cars, 300.0), 300.0, 0.0)
+        steer = rng.uniform(-1.0, 1.0, args.cars)
+        throttle = rng.uniform(0.0, 1.0, args.cars)
+
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            batch.update_physics(steer, throttle, 0.0)
+        batch_time = time.perf_counter() - start
+
+        print_formatted(f"Batch:      {args.frames * args.cars / batch_time:10.1f} car steps/s ({args.cars} cars)",
+                        GREEN)
+
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,15 @@
+import os
+import sys
+import cv2
 import pygame
 import math
+import numpy as np
 import torch
 
+from collections import OrderedDict
+
+ASSETS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scene_assets')
+
 
 class Scene:
     """
@@ -15,22 +23,30 @@ class Scene:
         angle (float): Initial angle of the scene.
         screen_width (int): Width of the screen derived from the background image.
         screen_height (int): Height of the screen derived from the background image.
-        clock (pygame.time.Clock): Clock used to manage update rates.
+        clock (pygame.time.Clock): Clock used to manage update rates, None for headless scenes.
         agents (list): A list of agents (e.g., cars) added to the scene.
-        screen (pygame.Surface): The pygame display surface.
+        screen (pygame.Surface): The pygame display surface, or an offscreen surface for headless scenes.
+        headless (bool): Whether the scene renders offscreen without a window or frame rate limit.
+        frame_rate (int): The frame rate run() is limited to in a window.
+        screenshot_buffers (dict): Preallocated crop buffers of capture, by screenshot size and channels.
+        agent_rects (list): The screen areas the agents were drawn to in the last frame.
+        full_redraw (bool): Whether the next frame redraws the whole background instead of only the agent
+            areas. Only the first frame is a full redraw.
     """
 
-    def __init__(self, background_image, initial_x, initial_y, initial_angle):
+    def __init__(self, background_image, initial_x, initial_y, initial_angle, headless=False, frame_rate=60):
         """
         Initializes the scene with a background, position, and angle. Sets up the
         screen and joystick if available.
 
         Parameters:
-            config (dict): Configuration settings for the scene.
             background_image (pygame.Surface): Background image for the scene.
             initial_x (int): Initial x position for the scene.
             initial_y (int): Initial y position for the scene.
             initial_angle (float): Initial angle for the scene.
+            headless (bool): Render to an offscreen surface and run as fast as possible, e.g. for automated
+                evaluation and data generation.
+            frame_rate (int): The frame rate run() is limited to in a window.
         """
         self.background_image = background_image
         self.x = initial_x
@@ -40,16 +56,27 @@ class Scene:
         self.screen_height = background_image.get_height()
         self.clock = None
         self.agents = []
+        self.headless = headless
+        self.frame_rate = frame_rate
+        self.screenshot_buffers = {}
+        self.agent_rects = []
+        self.full_redraw = True
 
         self.screen = self.initialize_screen()
 
     def initialize_screen(self):
         """
-        Initializes the pygame display surface based on the background image dimensions.
+        Initializes the pygame display surface based on the background image dimensions. Headless scenes
+        render to an offscreen surface of the same size instead and never open a window.
 
         Returns:
             pygame.Surface: The initialized display surface.
         """
+        if self.headless:
+            # Offscreen surfaces need neither the display nor a video driver. The display is left untouched, so
+            # a windowed scene can still be created later in the same process
+            return pygame.Surface((self.screen_width, self.screen_height))
+
         pygame.init()
         screen = pygame.display.set_mode((self.screen_width, self.screen_height))
         pygame.display.set_caption('2D Imitation Learning Scene')
@@ -68,21 +95,32 @@ class Scene:
 
     def update_scene(self):
         """
-        Updates and renders the scene including all agents.
+        Updates and renders the scene including all agents. Only the agents move, so after the first frame
+        only the areas the agents were drawn to in the last frame are restored from the background, and only
+        those and the areas of the new frame are updated on the display.
         """
-        self.screen.blit(self.background_image, (0, 0))
+        if self.full_redraw:
+            self.screen.blit(self.background_image, (0, 0))
+            dirty_rects = [self.screen.get_rect()]
+            self.full_redraw = False
+        else:
+            dirty_rects = self.agent_rects
+            for rect in dirty_rects:
+                self.screen.blit(self.background_image, rect, rect)
 
-        for agent in self.agents:
-            agent.render(self.screen)
+        self.agent_rects = [agent.render(self.screen) for agent in self.agents]
 
-        pygame.display.update()
+        if not self.headless:
+            pygame.display.update(dirty_rects + self.agent_rects)
 
     def run(self):
         """
-        Main loop for updating the scene at a fixed rate.
+        Main loop for updating the scene at a fixed rate. Headless scenes are not throttled.
         """
         self.update_scene()
-        self.clock.tick(60)
+
+        if not self.headless:
+            self.clock.tick(self.frame_rate)
 
     def take_screenshot(self, agent, width=200, height=200, offset_x=0, offset_y=0):
         """
@@ -95,28 +133,199 @@ class Scene:
             height (int): Height of the screenshot.
             offset_x (int): Horizontal offset from the center of the agent.
             offset_y (int): Vertical offset from the center of the agent.
+
+        Returns:
+            numpy.ndarray: A new (width, height, 3) float64 screenshot with values in [0, 1].
+        """
+        return self.capture(agent, np.empty((width, height, 3), dtype=np.float64), offset_x, offset_y)
+
+    def capture(self, agent, out, offset_x=0, offset_y=0):
+        """
+        Takes the screenshot of take_screenshot straight into a buffer of the caller, e.g. a frame of a
+        FrameRing, so the game loop allocates no frames. The size of the screenshot is the size of the buffer.
+
+        Only the pixels of the screenshot are sampled: a single affine warp rotates and crops the window around
+        the agent straight from the pixels of the screen, without copying or rotating the whole screen.
+
+        Parameters:
+            agent (Agent): The agent to center the screenshot on.
+            out (numpy.ndarray): The (width, height, 3) buffer to write to. uint8 buffers receive the pixel
+                values, floating point buffers the pixel values divided by 255.
+            offset_x (int): Horizontal offset from the center of the agent.
+            offset_y (int): Vertical offset from the center of the agent.
+
+        Returns:
+            numpy.ndarray: The buffer.
+        """
+        if out.ndim != 3 or out.shape[2] != 3:
+            raise ValueError(f"Expected a (width, height, 3) buffer, got shape {out.shape}")
+        if out.dtype != np.uint8 and not np.issubdtype(out.dtype, np.floating):
+            raise ValueError(f"Expected a uint8 or floating point buffer, got {out.dtype}")
+
+        width, height = out.shape[:2]
+
+        # Maps every screenshot pixel back to the screen: the agent lands on the screenshot center (shifted by
+        # the offset) and the screen is rotated by the agent angle + 90 degrees, counterclockwise
+        angle = math.radians(agent.angle + 90)
+        cos, sin = math.cos(angle), math.sin(angle)
+        center_x, center_y = width // 2 + offset_x, height // 2 + offset_y
+        matrix = np.array([[cos, -sin, agent.x - cos * center_x + sin * center_y],
+                           [sin, cos, agent.y - sin * center_x - cos * center_y]])
+
+        pixels, channels = self.get_screen_pixels()
+        crop = self.screenshot_buffers.get((width, height, pixels.shape[2]))
+        if crop is None:
+            crop = np.empty((height, width, pixels.shape[2]), dtype=np.uint8)
+            self.screenshot_buffers[(width, height, pixels.shape[2])] = crop
+
+        cv2.warpAffine(pixels, matrix, (width, height), dst=crop, flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                       borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        # Releases the lock of the screen
+        del pixels
+
+        # The screenshot is indexed [x, y] like pygame's surfarray. Channels are written one by one through
+        # views, so no temporary frame is allocated
+        for i, channel in enumerate(channels):
+            if out.dtype == np.uint8:
+                np.copyto(out[..., i], crop[..., channel].T)
+            else:
+                np.divide(crop[..., channel].T, 255.0, out=out[..., i], dtype=out.dtype)
+
+        return out
+
+    def get_screen_pixels(self):
+        """
+        Returns the pixels of the screen as a (height, width, channels) uint8 array, without copying them when
+        the screen has 32 bit pixels. The screen stays locked while the array is referenced.
+
+        Returns:
+            tuple: The pixel array and the indices of its red, green and blue channels.
+        """
+        if self.screen.get_bytesize() != 4:
+            return np.ascontiguousarray(pygame.surfarray.pixels3d(self.screen).transpose(1, 0, 2)), [0, 1, 2]
+
+        pixels = np.frombuffer(self.screen.get_buffer(), dtype=np.uint8)
+        pixels = pixels.reshape(self.screen_height, self.screen.get_pitch())[:, :self.screen_width * 4]
+        pixels = pixels.reshape(self.screen_height, self.screen_width, 4)
+
+        shifts = self.screen.get_shifts()[:3]
+        channels = [shift // 8 if sys.byteorder == 'little' else 3 - shift // 8 for shift in shifts]
+
+        return pixels, channels
+
+
+class FrameRing:
+    """
+    A ring of preallocated screenshot frames for Scene.capture. Frames are handed out in turn and reused
+    after every len(ring) frames, so a frame must be consumed (e.g. saved) before the ring wraps around to it.
+
+    Attributes:
+        frames (numpy.ndarray): The (size, width, height, 3) frames.
+        index (int): The index of the next frame.
+    """
+
+    def __init__(self, size, width=200, height=200, dtype=np.uint8):
+        """
+        Allocates the frames of the ring.
+
+        Parameters:
+            size (int): The number of frames.
+            width (int): Width of the frames.
+            height (int): Height of the frames.
+            dtype (numpy.dtype): The dtype of the frames, uint8 or floating point.
+        """
+        self.frames = np.zeros((size, width, height, 3), dtype=dtype)
+        self.index = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def next(self):
+        """
+        Returns the next frame of the ring.
+
+        Returns:
+            numpy.ndarray: A (width, height, 3) view of the frame.
         """
-        screenshot_surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        frame = self.frames[self.index]
+        self.index = (self.index + 1) % len(self.frames)
+        return frame
 
-        screen_surface = self.screen.copy()
 
-        angle = agent.angle + 90
+class SpriteAtlas:
+    """
+    Shares sprite images between agents: every image file is loaded and scaled once, and the rotated
+    variants of the images are cached, so rendering an agent is a single blit once its angles have been seen.
+    Angles are rounded to multiples of rotation_step degrees, and the least recently used rotated images are
+    evicted once the cache holds cache_size of them.
 
-        rotated_surface = pygame.transform.rotozoom(screen_surface, angle, 1.0)
-        rotated_rect = rotated_surface.get_rect(center=(width // 2, height // 2))
+    Attributes:
+        rotation_step (float): The angle resolution of the rotated images in degrees.
+        cache_size (int): The maximum number of cached rotated images.
+        images (dict): The loaded images, by path and scale.
+        rotated_images (collections.OrderedDict): The rotated images by image and angle step, least recently
+            used first.
+        stats (dict): The number of rotations and cache hits.
+    """
 
-        dx = self.screen_width // 2 - agent.x
-        dy = self.screen_height // 2 - agent.y
+    def __init__(self, rotation_step=1.0, cache_size=4096):
+        self.rotation_step = rotation_step
+        self.cache_size = cache_size
+        self.images = {}
+        self.rotated_images = OrderedDict()
+        self.stats = {'rotations': 0, 'hits': 0}
 
-        cos = math.cos(math.radians(-angle))
-        sin = math.sin(math.radians(-angle))
+    def load(self, path, scale=1.0):
+        """
+        Loads an image file, scaled by a factor. Every path and scale is loaded from disk only once.
 
-        rotated_rect.x += dx * cos - dy * sin + offset_x
-        rotated_rect.y += dx * sin + dy * cos + offset_y
+        Parameters:
+            path (str): The path of the image file.
+            scale (float): Scale factor for the image.
 
-        screenshot_surface.blit(rotated_surface, rotated_rect)
+        Returns:
+            pygame.Surface: The shared image. It must not be drawn on.
+        """
+        key = (os.path.abspath(path), scale)
+        if key not in self.images:
+            image = pygame.image.load(path)
+            image = pygame.transform.scale(image, (int(image.get_width() * scale), int(image.get_height() * scale)))
+            self.images[key] = image
+
+        return self.images[key]
 
-        return pygame.surfarray.array3d(screenshot_surface) / 255.0
+    def rotate(self, image, angle):
+        """
+        Returns an image rotated counterclockwise by an angle rounded to rotation_step.
+
+        Parameters:
+            image (pygame.Surface): The image to rotate.
+            angle (float): The rotation angle in degrees.
+
+        Returns:
+            pygame.Surface: The cached rotated image. It must not be drawn on.
+        """
+        steps = round(360 / self.rotation_step)
+        key = (image, round(angle / self.rotation_step) % steps)
+
+        rotated_image = self.rotated_images.get(key)
+        if rotated_image is not None:
+            self.rotated_images.move_to_end(key)
+            self.stats['hits'] += 1
+            return rotated_image
+
+        if len(self.rotated_images) >= self.cache_size:
+            self.rotated_images.popitem(last=False)
+
+        rotated_image = pygame.transform.rotate(image, key[1] * self.rotation_step)
+        self.rotated_images[key] = rotated_image
+        self.stats['rotations'] += 1
+
+        return rotated_image
+
+
+# The atlas shared by all agents that are not given an atlas of their own
+sprite_atlas = SpriteAtlas()
 
 
 class Agent:
@@ -129,9 +338,10 @@ class Agent:
         x (int): x position of the agent.
         y (int): y position of the agent.
         angle (float): Orientation angle of the agent.
+        atlas (SpriteAtlas): The atlas caching the rotated images of the agent.
     """
 
-    def __init__(self, image, x, y, angle):
+    def __init__(self, image, x, y, angle, atlas=None):
         """
         Initializes the agent with its image, position, and orientation.
 
@@ -140,6 +350,7 @@ class Agent:
             x (int): Initial x position of the agent.
             y (int): Initial y position of the agent.
             angle (float): Initial orientation angle of the agent.
+            atlas (SpriteAtlas or None): The atlas caching the rotated images, the shared atlas when None.
         """
         self.image = image
         self.image_width = image.get_width()
@@ -147,6 +358,7 @@ class Agent:
         self.x = x
         self.y = y
         self.angle = angle
+        self.atlas = sprite_atlas if atlas is None else atlas
 
     def render(self, screen):
         """
@@ -154,14 +366,17 @@ class Agent:
 
         Parameters:
             screen (pygame.Surface): The display surface to render the agent on.
+
+        Returns:
+            pygame.Rect: The area of the screen the agent was drawn to.
         """
-        rotated_agent = pygame.transform.rotate(self.image, -self.angle)
+        rotated_agent = self.atlas.rotate(self.image, -self.angle)
 
         center = self.image.get_rect(topleft=(self.x, self.y)).center
         center = (center[0] - self.image_width / 2, center[1] - self.image_height / 2)
         agent_rect = rotated_agent.get_rect(center=center)
 
-        screen.blit(rotated_agent, agent_rect)
+        return screen.blit(rotated_agent, agent_rect)
 
     def update_position(self, x, y, angle):
         """
@@ -184,7 +399,7 @@ class Car(Agent):
     Inherits from Agent and adds velocity, mass, and drag for basic physics simulation.
     """
 
-    def __init__(self, x, y, angle, scale=1.0):
+    def __init__(self, x, y, angle, scale=1.0, atlas=None):
         """
         Initializes the car agent with position, orientation, and scale for its image.
 
@@ -193,16 +408,20 @@ class Car(Agent):
             y (int): Initial y position of the car.
             angle (float): Initial orientation angle of the car.
             scale (float): Scale factor for the car image.
+            atlas (SpriteAtlas or None): The atlas of the car image, the shared atlas when None.
         """
-        image = pygame.image.load('./scene_assets/car.png')
-        image = pygame.transform.scale(image, (int(image.get_width() * scale), int(image.get_height() * scale)))
+        atlas = sprite_atlas if atlas is None else atlas
+        image = atlas.load(os.path.join(ASSETS_FOLDER, 'car.png'), scale)
 
-        super().__init__(image, x, y, angle)
+        super().__init__(image, x, y, angle, atlas)
 
         self.velocity = 0.0
         self.mass = 1200
         self.drag_coefficient = 8.0
 
+        # The autopilot screenshot, reused every frame
+        self.observation = np.empty((200, 200, 3), dtype=np.float32)
+
     def update_physics(self, steer, throttle, brake):
         """
         Updates the car's physics based on throttle and steering input.
@@ -232,9 +451,8 @@ class Car(Agent):
 
     def get_autopilot_control(self, scene, model):
         if model:
-            image = scene.take_screenshot(self)
-            image = image.transpose((2, 0, 1))
-            image = torch.from_numpy(image).float().unsqueeze(0)
+            image = scene.capture(self, self.observation)
+            image = torch.from_numpy(image.transpose((2, 0, 1))).unsqueeze(0)
 
             speed = torch.tensor([self.velocity], dtype=torch.float32).unsqueeze(0)
 
@@ -243,3 +461,92 @@ class Car(Agent):
                 steer, throttle, brake = tuple(output.squeeze().tolist())
 
             return steer, throttle, brake
+
+
+class CarBatch:
+    """
+    Holds the state of many cars as NumPy arrays and steps all of them at once with the physics of
+    Car.update_physics. Stepping a batch gives the positions, angles and velocities of stepping every car on
+    its own, up to the last bits of NumPy's cos and sin, which allows running many rollouts in one process.
+
+    Attributes:
+        x (numpy.ndarray): x positions of the cars.
+        y (numpy.ndarray): y positions of the cars.
+        angle (numpy.ndarray): Orientation angles of the cars.
+        velocity (numpy.ndarray): Velocities of the cars.
+        mass (float): Mass of every car.
+        drag_coefficient (float): Drag coefficient of every car.
+    """
+
+    def __init__(self, x, y, angle, velocity=0.0):
+        """
+        Initializes the batch from the state of every car. Scalars are broadcast to the size of the batch.
+
+        Parameters:
+            x (array-like): Initial x positions of the cars.
+            y (array-like): Initial y positions of the cars.
+            angle (array-like): Initial orientation angles of the cars.
+            velocity (array-like): Initial velocities of the cars.
+        """
+        x, y, angle, velocity = np.broadcast_arrays(*(np.array(v, dtype=np.float64) for v in (x, y, angle, velocity)))
+
+        self.x = x.copy()
+        self.y = y.copy()
+        self.angle = angle.copy()
+        self.velocity = velocity.copy()
+        self.mass = 1200
+        self.drag_coefficient = 8.0
+
+    @classmethod
+    def from_cars(cls, cars):
+        """
+        Creates a batch from the current state of car agents.
+
+        Parameters:
+            cars (list): The Car agents.
+
+        Returns:
+            CarBatch: The batch holding one entry per car.
+        """
+        return cls([car.x for car in cars], [car.y for car in cars], [car.angle for car in cars],
+                   [car.velocity for car in cars])
+
+    def __len__(self):
+        return len(self.x)
+
+    def update_physics(self, steer, throttle, brake):
+        """
+        Updates the physics of every car. The operations are the ones of Car.update_physics in the same order.
+
+        Parameters:
+            steer (array-like): Steering input of every car, or one input for all cars.
+            throttle (array-like): Throttle input of every car, or one input for all cars.
+            brake (array-like): Brake input of every car, or one input for all cars.
+        """
+        throttle_force = (np.asarray(throttle, dtype=np.float64) + .25) * 20
+        drag_force = self.drag_coefficient * self.velocity
+        net_force = throttle_force - drag_force - np.asarray(brake, dtype=np.float64) * 25
+        acceleration = net_force / self.mass
+
+        self.velocity += acceleration
+        np.maximum(self.velocity, 0.0, out=self.velocity)
+        np.minimum(self.velocity, 1.0, out=self.velocity)
+
+        self.angle += (np.asarray(steer, dtype=np.float64) * 1.5) * self.velocity
+        np.mod(self.angle, 360, out=self.angle)
+
+        direction = np.radians(self.angle - 90)
+        self.x += np.cos(direction) * self.velocity
+        self.y += np.sin(direction) * self.velocity
+
+    def update_cars(self, cars):
+        """
+        Copies the state of the batch to car agents, e.g. to render them.
+
+        Parameters:
+            cars (list): The Car agents, in batch order.
+        """
+        for car, x, y, angle, velocity in zip(cars, self.x.tolist(), self.y.tolist(), self.angle.tolist(),
+                                              self.velocity.tolist()):
+            car.update_position(x, y, angle)
+            car.velocity = velocity
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The simulation modules import each other like the scripts do when they are run from their folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
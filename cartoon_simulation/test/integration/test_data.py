@@ -9,7 +9,7 @@ def test_data_manager_and_loader(tmp_path):
     targets = np.random.rand(3)
 
     manager.save(image, scalars, targets)
-    manager.h5file.close()
+    manager.close()
 
     dataset = ImitationDataset(str(tmp_path))
     read_image, read_scalars, read_targets = dataset[0]
@@ -0,0 +1,32 @@
+import numpy as np
+
+from cartoon_simulation.env import CartoonEnv, VectorEnv
+
+
+def test_vector_env_matches_single_envs():
+    """Test that the subprocess environments give the observations of environments stepped one by one."""
+    starts = [(300, 300, 0), (400, 350, 90)]
+    actions = np.array([[0.5, 1.0, 0.0], [-0.5, 0.5, 0.0]])
+    envs = [CartoonEnv(start=start, max_steps=3) for start in starts]
+    for env in envs:
+        env.reset()
+
+    with VectorEnv(2, starts=starts, max_steps=3) as vector_env:
+        images, velocities = vector_env.reset()
+        for _ in range(2):
+            (images, velocities), dones, infos = vector_env.step(actions)
+            results = [env.step(action) for env, action in zip(envs, actions)]
+
+            assert not dones.any()
+            for index, ((image, velocity), done, info) in enumerate(results):
+                assert np.array_equal(images[index], image)
+                assert velocities[index] == velocity
+                assert infos[index] == info
+
+        # The third step ends the episodes, which restart from the start
+        _, dones, infos = vector_env.step(actions)
+
+        assert dones.all()
+        assert [info['steps'] for info in infos] == [3, 3]
+        assert np.array_equal(velocities, [0.0, 0.0])
+        assert np.array_equal(images, [env.reset()[0] for env in envs])
@@ -1,5 +1,7 @@
 import os
+import pickle
 import pytest
+import h5py
 import numpy as np
 from unittest.mock import MagicMock, patch
 from cartoon_simulation.data import DataManager, ImitationDataset
@@ -29,9 +31,53 @@ class TestDataManager:
         scalars = np.zeros((1,))
         targets = np.zeros((3,))
         manager.save(image, scalars, targets)
+        manager.flush()
 
         for dataset in ['images', 'scalars', 'targets']:
-            assert manager.h5file[dataset].shape[0] == 1
+            assert manager.h5file[dataset].shape[0] >= 1
+        assert manager.length == 1
+
+    def test_save_is_buffered(self, tmp_path):
+        manager = DataManager(str(tmp_path), 'buffered', buffer_size=4)
+        for _ in range(3):
+            manager.save(np.zeros((200, 200, 3)), [0], [0, 0, 0])
+
+        assert manager.h5file['images'].shape[0] == 0
+
+        manager.save(np.zeros((200, 200, 3)), [0], [0, 0, 0])
+        assert manager.h5file['images'].shape[0] == 4
+        assert manager.buffered == 0
+
+    def test_datasets_grow_geometrically(self, tmp_path):
+        manager = DataManager(str(tmp_path), 'growth', buffer_size=2)
+        for _ in range(6):
+            manager.save(np.zeros((200, 200, 3)), [0], [0, 0, 0])
+
+        assert manager.length == 6
+        assert manager.h5file['images'].shape[0] == 8
+
+    def test_close_trims_datasets(self, tmp_path):
+        with DataManager(str(tmp_path), 'trim', buffer_size=4) as manager:
+            for i in range(5):
+                manager.save(np.full((200, 200, 3), i), [i], [i, i, i])
+
+        assert manager.h5file is None
+
+        dataset = ImitationDataset(str(tmp_path))
+        assert len(dataset) == 5
+        for i in range(5):
+            _, scalars, _ = dataset[i]
+            assert scalars[0] == i
+
+    def test_uint8_image_layout(self, tmp_path):
+        with DataManager(str(tmp_path), 'compact', image_dtype=np.uint8) as manager:
+            assert manager.h5file['images'].dtype == np.uint8
+            assert manager.h5file['images'].attrs['scale'] == 255.0
+            manager.save(np.full((200, 200, 3), 0.5), [0], [0, 0, 0])
+
+        image, _, _ = ImitationDataset(str(tmp_path))[0]
+        assert image.dtype == np.float32
+        assert np.allclose(image, 128 / 255.0)
 
 # Unit Tests for ImitationDataset
 class TestImitationDataset:
@@ -43,7 +89,7 @@ class TestImitationDataset:
     def dataset(self, tmp_path, manager):
         # Create some dummy data files
         manager.save(np.zeros((200, 200, 3)), [0], [0, 1, 2])
-        manager.h5file.close()  # Close to simulate completed file writing
+        manager.close()  # Close to simulate completed file writing
         return ImitationDataset(str(tmp_path))
 
     def test_file_paths(self, dataset, tmp_path):
@@ -57,4 +103,75 @@ class TestImitationDataset:
         image, scalars, targets = dataset[0]
         assert image.shape == (3, 200, 200)
         assert scalars.shape == (1,)
-        assert targets.shape == (3,)
\ No newline at end of file
+        assert targets.shape == (3,)
+
+    def test_file_handles_are_reused(self, dataset):
+        for _ in range(3):
+            dataset[0]
+
+        assert dataset.cache_info() == {'opens': 1, 'hits': 2, 'open_files': 1}
+
+    def test_file_cache_evicts_least_recently_used(self, tmp_path, manager):
+        manager.save(np.zeros((200, 200, 3)), [0], [0, 1, 2])
+        manager.close()
+        with DataManager(str(tmp_path), 'other') as other:
+            other.save(np.zeros((200, 200, 3)), [1], [0, 1, 2])
+
+        dataset = ImitationDataset(str(tmp_path), cache_size=1)
+        dataset[0]
+        dataset[1]
+        dataset[0]
+
+        assert dataset.cache_info() == {'opens': 3, 'hits': 0, 'open_files': 1}
+
+    def test_file_cache_is_not_inherited(self, dataset):
+        dataset[0]
+        dataset.cache_pid = -1  # simulate a forked DataLoader worker
+        dataset[0]
+
+        assert dataset.cache_info() == {'opens': 1, 'hits': 0, 'open_files': 1}
+
+    def test_pickle_drops_file_handles(self, dataset):
+        dataset[0]
+        restored = pickle.loads(pickle.dumps(dataset))
+
+        assert restored.cache_info()['open_files'] == 0
+        image, _, _ = restored[0]
+        assert image.shape == (3, 200, 200)
+
+    def test_get_items_matches_get_item(self, tmp_path, manager):
+        for i in range(6):
+            manager.save(np.random.rand(200, 200, 3), [i], [i, i, i])
+        manager.close()
+        with DataManager(str(tmp_path), 'other') as other:
+            for i in range(6, 10):
+                other.save(np.random.rand(200, 200, 3), [i], [i, i, i])
+
+        dataset = ImitationDataset(str(tmp_path))
+        indices = [7, 0, 1, 2, 9, 5, 1]
+
+        for (image, scalars, targets), idx in zip(dataset.__getitems__(indices), indices):
+            expected_image, expected_scalars, expected_targets = dataset[idx]
+            assert np.array_equal(image, expected_image)
+            assert np.array_equal(scalars, expected_scalars)
+            assert np.array_equal(targets, expected_targets)
+
+    def test_delete_groups_drops_over_allocated_rows(self, tmp_path):
+        manager = DataManager(str(tmp_path), 'unclean', buffer_size=2)
+        for i in range(5):
+            manager.save(np.zeros((200, 200, 3)), [i], [i, i, i])
+        manager.flush()
+        # simulate a session that was not closed cleanly, leaving over-allocated rows behind
+        manager.h5file.close()
+        manager.h5file = None
+
+        dataset = ImitationDataset(str(tmp_path))
+        assert len(dataset) == 5
+        assert dataset.delete_groups(1, 3) == 0
+
+        assert len(dataset) == 3
+        assert [dataset[i][1][0] for i in range(3)] == [0, 3, 4]
+        dataset.close_files()
+        with h5py.File(dataset.file_paths[0], 'r') as file:
+            assert file['images'].shape[0] == 3
+            assert file.attrs['length'] == 3
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from cartoon_simulation.env import CartoonEnv, get_policy_actions, get_episode_metrics
+from cartoon_simulation.model import CNNModel
+
+
+@pytest.fixture()
+def env():
+    return CartoonEnv(max_steps=5)
+
+
+def test_reset_observation(env):
+    """Test that a reset returns the screenshot and velocity of a car standing at the start."""
+    image, velocity = env.reset()
+
+    assert image.shape == (200, 200, 3) and image.dtype == np.float32
+    assert 0.0 <= image.min() and image.max() <= 1.0
+    assert velocity == 0.0
+    assert (env.car.x, env.car.y, env.car.angle) == (300, 300, 0)
+
+
+def test_step_moves_car(env):
+    """Test that throttle moves the car and that episodes end after max_steps."""
+    env.reset()
+    for _ in range(5):
+        (image, velocity), done, info = env.step((0.0, 1.0, 0.0))
+
+    assert done
+    assert velocity > 0.0 and info['steps'] == 5
+    assert info['y'] < 300
+
+
+def test_step_matches_scene_screenshot(env):
+    """Test that the observation is the screenshot the autopilot sees."""
+    env.reset()
+    (image, velocity), _, _ = env.step((0.5, 1.0, 0.0))
+
+    assert np.allclose(image, env.scene.take_screenshot(env.car))
+
+
+def test_policy_actions():
+    """Test that a batch of observations gives one action per environment."""
+    model = CNNModel().eval()
+    images = np.random.default_rng(0).integers(0, 256, (4, 200, 200, 3), dtype=np.uint8)
+
+    actions = get_policy_actions(model, images, np.zeros(4))
+
+    assert actions.shape == (4, 3)
+    assert np.allclose(actions[0], get_policy_actions(model, images[:1] / 255.0, np.zeros(1))[0], atol=1e-5)
+
+
+def test_track_detection():
+    """Test that the asphalt is on the track and the grass is not."""
+    env = CartoonEnv(start=(380, 455, 90))
+    env.reset()
+    assert env.get_info()['on_track']
+
+    env.reset((300, 150, 0))
+    assert not env.get_info()['on_track']
+
+
+def test_episode_metrics():
+    """Test the metrics of a short episode driving right at constant speed."""
+    infos = [{'x': 1.0 * step, 'y': 0.0, 'velocity': 1.0, 'on_track': step < 3} for step in range(1, 7)]
+    actions = [(steer, 1.0, 0.0) for steer in [0.0, 0.0, 1.0, 1.0, 0.0, 0.0]]
+
+    metrics = get_episode_metrics(infos, actions, (0.0, 0.0, 90.0), frame_rate=2)
+
+    assert metrics['off_track_time'] == 2.0
+    assert metrics['off_track_fraction'] == 4 / 6
+    assert metrics['mean_speed'] == 1.0
+    assert metrics['distance'] == 6.0
+    assert metrics['steering_jerk'] == 1.0
+    assert metrics['steps'] == 6
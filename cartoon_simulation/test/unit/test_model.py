@@ -1,7 +1,7 @@
 import pytest
 import torch
 
-from cartoon_simulation.model import CNNModel, save_model, load_model
+from cartoon_simulation.model import CNNModel, save_model, load_model, quantize_model, export_model, load_inference_model
 
 width = 200
 height = 200
@@ -35,3 +35,45 @@ class TestModelSavingLoading:
         loaded_model = load_model(str(tmp_path), model_name)
 
         assert model.state_dict().keys() == loaded_model.state_dict().keys()
+
+class TestModelExport:
+    @pytest.fixture
+    def model(self):
+        return CNNModel()
+
+    def test_export_matches_eval_model(self, tmp_path, model):
+        save_model(str(tmp_path), model, 'test_model')
+        export_model(str(tmp_path), model, 'test_model')
+        assert (tmp_path / 'test_model.pt').exists()
+
+        exported = load_inference_model(str(tmp_path), 'test_model')
+        assert isinstance(exported, torch.jit.ScriptModule)
+
+        x_img = torch.rand(2, 3, height, width)
+        scalar = torch.rand(2, 1)
+        with torch.no_grad():
+            assert torch.allclose(exported(x_img, scalar), model.eval()(x_img, scalar), atol=1e-5)
+
+    def test_load_inference_model_without_export(self, tmp_path, model):
+        save_model(str(tmp_path), model, 'test_model')
+
+        loaded = load_inference_model(str(tmp_path), 'test_model')
+        assert isinstance(loaded, CNNModel)
+        assert not loaded.training
+
+class TestModelQuantization:
+    @pytest.fixture
+    def model(self):
+        return CNNModel()
+
+    def test_quantized_save_load(self, tmp_path, model):
+        quantized = quantize_model(model)
+        save_model(str(tmp_path), quantized, 'test_model_int8')
+
+        loaded = load_model(str(tmp_path), 'test_model', quantized=True)
+
+        x_img = torch.rand(2, 3, height, width)
+        scalar = torch.rand(2, 1)
+        with torch.no_grad():
+            assert torch.allclose(loaded(x_img, scalar), quantized(x_img, scalar))
+            assert torch.allclose(loaded(x_img, scalar), model.eval()(x_img, scalar), atol=1e-1)
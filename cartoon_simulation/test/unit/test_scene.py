@@ -1,3 +1,8 @@
+import os
+import math
+import time
+
+import numpy as np
 import pytest
 import pygame
 
@@ -31,3 +36,221 @@ def test_update_screen(scene_fixture):
     """Test the update_screen method of the Scene class."""
     scene_fixture.update_scene()
     assert scene_fixture.screen.get_at((0, 0)) == (0, 0, 0, 255)
+
+
+@pytest.fixture()
+def headless_scene_fixture():
+    return scene.Scene(background_image, initial_x, initial_y, initial_angle, headless=True)
+
+
+def test_headless_scene_init(headless_scene_fixture):
+    """Test that a headless scene renders to an offscreen surface without a clock."""
+    assert headless_scene_fixture.headless
+    assert headless_scene_fixture.clock is None
+    assert type(headless_scene_fixture.screen) == pygame.Surface
+    assert headless_scene_fixture.screen is not pygame.display.get_surface()
+    assert headless_scene_fixture.screen.get_size() == (100, 100)
+
+
+def test_headless_scene_keeps_video_driver(monkeypatch):
+    """Test that a headless scene does not change the video driver a later windowed scene would use."""
+    monkeypatch.delenv('SDL_VIDEODRIVER', raising=False)
+    scene.Scene(background_image, initial_x, initial_y, initial_angle, headless=True)
+
+    assert 'SDL_VIDEODRIVER' not in os.environ
+
+
+def test_headless_run_is_not_throttled(headless_scene_fixture):
+    """Test that headless frames are not limited to the frame rate."""
+    start = time.perf_counter()
+    for _ in range(120):
+        headless_scene_fixture.run()
+
+    assert time.perf_counter() - start < 120 / headless_scene_fixture.frame_rate
+
+
+def test_headless_screenshot(headless_scene_fixture):
+    """Test that a headless scene renders agents and takes screenshots like a windowed scene."""
+    agent_image = pygame.Surface((10, 10))
+    agent_image.fill((255, 0, 0))
+    agent = scene.Agent(agent_image, 50, 50, 0)
+    headless_scene_fixture.add_agent(agent)
+
+    headless_scene_fixture.run()
+    screenshot = headless_scene_fixture.take_screenshot(agent, width=20, height=20)
+
+    assert headless_scene_fixture.screen.get_at((50, 50)) == (255, 0, 0, 255)
+    assert screenshot.shape == (20, 20, 3)
+
+
+
+def test_dirty_rect_rendering_matches_full_redraw():
+    """Test that restoring only the agent areas leaves the screen of a full redraw."""
+    gradient = pygame.surfarray.make_surface(np.indices((100, 100, 3)).sum(axis=0).astype(np.uint8))
+    agent_image = pygame.Surface((10, 6))
+    agent_image.fill((255, 0, 0))
+
+    dirty_scene = scene.Scene(gradient, 0, 0, 0, headless=True)
+    agents = [scene.Agent(agent_image, 20, 20, 0), scene.Agent(agent_image, 60, 40, 45)]
+    for agent in agents:
+        dirty_scene.add_agent(agent)
+
+    for _ in range(20):
+        for agent in agents:
+            agent.update_position(agent.x + 3, agent.y + 2, agent.angle + 17)
+        dirty_scene.run()
+
+    full_scene = scene.Scene(gradient, 0, 0, 0, headless=True)
+    for agent in agents:
+        full_scene.add_agent(agent)
+    full_scene.run()
+
+    assert np.array_equal(pygame.surfarray.array3d(dirty_scene.screen), pygame.surfarray.array3d(full_scene.screen))
+    assert not dirty_scene.full_redraw
+
+
+def test_sprite_atlas_caches_rotations():
+    """Test that rotations are rounded to the rotation step, shared by agents and reused."""
+    atlas = scene.SpriteAtlas()
+    image = pygame.Surface((10, 6))
+    agents = [scene.Agent(image, 0, 0, 90.2, atlas), scene.Agent(image, 50, 50, 89.9, atlas)]
+    rotated_images = [atlas.rotate(agent.image, -agent.angle) for agent in agents]
+
+    assert rotated_images[0] is rotated_images[1]
+    assert rotated_images[0].get_size() == (6, 10)
+    assert atlas.stats == {'rotations': 1, 'hits': 1}
+
+
+def test_sprite_atlas_evicts_least_recently_used():
+    """Test that the least recently used rotation is evicted once the cache is full."""
+    atlas = scene.SpriteAtlas(rotation_step=10.0, cache_size=2)
+    image = pygame.Surface((10, 6))
+    first = atlas.rotate(image, 10)
+    atlas.rotate(image, 20)
+    atlas.rotate(image, 10)
+    atlas.rotate(image, 30)
+
+    assert atlas.rotate(image, 10) is first
+    assert [step for _, step in atlas.rotated_images] == [3, 1]
+
+
+def test_sprite_atlas_loads_images_once():
+    """Test that every car shares the image loaded by the atlas."""
+    atlas = scene.SpriteAtlas()
+    cars = [scene.Car(0, 0, 0, 0.1, atlas), scene.Car(10, 10, 0, 0.1, atlas), scene.Car(0, 0, 0, 0.2, atlas)]
+
+    assert cars[0].image is cars[1].image
+    assert cars[0].image is not cars[2].image
+    assert len(atlas.images) == 2
+
+
+def rotozoom_screenshot(scene_object, agent, width, height):
+    """The screenshot of the previous take_screenshot, which rotated the whole screen."""
+    screenshot_surface = pygame.Surface((width, height), pygame.SRCALPHA)
+    angle = agent.angle + 90
+
+    rotated_surface = pygame.transform.rotozoom(scene_object.screen.copy(), angle, 1.0)
+    rotated_rect = rotated_surface.get_rect(center=(width // 2, height // 2))
+
+    dx = scene_object.screen_width // 2 - agent.x
+    dy = scene_object.screen_height // 2 - agent.y
+    cos = math.cos(math.radians(-angle))
+    sin = math.sin(math.radians(-angle))
+    rotated_rect.x += dx * cos - dy * sin
+    rotated_rect.y += dx * sin + dy * cos
+
+    screenshot_surface.blit(rotated_surface, rotated_rect)
+    return pygame.surfarray.array3d(screenshot_surface) / 255.0
+
+
+def test_screenshot_matches_rotozoom():
+    """Test that the affine crop matches the rotated full screen crop within a pixel tolerance."""
+    racetrack = pygame.image.load(os.path.join(scene.ASSETS_FOLDER, 'racetrack.jpeg'))
+    scene_object = scene.Scene(racetrack, 0, 0, 0, headless=True)
+    scene_object.run()
+    agent = scene.Agent(pygame.Surface((1, 1)), 0, 0, 0)
+
+    rng = np.random.default_rng(0)
+    for x, y, angle in zip(rng.uniform(100, 700, 10), rng.uniform(100, 500, 10), rng.uniform(0, 360, 10)):
+        agent.update_position(x, y, angle)
+        difference = np.abs(scene_object.take_screenshot(agent) - rotozoom_screenshot(scene_object, agent, 200, 200))
+
+        assert difference.mean() < 0.02
+        assert (difference > 0.1).mean() < 0.05
+
+
+def test_capture_into_buffers():
+    """Test that captures into uint8 and float32 buffers hold the pixels of take_screenshot."""
+    colored_background = pygame.Surface((100, 100))
+    colored_background.fill((0, 100, 200))
+    scene_object = scene.Scene(colored_background, 0, 0, 0, headless=True)
+    scene_object.run()
+    agent = scene.Agent(pygame.Surface((10, 10)), 50, 50, 30)
+
+    screenshot = scene_object.take_screenshot(agent, width=20, height=30)
+    frame = np.zeros((20, 30, 3), dtype=np.uint8)
+    observation = np.zeros((20, 30, 3), dtype=np.float32)
+
+    assert scene_object.capture(agent, frame) is frame
+    assert scene_object.capture(agent, observation) is observation
+    assert np.array_equal(frame, np.rint(screenshot * 255))
+    assert np.allclose(observation, screenshot)
+    assert not scene_object.screen.get_locked()
+
+
+def test_capture_rejects_buffers(headless_scene_fixture):
+    """Test that buffers of the wrong shape or dtype are rejected."""
+    agent = scene.Agent(pygame.Surface((10, 10)), 50, 50, 0)
+
+    with pytest.raises(ValueError):
+        headless_scene_fixture.capture(agent, np.zeros((20, 20), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        headless_scene_fixture.capture(agent, np.zeros((20, 20, 3), dtype=np.int32))
+
+
+def test_frame_ring():
+    """Test that the ring hands out its frames in turn and wraps around."""
+    ring = scene.FrameRing(3, width=4, height=5)
+    frames = [ring.next() for _ in range(4)]
+
+    assert len(ring) == 3
+    assert frames[0].shape == (4, 5, 3) and frames[0].dtype == np.uint8
+    assert not np.shares_memory(frames[0], frames[1])
+    assert np.shares_memory(frames[0], frames[3])
+
+
+@pytest.fixture()
+def cars():
+    rng = np.random.default_rng(0)
+    return [scene.Car(x, y, angle, 0.1) for x, y, angle in rng.uniform(0.0, 360.0, (16, 3))]
+
+
+def test_car_batch_matches_car(cars):
+    """Test that stepping a batch gives the state of stepping every car on its own."""
+    batch = scene.CarBatch.from_cars(cars)
+    rng = np.random.default_rng(1)
+
+    for _ in range(300):
+        steer, throttle, brake = rng.uniform(-1.0, 1.0, (3, len(cars)))
+        brake = np.maximum(brake, 0.0)
+
+        batch.update_physics(steer, throttle, brake)
+        for car, s, t, b in zip(cars, steer.tolist(), throttle.tolist(), brake.tolist()):
+            car.update_physics(s, t, b)
+
+    # NumPy's cos and sin may differ from the math module in the last bit
+    np.testing.assert_allclose(batch.x, [car.x for car in cars], rtol=1e-12)
+    np.testing.assert_allclose(batch.y, [car.y for car in cars], rtol=1e-12)
+    np.testing.assert_allclose(batch.angle, [car.angle for car in cars], rtol=1e-12)
+    np.testing.assert_allclose(batch.velocity, [car.velocity for car in cars], rtol=1e-12)
+
+
+def test_car_batch_update_cars(cars):
+    """Test that the batch state is copied back to the car agents."""
+    batch = scene.CarBatch(np.arange(len(cars)), 0.0, 90.0, 0.5)
+    batch.update_physics(0.0, 1.0, 0.0)
+    batch.update_cars(cars)
+
+    assert len(batch) == len(cars)
+    assert [car.x for car in cars] == batch.x.tolist()
+    assert all(car.angle == 90.0 and car.velocity == batch.velocity[0] for car in cars)
@@ -1,14 +1,25 @@
+import argparse
+
 from torch.utils.data import DataLoader
-from torch.utils.data import random_split
+from torch.utils.tensorboard import SummaryWriter
 
 import matplotlib.pyplot as plt
 
 from model import *
 from data import ImitationDataset
+from imitation_shared.sampling import ContiguousBatchSampler
+from imitation_shared.splits import load_split
+from imitation_shared.training import TrainingEngine, ThroughputMeter, LossAccumulator, AsyncScalarWriter, \
+    add_training_args
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Trains the 2D simulation model")
+    add_training_args(parser, epochs=15, batch_size=128)
+    args = parser.parse_args()
+
     print_game_letterhead("2D Simulation Training")
+    print_args(args)
 
     print_formatted("Starting Training Process", GREEN)
 
@@ -21,12 +32,17 @@ def main():
     model = model.to(device)
 
     # Hyperparameters
-    num_epochs = 15
-    batch_size = 128
+    num_epochs = args.epochs
+    batch_size = args.batch_size
+
+    # Tensorboard writer
+    run_dir = f"runs/{time.strftime('%Y-%m-%d_%H-%M-%S')}"
+    tsbd = AsyncScalarWriter(SummaryWriter(log_dir=run_dir))
 
     # Loss function and optimizer
     criterion = nn.MSELoss()
     optimizer = torch.optim.Adam(model.parameters(), lr=0.0001)
+    engine = TrainingEngine.from_args(model, optimizer, criterion, device, args)
 
     # Load your entire dataset
     dataset = ImitationDataset("data/training")
@@ -35,67 +51,85 @@ def main():
         print_formatted("No data found in the training folder", RED)
         return
 
-    # Determine the lengths of your splits
-    train_size = int(0.8 * len(dataset))  # 80% for training
-    val_size = len(dataset) - train_size  # 20% for validation
+    # Split the dataset by session with the split manifest shared by all runs (about 20% for validation)
+    train_indices, validation_indices = load_split(dataset.file_paths, dataset.file_lengths)
+
+    # Without validation sessions the epochs are only measured on the training loss
+    has_validation = len(validation_indices) > 0
+    if not has_validation:
+        print_formatted("No validation sessions, record more sessions to validate the model", YELLOW)
 
-    # Split the dataset
-    train_dataset, validation_dataset = random_split(dataset, [train_size, val_size])
+    # Create dataloaders for the training and validation sets. The batch samplers keep neighbouring rows
+    # together so that ImitationDataset.__getitems__ can read each batch with a few contiguous slices.
+    train_sampler = ContiguousBatchSampler(train_indices, batch_size, shuffle=True)
+    validation_sampler = ContiguousBatchSampler(validation_indices, batch_size, shuffle=False)
 
-    # Create dataloaders for the training and validation sets
-    train_dataloader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=8, pin_memory=True)
-    validation_dataloader = DataLoader(validation_dataset, batch_size=batch_size, shuffle=True, num_workers=8, pin_memory=True)
+    train_dataloader = DataLoader(dataset, batch_sampler=train_sampler, num_workers=8, pin_memory=True)
+    validation_dataloader = DataLoader(dataset, batch_sampler=validation_sampler, num_workers=8, pin_memory=True)
 
     training_losses = []
     validation_losses = []
 
     for epoch in range(num_epochs):
-        running_loss = 0.0
+        running_loss = LossAccumulator(device)
+        throughput = ThroughputMeter()
 
-        # Training loop
-        for images_batch, scalars_batch, targets_batch in train_dataloader:
-            images_batch = images_batch.to(device, non_blocking=True)
-            scalars_batch = scalars_batch.to(device, non_blocking=True)
-            targets_batch = targets_batch.to(device, non_blocking=True)
+        # Training loop. The losses stay on the device and are only read back every log_interval steps.
+        engine.timer.start()
+        for i, batch in enumerate(train_dataloader):
+            engine.timer.mark('data')
+            images_batch, scalars_batch, targets_batch = engine.move_batch(batch)
+            engine.timer.mark('h2d')
 
-            optimizer.zero_grad(set_to_none=True)
+            loss = engine.train_step((images_batch, scalars_batch), targets_batch)
 
-            outputs = model(images_batch, scalars_batch)
-            loss = criterion(outputs, targets_batch)
+            running_loss.update(loss)
+            throughput.update(len(targets_batch))
+            if (i + 1) % args.log_interval == 0:
+                tsbd.add_scalar('Loss/Train', running_loss.interval_mean(), epoch * len(train_dataloader) + i)
 
-            loss.backward()
-            optimizer.step()
+        samples_per_second = throughput.samples_per_second()
 
-            running_loss += loss.item()
+        # Save losses for plotting
+        training_losses.append(running_loss.mean())
+        tsbd.add_scalar('Loss/TrainEpoch', training_losses[-1], epoch)
+        tsbd.add_scalar('Throughput/TrainSamplesPerSecond', samples_per_second, epoch)
+        summary = f"Training Loss: {training_losses[-1]:.4f}"
 
         # Validation loop
-        model.eval()
-        with torch.no_grad():
-            validation_loss = 0.0
-            for images_batch, scalars_batch, targets_batch in validation_dataloader:
-                images_batch, scalars_batch, targets_batch = images_batch.to(device), scalars_batch.to(
-                    device), targets_batch.to(device)
+        if has_validation:
+            engine.eval()
+            validation_loss = LossAccumulator(device)
+            for batch in validation_dataloader:
+                images_batch, scalars_batch, targets_batch = engine.move_batch(batch)
 
-                outputs = model(images_batch, scalars_batch)
-                loss = criterion(outputs, targets_batch)
+                loss = engine.eval_step((images_batch, scalars_batch), targets_batch)
 
-                validation_loss += loss.item()
+                validation_loss.update(loss)
 
-        # Save losses for plotting
-        training_losses.append(running_loss / len(train_dataloader))
-        validation_losses.append(validation_loss / len(validation_dataloader))
+            validation_losses.append(validation_loss.mean())
+            tsbd.add_scalar('Loss/ValidationEpoch', validation_losses[-1], epoch)
+            summary += f" - Validation Loss: {validation_losses[-1]:.4f}"
+
+        print_formatted(f"Epoch {epoch + 1}/{num_epochs} - {summary} - {samples_per_second:.1f} samples/s")
+
+        if engine.timer.enabled:
+            for phase, milliseconds in engine.timer.summary().items():
+                tsbd.add_scalar(f'StepTime/{phase}', milliseconds, epoch)
+            print_formatted(f"Step time - {engine.timer.format_summary()}")
+            engine.timer.reset()
 
-        print_formatted(f"Epoch {epoch + 1}/{num_epochs} - Training Loss: {training_losses[-1]:.4f} - "
-                        f"Validation Loss: {validation_losses[-1]:.4f}")
+        engine.train()
 
-        model.train()
+    tsbd.close()
 
     # Save the model and plot the losses
     save_model("data/model", model, "model_state_dict")
 
     plt.figure(figsize=(10, 5))
     plt.plot(training_losses, label='Training Loss')
-    plt.plot(validation_losses, label='Validation Loss')
+    if validation_losses:
+        plt.plot(validation_losses, label='Validation Loss')
     plt.xlabel('Epochs')
     plt.ylabel('Loss')
     plt.legend()
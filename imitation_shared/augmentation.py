@@ -0,0 +1,125 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugmentation:
+    """
+    Augments a whole batch of images at once with tensor operations. Every sample draws its own parameters,
+    like the per-sample torchvision pipeline this replaces:
+
+        ColorJitter(brightness, contrast), GaussianBlur(blur_kernel, blur_sigma) and erasing_count times
+        RandomErasing(erasing_p, erasing_scale, erasing_ratio)
+
+    Brightness is applied before contrast. The parameters come from a generator of its own, so a seeded
+    augmentation repeats itself and does not disturb the global random state.
+
+    Attributes:
+        brightness (float): Brightness factors are drawn from [1 - brightness, 1 + brightness].
+        contrast (float): Contrast factors are drawn from [1 - contrast, 1 + contrast].
+        blur_kernel (int): The odd size of the Gaussian blur kernel.
+        blur_sigma (tuple): The range the blur sigma is drawn from.
+        erasing_count (int): The number of erasing attempts per sample.
+        erasing_p (float): The probability of each erasing attempt.
+        erasing_scale (tuple): The range of the erased area relative to the image area.
+        erasing_ratio (tuple): The range of the aspect ratio of the erased rectangles.
+        generator (torch.Generator): The generator of the random parameters.
+    """
+
+    def __init__(self, brightness=0.2, contrast=0.2, blur_kernel=3, blur_sigma=(0.1, 2.0), erasing_count=4,
+                 erasing_p=0.5, erasing_scale=(0.005, 0.01), erasing_ratio=(0.3, 3.3), seed=None):
+        self.brightness = brightness
+        self.contrast = contrast
+        self.blur_kernel = blur_kernel
+        self.blur_sigma = blur_sigma
+        self.erasing_count = erasing_count
+        self.erasing_p = erasing_p
+        self.erasing_scale = erasing_scale
+        self.erasing_ratio = erasing_ratio
+
+        self.generator = torch.Generator()
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    def get_state(self):
+        return self.generator.get_state()
+
+    def set_state(self, state):
+        self.generator.set_state(state)
+
+    def uniform(self, low, high, *size):
+        # Parameters are drawn on the CPU so that the sequence does not depend on the device of the batch
+        return torch.rand(size, generator=self.generator) * (high - low) + low
+
+    def __call__(self, images):
+        """
+        Augments a batch of images.
+
+        Parameters:
+            images (torch.Tensor): A (N, C, H, W) float batch with values in [0, 1].
+
+        Returns:
+            torch.Tensor: The augmented batch, in the memory format of the input.
+        """
+        channels_last = not images.is_contiguous() and images.is_contiguous(memory_format=torch.channels_last)
+
+        images = self.color_jitter(images)
+        images = self.gaussian_blur(images)
+        images = self.random_erasing(images)
+
+        return images.contiguous(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+
+    def color_jitter(self, images):
+        n = images.shape[0]
+        brightness = self.uniform(1 - self.brightness, 1 + self.brightness, n, 1, 1, 1).to(images.device)
+        contrast = self.uniform(1 - self.contrast, 1 + self.contrast, n, 1, 1, 1).to(images.device)
+
+        images = (images * brightness).clamp(0.0, 1.0)
+
+        # Contrast blends each image with the mean of its grayscale version, like torchvision's adjust_contrast
+        weights = torch.tensor([0.2989, 0.587, 0.114], device=images.device, dtype=images.dtype).view(1, 3, 1, 1)
+        mean = (images * weights).sum(dim=1, keepdim=True).mean(dim=(2, 3), keepdim=True)
+
+        return (contrast * images + (1 - contrast) * mean).clamp(0.0, 1.0)
+
+    def gaussian_blur(self, images):
+        n, c, h, w = images.shape
+        sigma = self.uniform(*self.blur_sigma, n, 1).to(images.device)
+
+        # One normalized 1D kernel per sample, applied along both axes as a grouped convolution
+        offsets = torch.arange(self.blur_kernel, device=images.device, dtype=images.dtype) - self.blur_kernel // 2
+        kernel = torch.exp(-0.5 * (offsets / sigma) ** 2)
+        kernel = (kernel / kernel.sum(dim=1, keepdim=True)).repeat_interleave(c, dim=0)
+
+        padding = self.blur_kernel // 2
+        x = images.reshape(1, n * c, h, w)
+        x = F.conv2d(F.pad(x, (padding, padding, 0, 0), mode='reflect'), kernel.view(n * c, 1, 1, -1), groups=n * c)
+        x = F.conv2d(F.pad(x, (0, 0, padding, padding), mode='reflect'), kernel.view(n * c, 1, -1, 1), groups=n * c)
+
+        return x.reshape(n, c, h, w)
+
+    def random_erasing(self, images):
+        n, c, h, w = images.shape
+        shape = (n, self.erasing_count)
+
+        area = self.uniform(*self.erasing_scale, *shape) * h * w
+        log_ratio = self.uniform(math.log(self.erasing_ratio[0]), math.log(self.erasing_ratio[1]), *shape)
+        ratio = torch.exp(log_ratio)
+
+        erase_h = torch.sqrt(area * ratio).round().long().clamp(1, h - 1)
+        erase_w = torch.sqrt(area / ratio).round().long().clamp(1, w - 1)
+        top = (torch.rand(shape, generator=self.generator) * (h - erase_h + 1)).long()
+        left = (torch.rand(shape, generator=self.generator) * (w - erase_w + 1)).long()
+        applied = torch.rand(shape, generator=self.generator) < self.erasing_p
+
+        rows = torch.arange(h).view(1, 1, h, 1)
+        cols = torch.arange(w).view(1, 1, 1, w)
+        top, left = top[..., None, None], left[..., None, None]
+        inside = ((rows >= top) & (rows < top + erase_h[..., None, None]) &
+                  (cols >= left) & (cols < left + erase_w[..., None, None]))
+        mask = (inside & applied[..., None, None]).any(dim=1)
+
+        return images.masked_fill(mask.unsqueeze(1).to(images.device), 0.0)
@@ -0,0 +1,27 @@
+import time
+
+import torch
+
+
+def measure_latency(model, inputs, iterations, warmup=5):
+    """
+    Measures the mean latency of a single-frame forward pass.
+
+    Parameters:
+        model (torch.nn.Module): The model to benchmark.
+        inputs (tuple): The model inputs for one frame.
+        iterations (int): The number of timed forward passes.
+        warmup (int): The number of untimed forward passes before timing.
+
+    Returns:
+        float: The mean latency in milliseconds.
+    """
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(*inputs)
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(*inputs)
+
+    return (time.perf_counter() - start) / iterations * 1000.0
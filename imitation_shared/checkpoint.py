@@ -0,0 +1,168 @@
+import os
+import json
+import random
+
+import numpy as np
+import torch
+
+
+def save_atomic(state, file_path):
+    """
+    Saves a checkpoint to a temporary file next to its destination and renames it into place, so a crash while
+    saving never leaves a truncated checkpoint behind.
+
+    Parameters:
+        state (dict): The checkpoint to save.
+        file_path (str): The destination path.
+    """
+    temp_path = file_path + '.tmp'
+    torch.save(state, temp_path)
+    os.replace(temp_path, file_path)
+
+
+def find_latest_run(runs_folder='runs'):
+    """
+    Finds the most recent run with a checkpoint. Run folders are named after their start time, so the most
+    recent run sorts last.
+
+    Parameters:
+        runs_folder (str): The folder holding the run folders.
+
+    Returns:
+        str or None: The folder of the run, or None if no run has a checkpoint.
+    """
+    try:
+        runs = sorted(os.listdir(runs_folder))
+    except FileNotFoundError:
+        return None
+
+    for run in reversed(runs):
+        run_dir = os.path.join(runs_folder, run)
+        if os.path.exists(os.path.join(run_dir, CheckpointManager.FOLDER, CheckpointManager.LATEST)):
+            return run_dir
+
+    return None
+
+
+def get_rng_state():
+    """
+    Returns the state of every random number generator used during training.
+
+    Returns:
+        dict: The python, numpy, torch and (if available) CUDA generator states.
+    """
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+
+def set_rng_state(state):
+    """
+    Restores the generator states returned by get_rng_state.
+
+    Parameters:
+        state (dict): The generator states.
+    """
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class CheckpointManager:
+    """
+    Keeps the checkpoints of a training run in a folder: the latest checkpoint, which is overwritten every
+    time training progresses, and the best keep_best end-of-epoch checkpoints ranked by validation loss.
+    The ranking is kept in an index file so that it survives a restart. Every run needs a folder of its own,
+    usually the FOLDER subfolder of the run folder, since the ranking only compares checkpoints of one run.
+
+    Attributes:
+        folder (str): The folder holding the checkpoints.
+        keep_best (int): The number of end-of-epoch checkpoints to keep.
+    """
+
+    FOLDER = 'checkpoints'
+    LATEST = 'latest.pth'
+    INDEX = 'best.json'
+
+    def __init__(self, folder, keep_best=3):
+        self.folder = folder
+        self.keep_best = keep_best
+
+        os.makedirs(folder, exist_ok=True)
+
+    def get_path(self, name):
+        return os.path.join(self.folder, name)
+
+    def save_latest(self, state):
+        save_atomic(state, self.get_path(self.LATEST))
+
+    def load_latest(self):
+        """
+        Loads the latest checkpoint.
+
+        Returns:
+            dict or None: The checkpoint, or None if the run has no checkpoint yet.
+        """
+        try:
+            # The checkpoint holds numpy arrays and generator states, which the weights only loader rejects
+            return torch.load(self.get_path(self.LATEST), map_location='cpu', weights_only=False)
+        except FileNotFoundError:
+            return None
+
+    def best(self):
+        """
+        Returns the kept end-of-epoch checkpoints, best first.
+
+        Returns:
+            list: Entries with the 'file', 'epoch' and 'validation_loss' of each checkpoint.
+        """
+        try:
+            with open(self.get_path(self.INDEX), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return []
+
+    def save_best(self, state, epoch, validation_loss):
+        """
+        Saves an end-of-epoch checkpoint if its validation loss is among the best keep_best, and deletes the
+        checkpoints that are no longer ranked, including an earlier checkpoint of the same epoch.
+
+        Parameters:
+            state (dict): The checkpoint to save.
+            epoch (int): The epoch that just finished.
+            validation_loss (float): The validation loss of the epoch.
+
+        Returns:
+            bool: True if the checkpoint was kept.
+        """
+        previous = self.best()
+        entry = {'file': f"epoch_{epoch:03d}.pth", 'epoch': epoch, 'validation_loss': validation_loss}
+
+        # A repeated epoch, e.g. after resuming from a mid-epoch checkpoint, replaces its earlier entry
+        ranked = sorted([e for e in previous if e['epoch'] != epoch] + [entry], key=lambda e: e['validation_loss'])
+        kept = ranked[:self.keep_best]
+        kept_files = {e['file'] for e in kept}
+
+        if entry in kept:
+            save_atomic(state, self.get_path(entry['file']))
+
+        temp_path = self.get_path(self.INDEX) + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(kept, file, indent=2)
+        os.replace(temp_path, self.get_path(self.INDEX))
+
+        # Files are only removed once the index no longer refers to them
+        for dropped_entry in previous:
+            if dropped_entry['file'] in kept_files:
+                continue
+            try:
+                os.remove(self.get_path(dropped_entry['file']))
+            except FileNotFoundError:
+                pass
+
+        return entry in kept
@@ -0,0 +1,93 @@
+import os
+
+import torch
+import torch.distributed as dist
+
+
+def init_distributed():
+    """
+    Joins the process group when the script was started by torchrun, e.g.
+
+        torchrun --nproc_per_node 8 train.py
+
+    The gloo backend is used, so the processes can share the cores of a CPU node. Each process gets an equal
+    share of the cores for its intra-op threads; torchrun would otherwise leave every process with a single
+    thread.
+
+    Returns:
+        tuple: The (rank, world_size) of this process, (0, 1) when the script was started directly.
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size == 1:
+        return 0, 1
+
+    dist.init_process_group(backend='gloo')
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+
+    return dist.get_rank(), world_size
+
+
+def cleanup_distributed():
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def broadcast_object(value, src=0):
+    """
+    Sends a picklable value from one process to all the others.
+
+    Parameters:
+        value (object): The value on the source process. Ignored on the other processes.
+        src (int): The rank of the source process.
+
+    Returns:
+        object: The value of the source process.
+    """
+    if not is_distributed():
+        return value
+
+    values = [value]
+    dist.broadcast_object_list(values, src=src)
+    return values[0]
+
+
+def all_gather_object(value):
+    """
+    Collects a picklable value from every process.
+
+    Parameters:
+        value (object): The value of this process.
+
+    Returns:
+        list: The values of all processes, indexed by rank.
+    """
+    if not is_distributed():
+        return [value]
+
+    values = [None] * dist.get_world_size()
+    dist.all_gather_object(values, value)
+    return values
+
+
+def all_reduce_sum(tensor):
+    """
+    Sums a tensor over all processes in place.
+
+    Parameters:
+        tensor (torch.Tensor): The local tensor.
+
+    Returns:
+        torch.Tensor: The same tensor, holding the sum over all processes.
+    """
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
@@ -0,0 +1,146 @@
+import numpy as np
+
+from torch.utils.data import Sampler
+
+
+def read_rows(dataset, rows, max_gap=4):
+    """
+    Reads rows of an HDF5 dataset with as few reads as possible. The requested rows are sorted and split
+    into runs wherever two neighbours are more than max_gap rows apart; each run is read with a single slice
+    and the rows are scattered back into the order they were requested in.
+
+    Parameters:
+        dataset (h5py.Dataset): The dataset to read from.
+        rows (array-like): The row indices to read, in any order and possibly repeated.
+        max_gap (int): The largest gap between two requested rows that is read through rather than split.
+
+    Returns:
+        numpy.ndarray: The requested rows, in the requested order.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    output = np.empty((len(rows), *dataset.shape[1:]), dtype=dataset.dtype)
+
+    if len(rows) == 0:
+        return output
+
+    order = np.argsort(rows, kind='stable')
+    sorted_rows = rows[order]
+
+    breaks = np.flatnonzero(np.diff(sorted_rows) > max_gap) + 1
+    for run in np.split(np.arange(len(rows)), breaks):
+        start, stop = sorted_rows[run[0]], sorted_rows[run[-1]] + 1
+        block = dataset[start:stop]
+        output[order[run]] = block[sorted_rows[run] - start]
+
+    return output
+
+
+class ContiguousBatchSampler(Sampler):
+    """
+    Batch sampler that keeps neighbouring dataset rows together so that a batch can be read with a few
+    slices instead of one small read per sample.
+
+    The sorted indices are cut into runs of run_length neighbours. Each epoch the run boundaries are moved by
+    a random offset, the runs are shuffled and the shuffled stream is cut into batches, which are shuffled
+    internally. Every index is still visited exactly once per epoch, and each batch is made of
+    batch_size / run_length runs taken from random places in the dataset.
+
+    In a distributed run every process creates the sampler with the same indices and seed and its own rank.
+    The batches of the epoch are dealt out to the processes in turn, so each process gets the same number of
+    batches; when the batches do not divide evenly the first batches of the epoch are repeated to fill up the
+    last round, or the incomplete round is dropped with drop_last, like torch.utils.data.DistributedSampler
+    does with its samples.
+
+    Attributes:
+        indices (numpy.ndarray): The sorted dataset indices to sample from.
+        batch_size (int): The number of indices per batch.
+        run_length (int): The number of neighbouring indices that stay together.
+        shuffle (bool): Whether to shuffle runs and batches. Unshuffled batches are yielded in index order.
+        drop_last (bool): Whether to drop the last incomplete batch.
+        seed (int or None): Base seed; each epoch uses seed + epoch. None draws fresh entropy every epoch.
+        epoch (int): The current epoch, set through set_epoch.
+        start_batch (int): The number of batches of the epoch to skip, set through set_epoch to resume a
+            seeded epoch where it stopped. Counted in batches of this process.
+        rank (int): The rank of this process.
+        num_replicas (int): The number of processes sharing the epoch.
+    """
+
+    def __init__(self, indices, batch_size, run_length=8, shuffle=True, drop_last=False, seed=None, rank=0,
+                 num_replicas=1):
+        self.indices = np.sort(np.asarray(indices, dtype=np.int64))
+        self.batch_size = batch_size
+        self.run_length = run_length
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+        self.rank = rank
+        self.num_replicas = num_replicas
+
+    def set_epoch(self, epoch, start_batch=0):
+        """
+        Sets the epoch used to derive the shuffle of a seeded sampler.
+
+        Parameters:
+            epoch (int): The epoch number.
+            start_batch (int): The number of batches of the epoch that were already processed.
+        """
+        self.epoch = epoch
+        self.start_batch = start_batch
+
+    def get_order(self, rng):
+        """
+        Returns the shuffled positions into self.indices for one epoch.
+
+        Parameters:
+            rng (numpy.random.Generator): The random generator for the epoch.
+
+        Returns:
+            numpy.ndarray: A permutation of range(len(self.indices)) made of shuffled runs.
+        """
+        positions = np.arange(len(self.indices))
+
+        offset = rng.integers(self.run_length)
+        run_starts = np.unique(np.r_[0, np.arange(offset, len(positions), self.run_length)])
+        run_ids = np.searchsorted(run_starts, positions, side='right') - 1
+        run_ranks = rng.permutation(len(run_starts))
+
+        return np.lexsort((positions, run_ranks[run_ids]))
+
+    def __iter__(self):
+        if self.shuffle:
+            rng = np.random.default_rng(None if self.seed is None else self.seed + self.epoch)
+            order = self.get_order(rng)
+        else:
+            rng = None
+            order = np.arange(len(self.indices))
+
+        batches = []
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            if self.drop_last and len(batch) < self.batch_size:
+                break
+            if rng is not None:
+                batch = rng.permutation(batch)
+            batches.append(batch)
+
+        if self.num_replicas > 1 and batches:
+            total = self.get_epoch_length() * self.num_replicas
+            batches = [batches[i % len(batches)] for i in range(total)][self.rank::self.num_replicas]
+
+        for batch in batches[self.start_batch:]:
+            yield self.indices[batch].tolist()
+
+    def get_epoch_length(self):
+        """
+        Returns the number of batches of a full epoch on this process.
+        """
+        if self.drop_last:
+            return len(self.indices) // self.batch_size // self.num_replicas
+
+        batches = (len(self.indices) + self.batch_size - 1) // self.batch_size
+        return (batches + self.num_replicas - 1) // self.num_replicas
+
+    def __len__(self):
+        return max(self.get_epoch_length() - self.start_batch, 0)
@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+
+from imitation_shared.utils import *
+
+# Split manifest shared by all training runs on a data folder. Whole sessions are assigned to a split, so
+# neighbouring, nearly identical frames never end up on both sides of the split.
+SPLIT_MANIFEST = 'data/splits.npz'
+TRAIN, VALIDATION = 0, 1
+
+
+def assign_sessions(counts, assignment, validation_fraction, rng):
+    """
+    Assigns the unassigned sessions to the training or validation split. Sessions are visited from the largest
+    to the smallest, and a session goes to validation when that brings the per-class sample counts of the
+    validation split closer to validation_fraction of all samples of the class. Assigned sessions keep their
+    split, so adding sessions never moves a sample between splits.
+
+    Parameters:
+        counts (numpy.ndarray): The (sessions, classes) sample count of every class in every session. A single
+            column balances plain sample counts.
+        assignment (numpy.ndarray): The split of every session, -1 for the sessions to assign. Updated in place.
+        validation_fraction (float): The targeted fraction of validation samples of every class.
+        rng (numpy.random.Generator): Breaks ties between sessions of equal size.
+    """
+    target = validation_fraction * counts.sum(axis=0)
+    validation_counts = counts[assignment == VALIDATION].sum(axis=0)
+
+    unassigned = np.flatnonzero(assignment < 0)
+    unassigned = unassigned[rng.permutation(len(unassigned))]
+    unassigned = unassigned[np.argsort(-counts[unassigned].sum(axis=1), kind='stable')]
+
+    for session in unassigned:
+        error_if_train = np.square(validation_counts - target).sum()
+        error_if_validation = np.square(validation_counts + counts[session] - target).sum()
+
+        if error_if_validation < error_if_train:
+            assignment[session] = VALIDATION
+            validation_counts += counts[session]
+        else:
+            assignment[session] = TRAIN
+
+
+def get_split_indices(assignment, file_lengths):
+    """
+    Expands the split of every session to the sample indices of both splits.
+
+    Parameters:
+        assignment (numpy.ndarray): The split of every session, in dataset order.
+        file_lengths (numpy.ndarray): The sample count of every session.
+
+    Returns:
+        tuple: The training and validation sample indices.
+    """
+    sample_assignment = np.repeat(assignment, file_lengths)
+    return np.flatnonzero(sample_assignment == TRAIN), np.flatnonzero(sample_assignment == VALIDATION)
+
+
+def load_split(file_names, file_lengths, commands=None, manifest_path=SPLIT_MANIFEST, validation_fraction=0.2,
+               seed=0):
+    """
+    Returns the training and validation indices of a dataset from the split manifest. Sessions that are not
+    in the manifest yet are assigned and the manifest is rewritten; sessions that no longer exist are dropped
+    from it. The manifest stores the file name, length and split of every session, the indices are derived
+    from them.
+
+    Parameters:
+        file_names (list): The session file names of the dataset, in dataset order.
+        file_lengths (array-like): The sample count of every session of the dataset.
+        commands (numpy.ndarray or None): The command of every sample in dataset order. When given, the split
+            is stratified by command, otherwise by sample count.
+        manifest_path (str): The path of the split manifest.
+        validation_fraction (float): The targeted fraction of validation samples.
+        seed (int): The seed of new manifests.
+
+    Returns:
+        tuple: The training and validation sample indices of the dataset.
+    """
+    file_names = [os.path.basename(f) for f in file_names]
+    file_lengths = np.asarray(file_lengths, dtype=np.int64)
+
+    known = {}
+    try:
+        with np.load(manifest_path) as manifest:
+            known = {name: (length, split) for name, length, split in
+                     zip(manifest['sessions'].tolist(), manifest['lengths'].tolist(), manifest['assignment'].tolist())}
+            validation_fraction, seed = float(manifest['validation_fraction']), int(manifest['seed'])
+    except FileNotFoundError:
+        pass
+
+    # Sessions that are new, or whose length changed because they were re-recorded, are assigned
+    assignment = np.array([known[name][1] if known.get(name, (None,))[0] == length else -1
+                           for name, length in zip(file_names, file_lengths.tolist())], dtype=np.int8)
+    new_sessions = int((assignment < 0).sum())
+
+    if new_sessions > 0 or set(file_names) != set(known):
+        if commands is None:
+            counts = file_lengths[:, None]
+        else:
+            session_ids = np.repeat(np.arange(len(file_names)), file_lengths)
+            counts = np.zeros((len(file_names), int(commands.max(initial=0)) + 1), dtype=np.int64)
+            np.add.at(counts, (session_ids, np.asarray(commands).reshape(-1).astype(np.int64)), 1)
+
+        rng = np.random.default_rng([seed, len(file_names)])
+        assign_sessions(counts, assignment, validation_fraction, rng)
+
+        save_split_manifest(manifest_path, file_names, file_lengths, assignment, validation_fraction, seed)
+        print_formatted(f"Updated the split manifest with {new_sessions} new sessions", GREEN)
+
+    return get_split_indices(assignment, file_lengths)
+
+
+def save_split_manifest(manifest_path, file_names, file_lengths, assignment, validation_fraction, seed):
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, sessions=np.array(file_names), lengths=file_lengths, assignment=assignment,
+                 validation_fraction=validation_fraction, seed=seed)
+    os.replace(temp_path, manifest_path)
@@ -0,0 +1,146 @@
+import os
+import argparse
+import h5py
+import numpy as np
+
+from imitation_shared.utils import *
+
+# Attribute on the images dataset recording the value that represents full intensity.
+# float32 sessions store normalized images (scale 1.0), uint8 sessions store raw 8-bit pixels (scale 255.0).
+IMAGE_SCALE_ATTR = 'scale'
+
+
+def get_image_scale(dtype):
+    """
+    Returns the image scale used for the given storage dtype.
+
+    Parameters:
+        dtype (numpy.dtype): The dtype of the images dataset.
+
+    Returns:
+        float: 255.0 for uint8 images, 1.0 for normalized floating point images.
+    """
+    return 255.0 if np.dtype(dtype) == np.uint8 else 1.0
+
+
+def read_image_scale(dataset):
+    """
+    Reads the image scale recorded on an images dataset. Datasets written before the attribute existed
+    are inferred from their dtype.
+
+    Parameters:
+        dataset (h5py.Dataset): The images dataset.
+
+    Returns:
+        float: The value representing full intensity in the dataset.
+    """
+    return float(dataset.attrs.get(IMAGE_SCALE_ATTR, get_image_scale(dataset.dtype)))
+
+
+def encode_images(images, dtype):
+    """
+    Converts images to the storage dtype. Normalized float images are rounded to 8-bit when storing uint8,
+    uint8 images are normalized when storing floats.
+
+    Parameters:
+        images (numpy.ndarray): The images to encode.
+        dtype (numpy.dtype): The storage dtype.
+
+    Returns:
+        numpy.ndarray: The encoded images.
+    """
+    images = np.asarray(images)
+    dtype = np.dtype(dtype)
+
+    if images.dtype == dtype:
+        return images
+    if dtype == np.uint8:
+        return np.clip(np.rint(images * 255.0), 0, 255).astype(np.uint8)
+    if images.dtype == np.uint8:
+        return images.astype(dtype) / dtype.type(255.0)
+
+    return images.astype(dtype)
+
+
+def decode_images(images, scale):
+    """
+    Converts stored images back to normalized float32 values in [0, 1].
+
+    Parameters:
+        images (numpy.ndarray): The stored images.
+        scale (float): The image scale recorded on the dataset.
+
+    Returns:
+        numpy.ndarray: The normalized float32 images.
+    """
+    images = np.asarray(images, dtype=np.float32)
+
+    if scale != 1.0:
+        images = images / np.float32(scale)
+
+    return images
+
+
+def convert_file_to_uint8(file_path, block_size=256):
+    """
+    Rewrites a session file so that its images are stored as uint8. The file is written to a temporary
+    path next to the original and then renamed over it, so the freed space is reclaimed and an interrupted
+    conversion leaves the original untouched.
+
+    Parameters:
+        file_path (str): The path of the session file to convert.
+        block_size (int): The number of images converted per read.
+
+    Returns:
+        bool: True if the file was converted, False if it already stored uint8 images.
+    """
+    temp_path = file_path + '.tmp'
+
+    with h5py.File(file_path, 'r') as source:
+        if source['images'].dtype == np.uint8:
+            return False
+
+        with h5py.File(temp_path, 'w') as target:
+            for key, value in source.attrs.items():
+                target.attrs[key] = value
+
+            for name, dataset in source.items():
+                if name != 'images':
+                    source.copy(dataset, target, name=name)
+                    continue
+
+                images = target.create_dataset(name, dataset.shape, maxshape=dataset.maxshape, dtype=np.uint8,
+                                               chunks=dataset.chunks)
+                for key, value in dataset.attrs.items():
+                    images.attrs[key] = value
+                images.attrs[IMAGE_SCALE_ATTR] = get_image_scale(np.uint8)
+
+                scale = read_image_scale(dataset)
+                for start in range(0, dataset.shape[0], block_size):
+                    block = decode_images(dataset[start:start + block_size], scale)
+                    images[start:start + block.shape[0]] = encode_images(block, np.uint8)
+
+    os.replace(temp_path, file_path)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts float32 session images to the compact uint8 layout")
+    parser.add_argument('folder', type=str, nargs='?', default='data/training',
+                        help="Folder containing the session .h5 files. Default is data/training.")
+    args = parser.parse_args()
+
+    file_paths = sorted([os.path.join(args.folder, f) for f in os.listdir(args.folder) if f.endswith('.h5')])
+
+    for file_path in file_paths:
+        old_size = os.path.getsize(file_path)
+
+        if convert_file_to_uint8(file_path):
+            new_size = os.path.getsize(file_path)
+            print_formatted(f"Converted {file_path}: {old_size / 2 ** 20:.1f} MB -> {new_size / 2 ** 20:.1f} MB", GREEN)
+        else:
+            print_formatted(f"Skipped {file_path}: images are already uint8", YELLOW)
+
+
+if __name__ == '__main__':
+    main()
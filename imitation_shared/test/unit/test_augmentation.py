@@ -0,0 +1,73 @@
+import unittest
+
+import torch
+
+from imitation_shared.augmentation import BatchAugmentation
+
+
+def make_images():
+    return torch.rand(8, 3, 88, 200, generator=torch.Generator().manual_seed(0))
+
+
+class UnitTestBatchAugmentation(unittest.TestCase):
+    def test_shape_and_range(self):
+        """Test that the augmented batch keeps its shape and stays within [0, 1]."""
+        augmented = BatchAugmentation(seed=0)(make_images())
+
+        self.assertEqual(augmented.shape, (8, 3, 88, 200))
+        self.assertGreaterEqual(augmented.min().item(), 0.0)
+        self.assertLessEqual(augmented.max().item(), 1.0)
+
+    def test_seeded(self):
+        """Test that equal seeds give equal augmentations and that the samples of a batch differ."""
+        images = make_images()
+        first = BatchAugmentation(seed=1)(images)
+        second = BatchAugmentation(seed=1)(images)
+
+        self.assertTrue(torch.equal(first, second))
+        self.assertFalse(torch.equal(first, BatchAugmentation(seed=2)(images)))
+
+        same = torch.ones(2, 3, 88, 200) * 0.5
+        augmented = BatchAugmentation(seed=1)(same)
+        self.assertFalse(torch.equal(augmented[0], augmented[1]))
+
+    def test_state(self):
+        """Test that restoring the generator state repeats the next augmentation."""
+        images = make_images()
+        augmentation = BatchAugmentation(seed=3)
+        state = augmentation.get_state()
+        first = augmentation(images)
+
+        augmentation.set_state(state)
+        self.assertTrue(torch.equal(augmentation(images), first))
+
+    def test_blur_matches_torchvision(self):
+        """Test that the blur of a sample matches the torchvision kernel for the same sigma."""
+        from torchvision.transforms import functional
+
+        images = make_images()
+        augmentation = BatchAugmentation(blur_sigma=(0.7, 0.7), seed=0)
+        expected = torch.stack([functional.gaussian_blur(image, [3, 3], [0.7, 0.7]) for image in images])
+
+        self.assertTrue(torch.allclose(augmentation.gaussian_blur(images), expected, atol=1e-5))
+
+    def test_erasing(self):
+        """Test that erasing zeroes small rectangles in all channels, and nothing when disabled."""
+        images = torch.ones(16, 3, 88, 200)
+        erased = BatchAugmentation(erasing_p=1.0, seed=0).random_erasing(images)
+
+        zeros = (erased == 0).all(dim=1)
+        self.assertTrue(zeros.flatten(1).any(dim=1).all())
+        self.assertLess(zeros.float().mean().item(), 4 * 0.01 + 1e-3)
+        self.assertTrue(torch.equal(BatchAugmentation(erasing_p=0.0, seed=0).random_erasing(images), images))
+
+    def test_channels_last(self):
+        """Test that a channels_last batch stays channels_last."""
+        images = make_images().contiguous(memory_format=torch.channels_last)
+        augmented = BatchAugmentation(seed=0)(images)
+
+        self.assertTrue(augmented.is_contiguous(memory_format=torch.channels_last))
+
+
+if __name__ == '__main__':
+    unittest.main()
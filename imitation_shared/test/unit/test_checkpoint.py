@@ -0,0 +1,115 @@
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from imitation_shared.checkpoint import CheckpointManager, save_atomic, find_latest_run, get_rng_state, \
+    set_rng_state
+
+
+class UnitTestSaveAtomic(unittest.TestCase):
+    def test_no_temporary_file_left(self):
+        """Test that the checkpoint ends up at its destination without a leftover temporary file."""
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, 'state.pth')
+            save_atomic({'step': 3}, file_path)
+
+            self.assertEqual(os.listdir(folder), ['state.pth'])
+            self.assertEqual(torch.load(file_path)['step'], 3)
+
+
+class UnitTestRngState(unittest.TestCase):
+    def test_restore(self):
+        """Test that restoring the generator states repeats the random draws."""
+        state = get_rng_state()
+        draws = (random.random(), np.random.rand(), torch.rand(1).item())
+
+        set_rng_state(state)
+        self.assertEqual((random.random(), np.random.rand(), torch.rand(1).item()), draws)
+
+
+class UnitTestCheckpointManager(unittest.TestCase):
+    def test_round_trip_training_state(self):
+        """Test that a checkpoint with numpy arrays and generator states loads back and restores the draws."""
+        with tempfile.TemporaryDirectory() as folder:
+            manager = CheckpointManager(folder)
+            model = torch.nn.Linear(2, 1)
+            manager.save_latest({'epoch': 1, 'step': 5, 'model': model.state_dict(),
+                                 'running_loss': {'total': 1.5, 'count': 3}, 'training_losses': [0.5],
+                                 'train_indices': np.arange(8, dtype=np.int64), 'validation_indices': np.arange(8, 10),
+                                 'seed': 7, 'rng': get_rng_state()})
+            draws = (random.random(), np.random.rand(), torch.rand(1).item())
+
+            checkpoint = manager.load_latest()
+            set_rng_state(checkpoint['rng'])
+            np.testing.assert_array_equal(checkpoint['train_indices'], np.arange(8))
+            np.testing.assert_array_equal(checkpoint['validation_indices'], np.arange(8, 10))
+            self.assertTrue(torch.equal(checkpoint['model']['weight'], model.weight.detach()))
+            self.assertEqual((random.random(), np.random.rand(), torch.rand(1).item()), draws)
+
+    def test_latest(self):
+        """Test that the latest checkpoint is overwritten and missing checkpoints load as None."""
+        with tempfile.TemporaryDirectory() as folder:
+            manager = CheckpointManager(folder)
+            self.assertIsNone(manager.load_latest())
+
+            manager.save_latest({'epoch': 1})
+            manager.save_latest({'epoch': 2})
+            self.assertEqual(manager.load_latest()['epoch'], 2)
+
+    def test_keeps_best(self):
+        """Test that only the best checkpoints by validation loss are kept on disk and in the index."""
+        with tempfile.TemporaryDirectory() as folder:
+            manager = CheckpointManager(folder, keep_best=2)
+
+            results = [manager.save_best({'epoch': epoch}, epoch, loss)
+                       for epoch, loss in [(1, 0.5), (2, 0.3), (3, 0.4), (4, 0.6)]]
+
+            self.assertEqual(results, [True, True, True, False])
+            self.assertEqual([entry['epoch'] for entry in manager.best()], [2, 3])
+            self.assertEqual(sorted(f for f in os.listdir(folder) if f.startswith('epoch_')),
+                             ['epoch_002.pth', 'epoch_003.pth'])
+
+            # The ranking survives a new manager on the same folder
+            self.assertEqual([entry['epoch'] for entry in CheckpointManager(folder, keep_best=2).best()], [2, 3])
+
+    def test_repeated_epoch_replaces_entry(self):
+        """Test that a repeated epoch replaces its earlier entry instead of being ranked twice."""
+        with tempfile.TemporaryDirectory() as folder:
+            manager = CheckpointManager(folder, keep_best=1)
+            manager.save_best({'epoch': 1}, 1, 0.5)
+            manager.save_best({'epoch': 2}, 2, 0.3)
+
+            self.assertTrue(manager.save_best({'epoch': 2}, 2, 0.2))
+            self.assertFalse(manager.save_best({'epoch': 3}, 3, 0.4))
+            self.assertEqual(manager.best(), [{'file': 'epoch_002.pth', 'epoch': 2, 'validation_loss': 0.2}])
+            self.assertEqual(sorted(f for f in os.listdir(folder) if f.startswith('epoch_')), ['epoch_002.pth'])
+
+    def test_consecutive_runs_are_independent(self):
+        """Test that a new run neither ranks against nor touches the checkpoints of the previous run."""
+        with tempfile.TemporaryDirectory() as runs_folder:
+            first_run = os.path.join(runs_folder, '2024-01-01_10-00-00')
+            second_run = os.path.join(runs_folder, '2024-01-01_11-00-00')
+            self.assertIsNone(find_latest_run(runs_folder))
+
+            first = CheckpointManager(os.path.join(first_run, CheckpointManager.FOLDER), keep_best=2)
+            for epoch, loss in [(1, 0.2), (2, 0.1)]:
+                first.save_latest({'epoch': epoch})
+                first.save_best({'epoch': epoch}, epoch, loss)
+
+            second = CheckpointManager(os.path.join(second_run, CheckpointManager.FOLDER), keep_best=2)
+            second.save_latest({'epoch': 1})
+
+            self.assertTrue(second.save_best({'epoch': 1}, 1, 0.9))
+            self.assertEqual([entry['epoch'] for entry in second.best()], [1])
+            self.assertEqual([entry['epoch'] for entry in first.best()], [2, 1])
+            self.assertEqual(sorted(f for f in os.listdir(first.folder) if f.startswith('epoch_')),
+                             ['epoch_001.pth', 'epoch_002.pth'])
+            self.assertEqual(find_latest_run(runs_folder), second_run)
+
+
+if __name__ == '__main__':
+    unittest.main()
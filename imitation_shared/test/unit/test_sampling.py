@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from imitation_shared.sampling import read_rows, ContiguousBatchSampler
+
+
+class UnitTestReadRows(unittest.TestCase):
+    def test_read_rows_matches_fancy_indexing(self):
+        """Test that rows come back in the requested order, including repeats and gaps."""
+        data = np.arange(100 * 2).reshape(100, 2)
+        rows = np.array([42, 3, 4, 5, 99, 4, 60, 61, 70])
+
+        with tempfile.TemporaryDirectory() as folder:
+            with h5py.File(os.path.join(folder, 'rows.h5'), 'w') as file:
+                dataset = file.create_dataset('data', data=data)
+                np.testing.assert_array_equal(read_rows(dataset, rows), data[rows])
+                np.testing.assert_array_equal(read_rows(dataset, rows, max_gap=0), data[rows])
+                self.assertEqual(read_rows(dataset, []).shape, (0, 2))
+
+
+class UnitTestContiguousBatchSampler(unittest.TestCase):
+    def test_every_index_once(self):
+        """Test that a shuffled epoch visits every index exactly once."""
+        indices = np.random.default_rng(0).choice(1000, 500, replace=False)
+        sampler = ContiguousBatchSampler(indices, batch_size=32, run_length=8, seed=0)
+
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        self.assertTrue(all(len(batch) == 32 for batch in batches[:-1]))
+        self.assertEqual(sorted(sum(batches, [])), sorted(indices.tolist()))
+
+    def test_batches_are_made_of_runs(self):
+        """Test that a batch only touches a few contiguous runs of rows."""
+        sampler = ContiguousBatchSampler(range(10000), batch_size=64, run_length=16, seed=0)
+
+        for batch in sampler:
+            runs = np.count_nonzero(np.diff(np.sort(batch)) != 1) + 1
+            self.assertLessEqual(runs, 64 // 16 + 1)
+
+    def test_seeded_epochs(self):
+        """Test that a seeded sampler repeats an epoch and changes between epochs."""
+        sampler = ContiguousBatchSampler(range(256), batch_size=32, seed=3)
+        first = list(sampler)
+        self.assertEqual(first, list(sampler))
+
+        sampler.set_epoch(1)
+        self.assertNotEqual(first, list(sampler))
+
+    def test_resume_mid_epoch(self):
+        """Test that starting an epoch at a batch yields the remaining batches of the uninterrupted epoch."""
+        sampler = ContiguousBatchSampler(range(300), batch_size=32, seed=3)
+        sampler.set_epoch(2)
+        full = list(sampler)
+
+        sampler.set_epoch(2, start_batch=4)
+        self.assertEqual(list(sampler), full[4:])
+        self.assertEqual(len(sampler), len(full) - 4)
+        self.assertEqual(sampler.get_epoch_length(), len(full))
+
+    def test_shards(self):
+        """Test that the processes of a distributed run split the epoch into equal, padded shares."""
+        samplers = [ContiguousBatchSampler(range(300), batch_size=32, seed=3, rank=rank, num_replicas=4)
+                    for rank in range(4)]
+        full = list(ContiguousBatchSampler(range(300), batch_size=32, seed=3))
+
+        shards = [list(sampler) for sampler in samplers]
+        self.assertTrue(all(len(shard) == len(sampler) == 3 for shard, sampler in zip(shards, samplers)))
+        self.assertEqual(sorted(sum(sum(shards, []), [])), sorted(sum(full + full[:2], [])))
+
+        samplers[1].set_epoch(0, start_batch=1)
+        self.assertEqual(list(samplers[1]), shards[1][1:])
+
+        sampler = ContiguousBatchSampler(range(300), batch_size=32, drop_last=True, rank=3, num_replicas=4)
+        self.assertEqual(len(list(sampler)), 2)
+        self.assertEqual(len(sampler), 2)
+
+    def test_unshuffled_drop_last(self):
+        """Test that an unshuffled sampler yields indices in order and drops the incomplete batch."""
+        sampler = ContiguousBatchSampler([5, 1, 3, 2, 4], batch_size=2, shuffle=False, drop_last=True)
+        self.assertEqual(list(sampler), [[1, 2], [3, 4]])
+        self.assertEqual(len(sampler), 2)
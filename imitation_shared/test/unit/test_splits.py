@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from imitation_shared.splits import load_split, assign_sessions, TRAIN, VALIDATION
+
+
+class UnitTestAssignSessions(unittest.TestCase):
+    def test_stratified(self):
+        """Test that the validation split gets close to the targeted share of every class."""
+        rng = np.random.default_rng(0)
+        counts = rng.integers(0, 100, (40, 3))
+        assignment = np.full(40, -1, dtype=np.int8)
+
+        assign_sessions(counts, assignment, 0.2, np.random.default_rng(0))
+
+        self.assertTrue(np.isin(assignment, [TRAIN, VALIDATION]).all())
+        share = counts[assignment == VALIDATION].sum(axis=0) / counts.sum(axis=0)
+        np.testing.assert_allclose(share, 0.2, atol=0.03)
+
+
+class UnitTestLoadSplit(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.manifest_path = os.path.join(self.folder.name, 'splits.npz')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_sessions_stay_together(self):
+        """Test that every session lands in exactly one split and the indices cover the dataset once."""
+        lengths = [30, 50, 20, 40, 60, 10, 25, 35]
+        names = [f"session_{i}.h5" for i in range(len(lengths))]
+
+        train, validation = load_split(names, lengths, manifest_path=self.manifest_path)
+
+        self.assertEqual(sorted(np.r_[train, validation].tolist()), list(range(sum(lengths))))
+        session_ids = np.repeat(np.arange(len(lengths)), lengths)
+        self.assertFalse(set(session_ids[train]) & set(session_ids[validation]))
+        self.assertGreater(len(validation), 0)
+
+    def test_incremental(self):
+        """Test that adding and removing sessions keeps the split of the other sessions."""
+        lengths = [30, 50, 20, 40, 60, 10]
+        names = [f"session_{i}.h5" for i in range(len(lengths))]
+        train, validation = load_split(names, lengths, manifest_path=self.manifest_path)
+        validation_sessions = set(np.repeat(names, lengths)[validation])
+
+        # A new session sorted in between, and the first session removed
+        new_names = names[1:3] + ["session_2b.h5"] + names[3:]
+        new_lengths = lengths[1:3] + [45] + lengths[3:]
+        train, validation = load_split(new_names, new_lengths, manifest_path=self.manifest_path)
+
+        new_validation_sessions = set(np.repeat(new_names, new_lengths)[validation])
+        self.assertEqual(new_validation_sessions - {"session_2b.h5"}, validation_sessions - {"session_0.h5"})
+
+        with np.load(self.manifest_path) as manifest:
+            self.assertEqual(manifest['sessions'].tolist(), new_names)
+            self.assertEqual(sorted(manifest.files), ['assignment', 'lengths', 'seed', 'sessions',
+                                                      'validation_fraction'])
+
+    def test_shared_across_orders(self):
+        """Test that a dataset listing the sessions in another order gets the same sessions per split."""
+        lengths = [30, 50, 20, 40, 60, 10]
+        names = [f"session_{i}.h5" for i in range(len(lengths))]
+        commands = np.random.default_rng(0).integers(0, 3, sum(lengths))
+        _, validation = load_split(names, lengths, commands, manifest_path=self.manifest_path)
+
+        order = [3, 0, 5, 1, 4, 2]
+        _, reordered = load_split([names[i] for i in order], [lengths[i] for i in order],
+                                  manifest_path=self.manifest_path)
+
+        self.assertEqual(set(np.repeat(names, lengths)[validation]),
+                         set(np.repeat([names[i] for i in order], [lengths[i] for i in order])[reordered]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+import imitation_shared.storage as storage
+
+
+class UnitTestStorage(unittest.TestCase):
+    def test_encode_decode_uint8(self):
+        """Test that 8-bit images survive a round trip through the uint8 layout."""
+        pixels = np.random.randint(0, 256, (4, 8, 8, 3))
+        images = (pixels / 255.0).astype(np.float32)
+
+        encoded = storage.encode_images(images, np.uint8)
+        self.assertEqual(encoded.dtype, np.uint8)
+        np.testing.assert_array_equal(encoded, pixels)
+
+        decoded = storage.decode_images(encoded, storage.get_image_scale(np.uint8))
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_allclose(decoded, images, atol=1e-7)
+
+    def test_read_image_scale_infers_legacy_files(self):
+        """Test that files written without the scale attribute are inferred from their dtype."""
+        with tempfile.TemporaryDirectory() as folder:
+            with h5py.File(os.path.join(folder, 'legacy.h5'), 'w') as file:
+                file.create_dataset('images', (0, 8, 8, 3), dtype=np.float32)
+                self.assertEqual(storage.read_image_scale(file['images']), 1.0)
+
+    def test_convert_file_to_uint8(self):
+        """Test converting a float32 session file in place."""
+        images = (np.random.randint(0, 256, (5, 8, 8, 3)) / 255.0).astype(np.float32)
+        scalars = np.random.rand(5, 1).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, 'session.h5')
+            with h5py.File(file_path, 'w') as file:
+                file.create_dataset('images', data=images)
+                file.create_dataset('scalars', data=scalars)
+                file.attrs['length'] = 5
+
+            self.assertTrue(storage.convert_file_to_uint8(file_path, block_size=2))
+            self.assertFalse(storage.convert_file_to_uint8(file_path))
+
+            with h5py.File(file_path, 'r') as file:
+                self.assertEqual(file['images'].dtype, np.uint8)
+                self.assertEqual(file.attrs['length'], 5)
+                np.testing.assert_array_equal(file['scalars'][:], scalars)
+
+                decoded = storage.decode_images(file['images'][:], storage.read_image_scale(file['images']))
+                np.testing.assert_allclose(decoded, images, atol=1e-7)
@@ -0,0 +1,168 @@
+import argparse
+import unittest
+from unittest import mock
+
+import torch
+import torch.nn as nn
+
+from imitation_shared.training import TrainingEngine, ThroughputMeter, LossAccumulator, AsyncScalarWriter, \
+    StepTimer, add_training_args
+
+
+class TinyModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = nn.Conv2d(3, 4, 3)
+        self.fc = nn.Linear(4 + 1, 3)
+
+    def forward(self, x_img, scalar):
+        x_img = self.conv(x_img).mean(dim=(2, 3))
+        return self.fc(torch.cat([x_img, scalar], dim=1))
+
+
+def make_engine(**kwargs):
+    torch.manual_seed(0)
+    model = TinyModel()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    return TrainingEngine(model, optimizer, nn.MSELoss(), torch.device('cpu'), **kwargs)
+
+
+def make_batch():
+    generator = torch.Generator().manual_seed(0)
+    return [torch.rand(8, 3, 8, 8, generator=generator), torch.rand(8, 1, generator=generator),
+            torch.rand(8, 3, generator=generator)]
+
+
+class UnitTestTrainingArgs(unittest.TestCase):
+    def test_defaults(self):
+        """Test that the shared options default to fp32 eager training."""
+        parser = argparse.ArgumentParser()
+        add_training_args(parser, epochs=7, batch_size=64)
+        args = parser.parse_args([])
+
+        self.assertEqual((args.epochs, args.batch_size), (7, 64))
+        self.assertFalse(args.bf16 or args.channels_last or args.compile or args.step_timing)
+        self.assertEqual(args.log_interval, 50)
+
+    def test_flags(self):
+        """Test that the engine picks up the options from the command line."""
+        parser = argparse.ArgumentParser()
+        add_training_args(parser, epochs=1, batch_size=1)
+        args = parser.parse_args(['--bf16', '--channels-last'])
+
+        model = TinyModel()
+        engine = TrainingEngine.from_args(model, torch.optim.SGD(model.parameters(), lr=0.1), nn.MSELoss(),
+                                          torch.device('cpu'), args)
+        self.assertTrue(engine.bf16 and engine.channels_last)
+        self.assertIs(engine.forward_model, engine.model)
+
+
+class UnitTestTrainingEngine(unittest.TestCase):
+    def test_train_step_reduces_loss(self):
+        """Test that repeated steps on the same batch reduce its loss."""
+        engine = make_engine()
+        images, scalars, targets = engine.move_batch(make_batch())
+
+        first = engine.train_step((images, scalars), targets)
+        for _ in range(20):
+            last = engine.train_step((images, scalars), targets)
+
+        self.assertFalse(first.requires_grad)
+        self.assertLess(last.item(), first.item())
+
+    def test_channels_last_batch(self):
+        """Test that the image batch is moved to channels_last without changing its values."""
+        engine = make_engine(channels_last=True)
+        batch = make_batch()
+        images, scalars, targets = engine.move_batch(batch)
+
+        self.assertTrue(images.is_contiguous(memory_format=torch.channels_last))
+        self.assertTrue(torch.equal(images, batch[0]))
+        self.assertTrue(engine.model.conv.weight.is_contiguous(memory_format=torch.channels_last))
+
+    def test_bf16_matches_fp32(self):
+        """Test that the bf16 loss is float32 and close to the fp32 loss."""
+        images, scalars, targets = make_batch()
+
+        fp32_loss = make_engine().eval_step((images, scalars), targets)
+        bf16_loss = make_engine(bf16=True).eval_step((images, scalars), targets)
+
+        self.assertEqual(bf16_loss.dtype, torch.float32)
+        self.assertAlmostEqual(bf16_loss.item(), fp32_loss.item(), delta=0.05 * fp32_loss.item())
+
+
+class UnitTestThroughputMeter(unittest.TestCase):
+    def test_counts_samples(self):
+        """Test that the meter accumulates the processed samples."""
+        meter = ThroughputMeter()
+        meter.update(32)
+        meter.update(16)
+
+        self.assertEqual(meter.samples, 48)
+        self.assertGreater(meter.samples_per_second(), 0.0)
+
+
+class UnitTestLossAccumulator(unittest.TestCase):
+    def test_epoch_and_interval_means(self):
+        """Test that the interval mean restarts after each read while the epoch mean covers every loss."""
+        accumulator = LossAccumulator(torch.device('cpu'))
+        for loss in [1.0, 2.0, 3.0]:
+            accumulator.update(torch.tensor(loss))
+
+        interval = accumulator.interval_mean()
+        accumulator.update(torch.tensor(6.0))
+
+        self.assertAlmostEqual(interval.item(), 2.0)
+        self.assertAlmostEqual(accumulator.interval_mean().item(), 6.0)
+        self.assertAlmostEqual(interval.item(), 2.0)
+        self.assertAlmostEqual(accumulator.mean(), 3.0)
+
+
+class UnitTestAsyncScalarWriter(unittest.TestCase):
+    def test_writes_in_order_on_close(self):
+        """Test that queued scalars reach the wrapped writer as floats before it is closed."""
+        writer = mock.Mock()
+        async_writer = AsyncScalarWriter(writer)
+
+        async_writer.add_scalar('Loss/Train', torch.tensor(0.5), 1)
+        async_writer.add_scalars('Loss/TrainValidation', {'Train': torch.tensor(0.25), 'Validation': 0.75}, 2)
+        async_writer.close()
+
+        writer.add_scalar.assert_called_once_with('Loss/Train', 0.5, 1)
+        writer.add_scalars.assert_called_once_with('Loss/TrainValidation', {'Train': 0.25, 'Validation': 0.75}, 2)
+        writer.close.assert_called_once()
+
+
+class UnitTestStepTimer(unittest.TestCase):
+    def test_phases(self):
+        """Test that the marks charge time to their phase and count steps."""
+        timer = StepTimer(torch.device('cpu'), enabled=True)
+        timer.start()
+        for _ in range(2):
+            for phase in StepTimer.PHASES:
+                timer.mark(phase)
+
+        self.assertEqual(timer.steps, 2)
+        self.assertEqual(set(timer.summary()), set(StepTimer.PHASES))
+
+    def test_disabled(self):
+        """Test that a disabled timer records nothing."""
+        timer = StepTimer(torch.device('cpu'))
+        timer.mark('optimizer')
+
+        self.assertEqual(timer.steps, 0)
+
+    def test_engine_marks_step_phases(self):
+        """Test that a training step marks the forward, backward and optimizer phases."""
+        engine = make_engine(step_timing=True)
+        images, scalars, targets = make_batch()
+
+        engine.timer.start()
+        engine.train_step((images, scalars), targets)
+
+        self.assertEqual(engine.timer.steps, 1)
+        self.assertGreater(engine.timer.totals['forward'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,370 @@
+import time
+import queue
+import threading
+import contextlib
+
+import torch
+from torch.nn.parallel import DistributedDataParallel
+
+from imitation_shared.distributed import is_distributed, all_reduce_sum
+
+
+def add_training_args(parser, epochs, batch_size):
+    """
+    Adds the options shared by the training scripts to an argument parser.
+
+    Parameters:
+        parser (argparse.ArgumentParser): The parser of the training script.
+        epochs (int): The default number of epochs.
+        batch_size (int): The default batch size.
+    """
+    parser.add_argument('--epochs', type=int, default=epochs, help=f"Number of epochs. Default is {epochs}.")
+    parser.add_argument('--batch-size', type=int, default=batch_size,
+                        help=f"Batch size. Default is {batch_size}.")
+    parser.add_argument('--bf16', action='store_true',
+                        help="Run the forward pass under bfloat16 autocast. The weights stay in float32.")
+    parser.add_argument('--channels-last', action='store_true',
+                        help="Keep the model and the image batches in the channels_last memory format.")
+    parser.add_argument('--compile', action='store_true', help="Compile the model with torch.compile.")
+    parser.add_argument('--log-interval', type=int, default=50,
+                        help="Number of training steps between loss logs. Default is 50.")
+    parser.add_argument('--step-timing', action='store_true',
+                        help="Report where the step time goes. Synchronizes the device between step phases.")
+
+
+class TrainingEngine:
+    """
+    Runs the training and validation steps of a model with the precision, memory format and compilation options
+    selected on the command line.
+
+    The engine keeps the original module in model and runs the steps through forward_model, which adds the
+    DistributedDataParallel wrapper in a distributed run and the torch.compile wrapper when compilation is
+    enabled. All of them share their parameters, so the optimizer and save_model keep working on model and the
+    saved state dictionary has the usual keys.
+
+    Attributes:
+        model (torch.nn.Module): The model being trained.
+        forward_model (torch.nn.Module): The module the steps run through.
+        optimizer (torch.optim.Optimizer): The optimizer of the model parameters.
+        criterion (torch.nn.Module): The loss function.
+        device (torch.device): The device the model and batches live on.
+        bf16 (bool): Whether the forward pass runs under bfloat16 autocast.
+        channels_last (bool): Whether the model and image batches use the channels_last memory format.
+        timer (StepTimer): Times the forward, backward and optimizer phases of the training steps.
+    """
+
+    def __init__(self, model, optimizer, criterion, device, bf16=False, channels_last=False, compile=False,
+                 step_timing=False, distributed=False):
+        self.model = model.to(device)
+        self.optimizer = optimizer
+        self.criterion = criterion
+        self.device = device
+        self.bf16 = bf16
+        self.channels_last = channels_last
+        self.timer = StepTimer(device, enabled=step_timing)
+
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+
+        self.forward_model = self.model
+        if distributed:
+            self.forward_model = DistributedDataParallel(self.forward_model)
+        if compile:
+            self.forward_model = torch.compile(self.forward_model)
+
+    @classmethod
+    def from_args(cls, model, optimizer, criterion, device, args):
+        return cls(model, optimizer, criterion, device, bf16=args.bf16, channels_last=args.channels_last,
+                   compile=args.compile, step_timing=args.step_timing, distributed=is_distributed())
+
+    def autocast(self):
+        """
+        Returns the autocast context of the forward pass, or a no-op context when bf16 is disabled.
+        """
+        if not self.bf16:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+
+    def move_batch(self, batch):
+        """
+        Moves a batch to the device. The first tensor of a batch is the image batch, which is converted to
+        channels_last when that memory format is enabled.
+
+        Parameters:
+            batch (list): The tensors yielded by the dataloader.
+
+        Returns:
+            list: The tensors on the device.
+        """
+        batch = [tensor.to(self.device, non_blocking=True) for tensor in batch]
+
+        if self.channels_last:
+            batch[0] = batch[0].contiguous(memory_format=torch.channels_last)
+
+        return batch
+
+    def compute_loss(self, inputs, targets):
+        with self.autocast():
+            outputs = self.forward_model(*inputs)
+
+        # The loss is always computed in float32 so that bf16 runs report comparable values.
+        return self.criterion(outputs.float(), targets)
+
+    def train_step(self, inputs, targets):
+        """
+        Runs one optimization step.
+
+        Parameters:
+            inputs (list): The model inputs.
+            targets (torch.Tensor): The targets of the batch.
+
+        Returns:
+            torch.Tensor: The loss of the batch.
+        """
+        self.optimizer.zero_grad(set_to_none=True)
+
+        loss = self.compute_loss(inputs, targets)
+        self.timer.mark('forward')
+        loss.backward()
+        self.timer.mark('backward')
+        self.optimizer.step()
+        self.timer.mark('optimizer')
+
+        return loss.detach()
+
+    def eval_step(self, inputs, targets):
+        """
+        Computes the loss of a batch without tracking gradients.
+
+        Parameters:
+            inputs (list): The model inputs.
+            targets (torch.Tensor): The targets of the batch.
+
+        Returns:
+            torch.Tensor: The loss of the batch.
+        """
+        with torch.no_grad():
+            return self.compute_loss(inputs, targets)
+
+    def train(self):
+        self.model.train()
+
+    def eval(self):
+        self.model.eval()
+
+
+class ThroughputMeter:
+    """
+    Measures the number of samples processed per second over an epoch.
+    """
+
+    def __init__(self):
+        self.samples = 0
+        self.start_time = time.perf_counter()
+
+    def update(self, batch_size):
+        self.samples += batch_size
+
+    def samples_per_second(self):
+        elapsed = time.perf_counter() - self.start_time
+        return self.samples / elapsed if elapsed > 0 else 0.0
+
+
+class LossAccumulator:
+    """
+    Sums batch losses on their device so that the training loop never waits for a loss value. The values are
+    only read back when they are logged.
+
+    Attributes:
+        total (torch.Tensor): The sum of the losses of the epoch.
+        count (int): The number of losses of the epoch.
+        interval_total (torch.Tensor): The sum of the losses since the last interval_mean call.
+        interval_count (int): The number of losses since the last interval_mean call.
+    """
+
+    def __init__(self, device):
+        self.total = torch.zeros((), device=device)
+        self.count = 0
+        self.interval_total = torch.zeros((), device=device)
+        self.interval_count = 0
+
+    def update(self, loss):
+        self.total += loss
+        self.count += 1
+        self.interval_total += loss
+        self.interval_count += 1
+
+    def state_dict(self):
+        return {'total': self.total.item(), 'count': self.count}
+
+    def load_state_dict(self, state):
+        self.total.fill_(state['total'])
+        self.count = state['count']
+
+    def synchronize(self):
+        """
+        Sums the epoch losses of all processes of a distributed run, so that mean returns the global mean.
+        """
+        if not is_distributed():
+            return
+
+        totals = torch.stack([self.total, torch.tensor(float(self.count), device=self.total.device)])
+        all_reduce_sum(totals)
+        self.total = totals[0]
+        self.count = int(totals[1].item())
+
+    def interval_mean(self):
+        """
+        Returns the mean loss since the previous call and starts a new interval. The mean is returned as a
+        tensor that is not touched again, so it can be read on another thread without synchronizing here.
+
+        Returns:
+            torch.Tensor: The mean loss of the interval.
+        """
+        mean = self.interval_total / max(self.interval_count, 1)
+        self.interval_total = torch.zeros_like(self.interval_total)
+        self.interval_count = 0
+        return mean
+
+    def mean(self):
+        """
+        Returns the mean loss of the epoch. This reads the value back from the device.
+
+        Returns:
+            float: The mean loss.
+        """
+        return self.total.item() / max(self.count, 1)
+
+
+class AsyncScalarWriter:
+    """
+    Writes TensorBoard scalars on a background thread. Tensor values are converted to floats on that thread,
+    so logging a loss that still lives on the device does not block the training loop.
+
+    Attributes:
+        writer (torch.utils.tensorboard.SummaryWriter): The wrapped writer. Calls other than the scalar methods,
+            e.g. add_graph, go to it directly and should be made before the first scalar is logged.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add_scalar(self, tag, value, step):
+        self._queue.put((self.writer.add_scalar, tag, value, step))
+
+    def add_scalars(self, main_tag, values, step):
+        self._queue.put((self.writer.add_scalars, main_tag, values, step))
+
+    def close(self):
+        """
+        Writes the queued scalars and closes the wrapped writer.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            method, tag, value, step = item
+            if isinstance(value, dict):
+                value = {key: to_float(val) for key, val in value.items()}
+            else:
+                value = to_float(value)
+            method(tag, value, step)
+
+
+class NullScalarWriter:
+    """
+    Stands in for AsyncScalarWriter on the processes of a distributed run that do not log.
+    """
+
+    writer = None
+
+    def add_scalar(self, tag, value, step):
+        pass
+
+    def add_scalars(self, main_tag, values, step):
+        pass
+
+    def close(self):
+        pass
+
+
+def to_float(value):
+    return value.item() if isinstance(value, torch.Tensor) else float(value)
+
+
+class StepTimer:
+    """
+    Breaks the training step time down into its phases. The training loop marks the end of each phase and the
+    time since the previous mark is added to that phase. Disabled timers do nothing, enabled timers synchronize
+    the device at each mark so that asynchronous kernels are charged to the phase that launched them.
+
+    Attributes:
+        device (torch.device): The device to synchronize.
+        enabled (bool): Whether the timer records anything.
+        totals (dict): The accumulated seconds of every phase that was marked.
+        steps (int): The number of completed steps, counted at each 'optimizer' mark.
+    """
+
+    PHASES = ('data', 'h2d', 'augmentation', 'forward', 'backward', 'optimizer')
+
+    def __init__(self, device, enabled=False):
+        self.device = device
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.totals = {}
+        self.steps = 0
+        self.last = time.perf_counter()
+
+    def synchronize(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def start(self):
+        """
+        Restarts the clock, e.g. right before the first batch of an epoch is requested.
+        """
+        if self.enabled:
+            self.synchronize()
+            self.last = time.perf_counter()
+
+    def mark(self, phase):
+        """
+        Ends a phase of the current step.
+
+        Parameters:
+            phase (str): One of PHASES.
+        """
+        if not self.enabled:
+            return
+
+        self.synchronize()
+        now = time.perf_counter()
+        self.totals[phase] = self.totals.get(phase, 0.0) + now - self.last
+        self.last = now
+
+        if phase == 'optimizer':
+            self.steps += 1
+
+    def summary(self):
+        """
+        Returns the mean time per step of every phase the training loop marks.
+
+        Returns:
+            dict: The milliseconds per step of each phase, in the order of PHASES.
+        """
+        return {phase: self.totals[phase] / max(self.steps, 1) * 1000.0 for phase in self.PHASES
+                if phase in self.totals}
+
+    def format_summary(self):
+        return " - ".join(f"{phase}: {ms:.1f} ms" for phase, ms in self.summary().items())